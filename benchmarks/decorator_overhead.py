@@ -0,0 +1,156 @@
+"""per request overhead of sage_cache decorators on cache hits
+overhead is the time of a decorated view minus the time of the same undecorated view
+
+usage:
+    python benchmarks/decorator_overhead.py [--requests 5000] [--redis redis://localhost:6379]
+
+without --redis an in-process fakeredis server is used (pip install fakeredis)
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def setup_django(redis_url=None, **extra_settings):
+    import django
+    from django.conf import settings
+
+    options = {}
+    if redis_url is None:
+        import fakeredis
+
+        options = {
+            'CONNECTION_POOL_KWARGS': {
+                'connection_class': fakeredis.FakeConnection,
+                'server': fakeredis.FakeServer(),
+            }
+        }
+
+    settings.configure(
+        SECRET_KEY='benchmark',
+        ALLOWED_HOSTS=['*'],
+        INSTALLED_APPS=[
+            'django.contrib.contenttypes',
+            'django.contrib.auth',
+            'rest_framework',
+            'sage_cache',
+        ],
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+        CACHES={
+            'default': {
+                'BACKEND': 'django_redis.cache.RedisCache',
+                'LOCATION': redis_url or 'redis://localhost:6379',
+                'OPTIONS': options,
+            }
+        },
+        CACHE_TIMEOUT=3600,
+        **extra_settings
+    )
+    django.setup()
+
+
+def make_views():
+    from django.contrib.auth.models import Group
+    from rest_framework.response import Response
+    from rest_framework.viewsets import ViewSet
+
+    from sage_cache.decorators.cache_page import cache_page_per_site, cache_page_per_user
+    from sage_cache.decorators.cache_queryset import cache_queryset_per_site
+    from sage_cache.mixins.model_cache import ModelCacheMixin
+
+    class CachedGroup(Group, ModelCacheMixin):
+        CACHE_KEY = 'benchmark_group'
+
+        class Meta:
+            proxy = True
+            app_label = 'sage_cache'
+
+    # cached querysets are pickled, model must be importable from module
+    CachedGroup.__qualname__ = 'CachedGroup'
+    globals()['CachedGroup'] = CachedGroup
+
+    class PlainView(ViewSet):
+        model_class = CachedGroup
+
+        def list(self, request):
+            return Response({'ok': True})
+
+    class PageSiteView(PlainView):
+        @cache_page_per_site()
+        def list(self, request):
+            return Response({'ok': True})
+
+    class PageUserView(PlainView):
+        @cache_page_per_user()
+        def list(self, request):
+            return Response({'ok': True})
+
+    class QuerysetSiteView(PlainView):
+        @cache_queryset_per_site()
+        def list(self, request):
+            return Response({'ok': True})
+
+    return {
+        'plain': PlainView,
+        'cache_page_per_site': PageSiteView,
+        'cache_page_per_user': PageUserView,
+        'cache_queryset_per_site': QuerysetSiteView,
+    }
+
+
+def measure(view_class, requests):
+    """seconds per request through DRF dispatch (cache hits after first request)"""
+    import warnings
+
+    from rest_framework.test import APIRequestFactory
+
+    view = view_class.as_view({'get': 'list'})
+    factory = APIRequestFactory()
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        view(factory.get('/benchmark/')).render()  # warm cache
+        started = time.perf_counter()
+        for _ in range(requests):
+            view(factory.get('/benchmark/')).render()
+        return (time.perf_counter() - started) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--redis', default=None)
+    parser.add_argument('--json', action='store_true', help='print results as json')
+    args = parser.parse_args()
+
+    setup_django(args.redis)
+    from django.core.management import call_command
+
+    call_command('migrate', verbosity=0)
+    views = make_views()
+
+    results = {name: measure(view_class, args.requests) for name, view_class in views.items()}
+    plain = results['plain']
+    report = {
+        name: {
+            'us_per_request': round(seconds * 1e6, 2),
+            'overhead_us': round((seconds - plain) * 1e6, 2),
+        }
+        for name, seconds in results.items()
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for name, row in report.items():
+        print('{:<26} {:>10.2f} us/request {:>10.2f} us overhead'.format(
+            name, row['us_per_request'], row['overhead_us']
+        ))
+
+
+if __name__ == '__main__':
+    main()
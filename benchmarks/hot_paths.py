@@ -0,0 +1,309 @@
+"""latency of sage_cache hot paths on synthetic models (1k to 1M rows)
+every case reports throughput, p50/p99 latency, peak RSS of the process and bytes stored in redis
+
+usage:
+    python benchmarks/hot_paths.py [--rows 1000 10000] [--iterations 50] [--storage rows]
+                                   [--redis redis://localhost:6379] [--output results.json]
+    python benchmarks/hot_paths.py --compare results.json  # fails if a case got slower than --threshold
+
+without --redis an in-process fakeredis server is used (pip install fakeredis)
+data is generated with a fixed seed, results of the same options are comparable between releases
+"""
+import argparse
+import json
+import platform
+import random
+import resource
+import sys
+import time
+import warnings
+
+from decorator_overhead import setup_django
+
+WORDS = ['red', 'blue', 'green', 'black', 'phone', 'case', 'laptop', 'stand', 'usb', 'cable', 'mini', 'pro']
+CATEGORIES = 100
+USERS = 200
+BATCH_SIZE = 10000
+
+
+def make_models():
+    from django.db import connection, models
+
+    from sage_cache.mixins.model_cache import ModelCacheMixin
+
+    class BenchCategory(models.Model, ModelCacheMixin):
+        CACHE_KEY = 'bench_category'
+        title = models.CharField(max_length=64)
+
+        class Meta:
+            app_label = 'sage_cache'
+
+    class BenchProduct(models.Model, ModelCacheMixin):
+        CACHE_KEY = 'bench_product'
+        CACHED_RELATED_OBJECT = ['category']
+        CACHE_INDEXED_FIELDS = ['category']
+        CACHE_SEARCH_FIELDS = ['title']
+        title = models.CharField(max_length=128)
+        price = models.IntegerField()
+        category = models.ForeignKey(BenchCategory, on_delete=models.CASCADE)
+
+        class Meta:
+            app_label = 'sage_cache'
+
+    # cached querysets are pickled, models must be importable from module
+    for model_class in (BenchCategory, BenchProduct):
+        model_class.__qualname__ = model_class.__name__
+        globals()[model_class.__name__] = model_class
+
+    with connection.schema_editor() as editor:
+        editor.create_model(BenchCategory)
+        editor.create_model(BenchProduct)
+    return BenchCategory, BenchProduct
+
+
+def make_views(model_class):
+    from rest_framework.response import Response
+    from rest_framework.viewsets import ViewSet
+
+    from sage_cache.decorators.cache_page import cache_page_per_user
+
+    class PageUserView(ViewSet):
+        model_class = None
+
+        @cache_page_per_user()
+        def list(self, request):
+            return Response({'ok': True})
+
+    class FilterView:
+        filterset_fields = ['category', 'price']
+        search_fields = ['title']
+
+    PageUserView.model_class = FilterView.model_class = model_class
+    return PageUserView, FilterView
+
+
+def seed(category_class, product_class, rows):
+    """(re)create rows products with a fixed seed"""
+    rng = random.Random(rows)
+    product_class.objects.all().delete()
+    category_class.objects.all().delete()
+    category_class.objects.bulk_create([category_class(id=i + 1, title=f'c{i}') for i in range(CATEGORIES)])
+    for start in range(0, rows, BATCH_SIZE):
+        product_class.objects.bulk_create([
+            product_class(
+                id=i + 1,
+                title=' '.join(rng.sample(WORDS, 3)),
+                price=rng.randrange(10000),
+                category_id=rng.randrange(CATEGORIES) + 1,
+            )
+            for i in range(start, min(start + BATCH_SIZE, rows))
+        ])
+
+
+def get_redis_bytes():
+    """bytes of string values stored in redis (same on fakeredis and redis)"""
+    from sage_cache.services.key_funcs import get_redis_client
+
+    client = get_redis_client()
+    keys = [key for key in client.scan_iter(count=1000) if client.type(key) in (b'string', 'string')]
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.strlen(key)
+    return sum(pipe.execute()) if keys else 0
+
+
+def get_peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on linux
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def measure(func, iterations, before=None):
+    """seconds of each call of func, before() runs untimed before every call"""
+    samples = []
+    for _ in range(iterations):
+        if before is not None:
+            before()
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def make_cases(category_class, product_class, user_class):
+    from django.core.cache import cache
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory, force_authenticate
+
+    from sage_cache.filters.backend import CacheFilterBackend, CacheSearchBackend
+    from sage_cache.services.cache_funcs import (
+        clear_cache_for_model,
+        clear_cache_for_users,
+        filter_from_cache,
+        filter_related_from_cache,
+        get_all_from_cache,
+    )
+    from sage_cache.services.key_funcs import make_site_key, make_user_key, register_key
+
+    page_view_class, filter_view_class = make_views(product_class)
+    factory = APIRequestFactory()
+    users = list(user_class.objects.all())
+    page_view = page_view_class.as_view({'get': 'list'})
+
+    def get_all():
+        return get_all_from_cache(product_class, 3600, set_cache_key=make_site_key(product_class.CACHE_KEY))
+
+    def set_user_keys():
+        for user in users:
+            key = make_user_key(user.id, product_class.CACHE_KEY)
+            cache.set(key, b'x' * 64, 3600)
+            register_key(key, cache_key=product_class.CACHE_KEY, user_id=user.id, timeout=3600)
+
+    def page_request():
+        request = factory.get('/products/')
+        force_authenticate(request, user=users[0])
+        page_view(request).render()
+
+    def filter_request(query):
+        return Request(factory.get('/products/', query))
+
+    filter_view = filter_view_class()
+    return {
+        'get_all_from_cache:miss': (get_all, lambda: cache.delete(make_site_key(product_class.CACHE_KEY))),
+        'get_all_from_cache:hit': (get_all, None),
+        'filter_from_cache': (lambda: len(filter_from_cache(get_all(), category_id=7)), None),
+        'filter_related_from_cache': (
+            lambda: len(filter_related_from_cache(get_all(), category={'title': 'c7'})), None
+        ),
+        'CacheFilterBackend': (
+            lambda: len(CacheFilterBackend().filter_queryset(
+                filter_request({'category': 7, 'price__gte': 5000}), get_all(), filter_view
+            )),
+            None
+        ),
+        'CacheSearchBackend': (
+            lambda: len(CacheSearchBackend().filter_queryset(
+                filter_request({'search': 'blue pho'}), get_all(), filter_view
+            )),
+            None
+        ),
+        'cache_page_per_user:hit': (page_request, None),
+        'clear_cache_for_model': (lambda: clear_cache_for_model(product_class.CACHE_KEY), set_user_keys),
+        'clear_cache_for_users': (lambda: clear_cache_for_users(users), set_user_keys),
+    }
+
+
+def run(args):
+    from django.contrib.auth import get_user_model
+
+    from sage_cache import settings as sage_settings
+    from sage_cache.services.cache_funcs import clear_cache_for_model
+
+    sage_settings.CACHE_STORAGE_FORMAT = args.storage
+    category_class, product_class = make_models()
+    user_class = get_user_model()
+    user_class.objects.bulk_create([user_class(username=f'user{i}') for i in range(USERS)])
+    results = []
+
+    for rows in args.rows:
+        seed(category_class, product_class, rows)
+        clear_cache_for_model(product_class.CACHE_KEY)
+        cases = make_cases(category_class, product_class, user_class)
+        redis_bytes = None
+        for name, (func, before) in cases.items():
+            if args.cases and name not in args.cases:
+                continue
+            func()  # warm up (fills cache for hit cases)
+            if redis_bytes is None:
+                redis_bytes = get_redis_bytes()
+            samples = measure(func, args.iterations, before)
+            results.append({
+                'case': name,
+                'rows': rows,
+                'iterations': args.iterations,
+                'ops_per_sec': round(len(samples) / sum(samples), 2),
+                'p50_ms': round(percentile(samples, 0.5) * 1000, 3),
+                'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+                'peak_rss_mb': get_peak_rss_mb(),
+                'redis_bytes': redis_bytes,
+            })
+            if not args.output and not args.json:
+                row = results[-1]
+                print('{case:<28} {rows:>8} rows {ops_per_sec:>10.1f} ops/s  p50 {p50_ms:>9.3f} ms  '
+                      'p99 {p99_ms:>9.3f} ms  rss {peak_rss_mb:>7.1f} MB'.format(**row), file=sys.stderr)
+        clear_cache_for_model(product_class.CACHE_KEY)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """print p50 change of every case in baseline, returns cases slower than threshold (ratio)"""
+    previous = {(row['case'], row['rows']): row for row in baseline['results']}
+    regressions = []
+    for row in results:
+        old = previous.get((row['case'], row['rows']))
+        if old is None or not old['p50_ms']:
+            continue
+        change = row['p50_ms'] / old['p50_ms'] - 1
+        print('{:<28} {:>8} rows  p50 {:>9.3f} -> {:>9.3f} ms  {:>+7.1%}'.format(
+            row['case'], row['rows'], old['p50_ms'], row['p50_ms'], change
+        ))
+        if change > threshold:
+            regressions.append(row['case'])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--storage', default='rows', choices=['queryset', 'rows', 'chunked'])
+    parser.add_argument('--cases', nargs='*', help='run only these cases')
+    parser.add_argument('--redis', default=None)
+    parser.add_argument('--json', action='store_true', help='print results as json')
+    parser.add_argument('--output', help='write json results to file')
+    parser.add_argument('--compare', help='json results of a previous run')
+    parser.add_argument('--threshold', type=float, default=0.2, help='p50 slowdown ratio of --compare failures')
+    args = parser.parse_args()
+
+    setup_django(args.redis, CACHE_AUTO_INVALIDATE=False)
+    from django.core.management import call_command
+
+    call_command('migrate', verbosity=0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        results = run(args)
+
+    import django
+
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'platform': platform.platform(),
+            'redis': args.redis or 'fakeredis',
+            'storage': args.storage,
+            'iterations': args.iterations,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        if regressions:
+            print('slower than baseline: {}'.format(', '.join(sorted(set(regressions)))), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class SageCacheConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sage_cache'
+
+    def ready(self):
+        from sage_cache.signals import connect_signals
+
+        connect_signals()
@@ -1,105 +1,448 @@
-from functools import wraps
+import asyncio
+import copy
+import time
+from functools import lru_cache, wraps
 import warnings
 
-from django.views.decorators.cache import cache_page
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.core.cache import cache, caches
+from django.utils.cache import _generate_cache_header_key, _generate_cache_key, get_max_age
+from django.utils.http import parse_http_date_safe
+from django.middleware.cache import CacheMiddleware
 
 from sage_cache import settings
+from sage_cache.services.cache_funcs import aget_many
+from sage_cache.services.key_funcs import make_meta_key
+from sage_cache.services.metrics import incr, timer
+from sage_cache.services.refresh_funcs import schedule_refresh
+from sage_cache.services.stampede_funcs import acquire_lock, await_for_lock, release_lock, wait_for_lock
+from sage_cache.services.tag_funcs import get_view_tags, tag_page
 from sage_cache.services.timeout_funcs import get_timeout_for_user
 
 
-def cache_page_per_user():
-    """cache page supported by DRF (per user)
-    settings:
-    CACHE_PAGE_ENABLED
-    CACHE_PER_USER_TIMEOUT_FUNC
-    CACHE_PER_USER_UNIQUE_ATTR
+def _get_response(request):
+    raise RuntimeError('page cache middleware is called directly, not as a middleware chain')
+
+
+class StaleCache:
+    """cache proxy storing values `stale_timeout` seconds longer than the timeout they're set with"""
+
+    def __init__(self, cache_, stale_timeout):
+        self.cache = cache_
+        self.stale_timeout = stale_timeout
+
+    def set(self, key, value, timeout=None, version=None):
+        if timeout:
+            timeout += self.stale_timeout
+        return self.cache.set(key, value, timeout, version=version)
+
+    def __getattr__(self, name):
+        return getattr(self.cache, name)
+
+
+class PageCacheMiddleware(CacheMiddleware):
+    """page cache middleware keeping pages `stale_timeout` seconds after they expire
+    max-age/Expires headers of responses are set from page_timeout,
+    pages (and their header lists) are stored for page_timeout + stale_timeout seconds
     """
 
-    def decorator(view_func):
-        @wraps(view_func)
-        def _wrapped_view(self, request, *args, **kwargs):
+    def __init__(self, get_response, page_timeout=None, stale_timeout=0, **kwargs):
+        super().__init__(get_response, page_timeout=page_timeout, **kwargs)
+        self.stale_timeout = stale_timeout
+
+    @property
+    def cache(self):
+        cache_ = caches[self.cache_alias]
+        return StaleCache(cache_, self.stale_timeout) if self.stale_timeout else cache_
+
+
+@lru_cache(maxsize=1024)
+def get_cache_middleware(timeout, key_prefix, stale_timeout=0):
+    """page cache middleware for timeout, key prefix and stale timeout (see `PageCacheMiddleware`)
+    built once and shared between requests (same as `cache_page` does per decorated view)
+    """
+    return PageCacheMiddleware(_get_response, page_timeout=timeout, stale_timeout=stale_timeout,
+                               key_prefix=key_prefix)
+
+
+def get_stale_timeout(timeout, stale_while_revalidate):
+    """seconds pages are kept after timeout (expired pages are served while they're refreshed)"""
+    return stale_while_revalidate if timeout and stale_while_revalidate else 0
+
+
+def get_page_metric_key(view):
+    """label of page metrics (view class, prefixes are per user)"""
+    return f'page:{type(view).__name__}'
+
+
+def get_page_store(middleware, request, tags=None):
+    """function storing response in page cache and adding its page key to tag sets"""
+    if not tags:
+        return lambda response: middleware.process_response(request, response)
+
+    def store(response):
+        update_cache = getattr(request, '_cache_update_cache', False)
+        response = middleware.process_response(request, response)
+        if update_cache:
+            tag_page(request, middleware.key_prefix, response, tags, middleware.cache_timeout,
+                     stale_timeout=middleware.stale_timeout)
+        return response
+
+    return store
+
+
+def get_cached_response(middleware, view, request):
+    """cached response of request (`CacheMiddleware.process_request`) or None"""
+    metric_key = get_page_metric_key(view)
+    with timer('redis_seconds', metric_key):
+        response = middleware.process_request(request)
+    if response is not None:
+        incr('hits', metric_key)
+    elif request._cache_update_cache:
+        incr('misses', metric_key)
+    return response
+
+
+def store_response(middleware, view_func, view, request, args, kwargs, tags=None):
+    """call view and store its response in page cache (request is looked up and missed)"""
+    store = get_page_store(middleware, request, tags)
+    response = view_func(view, request, *args, **kwargs)
+    if hasattr(response, 'render') and callable(response.render):
+        # page is stored in cache after response is rendered
+        response.add_post_render_callback(store)
+        return response
+    return store(response)
+
+
+def cached_response(middleware, view_func, view, request, args, kwargs, tags=None):
+    """call view through page cache middleware (same flow as `cache_page` decorator)
+    page key of stored response is added to sets of tags (see `invalidate_tags`)
+    """
+    response = get_cached_response(middleware, view, request)
+    if response is not None:
+        return response
+    return store_response(middleware, view_func, view, request, args, kwargs, tags)
+
+
+async def _aget_page(request, key_prefix, method):
+    """async `get_cache_key` + `cache.get` of page"""
+    header_key = _generate_cache_header_key(key_prefix, request)
+    headerlist = (await aget_many([header_key])).get(header_key)
+    if headerlist is None:
+        return None
+    page_key = _generate_cache_key(request, method, headerlist, key_prefix)
+    return (await aget_many([page_key])).get(page_key)
+
+
+async def aget_cached_page(request, key_prefix):
+    """async `CacheMiddleware.process_request` (cache is read with asyncio redis client)"""
+    if request.method not in ('GET', 'HEAD'):
+        request._cache_update_cache = False
+        return None
+
+    response = await _aget_page(request, key_prefix, 'GET')
+    if response is None and request.method == 'HEAD':
+        response = await _aget_page(request, key_prefix, 'HEAD')
+
+    if response is None:
+        request._cache_update_cache = True
+        return None
+
+    max_age_seconds = get_max_age(response)
+    expires_timestamp = parse_http_date_safe(response['Expires']) if response.has_header('Expires') else None
+    if max_age_seconds is not None and expires_timestamp is not None:
+        remaining_seconds = expires_timestamp - int(time.time())
+        response['Age'] = max(0, max_age_seconds - remaining_seconds)
+
+    request._cache_update_cache = False
+    return response
+
 
-            if hasattr(settings, 'CACHE_PAGE_ENABLED'):
-                enabled = settings.CACHE_PAGE_ENABLED
-            else:
-                enabled = True
+async def aget_cached_response(middleware, view, request):
+    """async `get_cached_response` (cache is read with asyncio redis client)"""
+    metric_key = get_page_metric_key(view)
+    with timer('redis_seconds', metric_key):
+        response = await aget_cached_page(request, middleware.key_prefix)
+    if response is not None:
+        incr('hits', metric_key)
+    elif request._cache_update_cache:
+        incr('misses', metric_key)
+    return response
 
-            if hasattr(settings, 'CACHE_PER_USER_TIMEOUT_FUNC'):
-                timeout_func = settings.CACHE_PER_USER_TIMEOUT_FUNC
-            else:
-                raise AttributeError(
-                    'CACHE_PER_USER_TIMEOUT_FUNC must be defined in settings.'
+
+async def astore_response(middleware, view_func, view, request, args, kwargs, tags=None):
+    """async `store_response`, missed pages are stored after response is rendered"""
+    store = get_page_store(middleware, request, tags)
+    response = await view_func(view, request, *args, **kwargs)
+    if hasattr(response, 'render') and callable(response.render):
+        response.add_post_render_callback(store)
+        return response
+    return await sync_to_async(store, thread_sensitive=False)(response)
+
+
+async def acached_response(middleware, view_func, view, request, args, kwargs, tags=None):
+    """async `cached_response` for coroutine views (hits don't use threads)"""
+    response = await aget_cached_response(middleware, view, request)
+    if response is not None:
+        return response
+    return await astore_response(middleware, view_func, view, request, args, kwargs, tags)
+
+
+def copy_request(view, request):
+    """(view, request) copies used to render page again in background
+    served request (and its view) keep their state, e.g `_cache_update_cache` of page cache middleware
+    """
+    request_ = copy.copy(request)
+    if hasattr(request, '_request'):  # rest_framework Request wraps HttpRequest
+        request_._request = copy.copy(request._request)
+    view_ = copy.copy(view)
+    if hasattr(view, 'request'):
+        view_.request = request_
+    if isinstance(getattr(view, 'headers', None), dict):
+        view_.headers = dict(view.headers)
+    return view_, request_
+
+
+def refresh_page(view_func, view, request, args, kwargs, timeout, stale_timeout, key_prefix, tags=None):
+    """render view again and store response in page cache (used by stale_while_revalidate)
+    page is fresh for `timeout` seconds and kept in cache `stale_timeout` seconds longer
+    NOTE: view and request must be copies of served ones (see `copy_request`)
+    """
+    page_id = f'page:{key_prefix}:{request.get_full_path()}'
+    token = acquire_lock(page_id)
+    if token is None:  # another worker is refreshing page
+        return
+
+    try:
+        response = view_func(view, request, *args, **kwargs)
+        if hasattr(view, 'finalize_response'):
+            response = view.finalize_response(request, response, *args, **kwargs)
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+        request._cache_update_cache = True
+        get_page_store(get_cache_middleware(timeout, key_prefix, stale_timeout), request, tags)(response)
+        cache.set(make_meta_key(page_id), True, timeout)
+    finally:
+        release_lock(page_id, token)
+
+
+def render_page(view_func, view, request, args, kwargs, timeout, key_prefix, lock=False, stale_while_revalidate=0,
+                tags=None):
+    """call view through django page cache
+    with lock=True only one worker renders a missed page, others wait for it to be cached
+    with stale_while_revalidate, page is kept `stale_while_revalidate` seconds after timeout
+    and an expired page is served while it's refreshed in background thread pool
+    stored pages are added to sets of tags
+    """
+    stale_timeout = get_stale_timeout(timeout, stale_while_revalidate)
+    middleware = get_cache_middleware(timeout, key_prefix, stale_timeout)
+
+    def cached_view():
+        return cached_response(middleware, view_func, view, request, args, kwargs, tags)
+
+    if request.method not in ('GET', 'HEAD') or not (lock or stale_while_revalidate):
+        return cached_view()
+
+    page_id = f'page:{key_prefix}:{request.get_full_path()}'
+    response = get_cached_response(middleware, view, request)
+    if response is not None:
+        if stale_while_revalidate and cache.get(make_meta_key(page_id)) is None:
+            view_, request_ = copy_request(view, request)
+            schedule_refresh(
+                page_id,
+                lambda: refresh_page(
+                    view_func, view_, request_, args, kwargs, timeout, stale_timeout, key_prefix, tags
                 )
+            )
+        return response
+
+    if stale_while_revalidate:
+        cache.set(make_meta_key(page_id), True, timeout)
 
-            if enabled:
+    token = acquire_lock(page_id) if lock else None
+    if lock and token is None:
+        incr('stampede_waits', get_page_metric_key(view))
+        with timer('stampede_wait_seconds', get_page_metric_key(view)):
+            response, token = wait_for_lock(page_id, lambda: middleware.process_request(request))
+        if token is None:  # page is cached by lock holder
+            incr('hits', get_page_metric_key(view))
+            return response
 
-                user_id = 'not_auth'
-                timeout_ = settings.CACHE_TIMEOUT
+    try:
+        # lock holder looks the page up again, it may be stored while lock is acquired
+        response = cached_view() if token else store_response(
+            middleware, view_func, view, request, args, kwargs, tags
+        )
+    except Exception:
+        if token:
+            release_lock(page_id, token)
+        raise
 
-                if request.user.is_authenticated:
+    if token:
+        # page is stored in cache after response is rendered
+        if hasattr(response, 'add_post_render_callback') and not response.is_rendered:
+            response.add_post_render_callback(lambda r: release_lock(page_id, token))
+        else:
+            release_lock(page_id, token)
+    return response
 
-                    if hasattr(settings, 'CACHE_PER_USER_UNIQUE_ATTR'):
-                        user_id = getattr(request.user, settings.CACHE_PER_USER_UNIQUE_ATTR)
-                    else:
-                        warnings.warn(
-                            'CACHE_PER_USER_UNIQUE_ATTR not defined in settings. Changed to user default value.'
-                        )
-                        user_id = request.user.id
 
-                    timeout_ = get_timeout_for_user(user=request.user, func=timeout_func)
-            else:
-                warnings.warn(
-                    'Cache page is disabled from settings. Set CACHE_PAGE_ENABLED to True to activate.'
+async def arender_page(view_func, view, request, args, kwargs, timeout, key_prefix, lock=False,
+                       stale_while_revalidate=0, tags=None):
+    """async `render_page` for coroutine views"""
+    stale_timeout = get_stale_timeout(timeout, stale_while_revalidate)
+    middleware = get_cache_middleware(timeout, key_prefix, stale_timeout)
+
+    async def cached_view():
+        return await acached_response(middleware, view_func, view, request, args, kwargs, tags)
+
+    if request.method not in ('GET', 'HEAD') or not (lock or stale_while_revalidate):
+        return await cached_view()
+
+    page_id = f'page:{key_prefix}:{request.get_full_path()}'
+    meta_key = make_meta_key(page_id)
+    response, fresh = await asyncio.gather(aget_cached_response(middleware, view, request), aget_many([meta_key]))
+    if response is not None:
+        if stale_while_revalidate and meta_key not in fresh:
+            view_, request_ = copy_request(view, request)
+            schedule_refresh(
+                page_id,
+                lambda: refresh_page(
+                    async_to_sync(view_func), view_, request_, args, kwargs, timeout, stale_timeout, key_prefix, tags
                 )
-                return view_func(self, request, *args, **kwargs)
+            )
+        return response
+
+    if stale_while_revalidate:
+        await sync_to_async(cache.set, thread_sensitive=False)(meta_key, True, timeout)
+
+    token = await sync_to_async(acquire_lock, thread_sensitive=False)(page_id) if lock else None
+    if lock and token is None:
+        incr('stampede_waits', get_page_metric_key(view))
+        with timer('stampede_wait_seconds', get_page_metric_key(view)):
+            response, token = await await_for_lock(page_id, lambda: aget_cached_page(request, key_prefix))
+        if token is None:  # page is cached by lock holder
+            incr('hits', get_page_metric_key(view))
+            return response
 
-            return cache_page(timeout=timeout_, key_prefix=f'_{user_id}_')(view_func)(request, *args, **kwargs)
+    try:
+        # lock holder looks the page up again, it may be stored while lock is acquired
+        response = await cached_view() if token else await astore_response(
+            middleware, view_func, view, request, args, kwargs, tags
+        )
+    except Exception:
+        if token:
+            await sync_to_async(release_lock, thread_sensitive=False)(page_id, token)
+        raise
 
+    if token:
+        # page is stored in cache after response is rendered
+        if hasattr(response, 'add_post_render_callback') and not response.is_rendered:
+            response.add_post_render_callback(lambda r: release_lock(page_id, token))
+        else:
+            await sync_to_async(release_lock, thread_sensitive=False)(page_id, token)
+    return response
+
+
+def cache_page_per_user(lock=None, stale_while_revalidate=None, tags=None):
+    """cache page supported by DRF (per user)
+    with lock=True only one worker renders a missed page (default CACHE_STAMPEDE_LOCK)
+    with stale_while_revalidate expired pages are served while they're refreshed in background
+    (default CACHE_STALE_WHILE_REVALIDATE)
+    tags (models, instances, strings or callable(view, request, *args, **kwargs) returning them)
+    are recorded for cached pages, pages are deleted with `invalidate_tags`
+    settings:
+    CACHE_PAGE_ENABLED
+    CACHE_PER_USER_TIMEOUT_FUNC
+    CACHE_PER_USER_UNIQUE_ATTR
+    NOTE: settings are read once when view is decorated
+    """
+
+    def decorator(view_func):
+        if not settings.CACHE_PAGE_ENABLED:
+            warnings.warn(
+                'Cache page is disabled from settings. Set CACHE_PAGE_ENABLED to True to activate.'
+            )
+            return view_func
+
+        timeout = settings.CACHE_TIMEOUT
+        timeout_func = settings.CACHE_PER_USER_TIMEOUT_FUNC
+        unique_attr = settings.CACHE_PER_USER_UNIQUE_ATTR
+        lock_ = settings.CACHE_STAMPEDE_LOCK if lock is None else lock
+        stale_while_revalidate_ = (
+            settings.CACHE_STALE_WHILE_REVALIDATE if stale_while_revalidate is None else stale_while_revalidate
+        )
+
+        def get_user_options(request):
+            """(timeout, key prefix) of user"""
+            if request.user.is_authenticated:
+                user_id = getattr(request.user, unique_attr)
+                return get_timeout_for_user(user=request.user, func=timeout_func), f'_{user_id}_'
+            return timeout, '_not_auth_'
+
+        render = arender_page if iscoroutinefunction(view_func) else render_page
+
+        @wraps(view_func)
+        def _wrapped_view(self, request, *args, **kwargs):
+            timeout_, key_prefix = get_user_options(request)
+            return render(
+                view_func, self, request, args, kwargs,
+                timeout=timeout_,
+                key_prefix=key_prefix,
+                lock=lock_,
+                stale_while_revalidate=stale_while_revalidate_,
+                tags=get_view_tags(tags, self, request, args, kwargs) if tags else None
+            )
+
+        if iscoroutinefunction(view_func):
+            markcoroutinefunction(_wrapped_view)
         return _wrapped_view
 
     return decorator
 
 
-def cache_page_per_site():
+def cache_page_per_site(lock=None, stale_while_revalidate=None, tags=None):
     """cache page supported by DRF (per site)
+    with lock=True only one worker renders a missed page (default CACHE_STAMPEDE_LOCK)
+    with stale_while_revalidate expired pages are served while they're refreshed in background
+    (default CACHE_STALE_WHILE_REVALIDATE)
+    tags (models, instances, strings or callable(view, request, *args, **kwargs) returning them)
+    are recorded for cached pages, pages are deleted with `invalidate_tags`
     settings:
     CACHE_PAGE_ENABLED
     CACHE_PAGE_PER_SITE_PREFIX
+    NOTE: settings are read once when view is decorated
     """
 
     def decorator(view_func):
+        if not settings.CACHE_PAGE_ENABLED:
+            warnings.warn(
+                'Cache page is disabled from settings. Set CACHE_PAGE_ENABLED to True to activate.'
+            )
+            return view_func
+
+        timeout = settings.CACHE_TIMEOUT
+        prefix = settings.CACHE_PAGE_PER_SITE_PREFIX
+        lock_ = settings.CACHE_STAMPEDE_LOCK if lock is None else lock
+        stale_while_revalidate_ = (
+            settings.CACHE_STALE_WHILE_REVALIDATE if stale_while_revalidate is None else stale_while_revalidate
+        )
+
+        render = arender_page if iscoroutinefunction(view_func) else render_page
+
         @wraps(view_func)
         def _wrapped_view(self, request, *args, **kwargs):
-            if hasattr(settings, 'CACHE_PAGE_ENABLED'):
-                enabled = settings.CACHE_PAGE_ENABLED
-            else:
-                enabled = True
-
-            if enabled:
-                if hasattr(settings, 'CACHE_TIMEOUT'):
-                    timeout = settings.CACHE_TIMEOUT
-                else:
-                    warnings.warn(
-                        'CACHE_TIMEOUT is not defined in settings. Changed to use default value.'
-                    )
-                    timeout = 60
-
-                if hasattr(settings, 'CACHE_PAGE_PER_SITE_PREFIX'):
-                    prefix = settings.CACHE_PAGE_PER_SITE_PREFIX
-                else:
-                    warnings.warn(
-                        'CACHE_PAGE_PER_SITE_PREFIX is not defined in settings. Changes to use default value.'
-                    )
-                    prefix = 'cache_page'
-
-                return cache_page(timeout=timeout, key_prefix=prefix)(view_func)(request, *args, **kwargs)
-
-            else:
-                warnings.warn(
-                    'Cache page is disabled from settings. Set CACHE_PAGE_ENABLED to True to activate.'
-                )
-                return view_func(self, request, *args, **kwargs)
+            return render(
+                view_func, self, request, args, kwargs,
+                timeout=timeout,
+                key_prefix=prefix,
+                lock=lock_,
+                stale_while_revalidate=stale_while_revalidate_,
+                tags=get_view_tags(tags, self, request, args, kwargs) if tags else None
+            )
 
+        if iscoroutinefunction(view_func):
+            markcoroutinefunction(_wrapped_view)
         return _wrapped_view
 
     return decorator
@@ -1,130 +1,191 @@
 import warnings
 from functools import wraps
 
+from asgiref.sync import iscoroutinefunction
+
 from sage_cache import settings
-from sage_cache.services.cache_funcs import get_all_from_cache, filter_from_cache
-from sage_cache.services.timeout_funcs import get_timeout_for_user
+from sage_cache.services.cache_funcs import aget_all_from_cache, get_all_from_cache, filter_from_cache
+from sage_cache.services.key_funcs import make_overlay_key, make_site_key, make_user_key
+from sage_cache.services.overlay_funcs import aget_overlay_from_cache, get_overlay_from_cache
+from sage_cache.services.timeout_funcs import adaptive_timeout, get_timeout_for_user
+
+
+def _check_model_class(view):
+    if not hasattr(view, 'model_class'):
+        raise AttributeError('model_class must be defined in {}'.format(type(view).__name__))
+
+    if not hasattr(view.model_class, 'CACHE_KEY'):
+        raise AttributeError("CACHE_KEY must be defined in {}".format(view.model_class.__name__))
 
 
-def cache_queryset_per_user(lazy=False):
+def _set_queryset(view, queryset, lazy, visible_pks=None):
+    view.visible_pks = visible_pks
+    if hasattr(view, 'queryset_filter'):
+        queryset = filter_from_cache(queryset, **view.queryset_filter, lazy=lazy)  # filtered
+    view.queryset = queryset
+
+
+def cache_queryset_per_user(
+        lazy=False, lock=None, stale_timeout=None, xfetch_beta=None, stale_while_revalidate=None, overlay=None
+):
     """cache queryset for DRF views (per user)
     identify cache keys with a unique attr of user
+    stampede protection (lock, stale_timeout, xfetch_beta, stale_while_revalidate) see `get_all_from_cache`
+    async views (coroutine functions) read cache with `aget_all_from_cache`
+    overlay=True (default CACHE_PER_USER_OVERLAY) caches the table once per site and per user just
+    primary keys of `get_user_queryset(request)` of view (see `get_overlay_from_cache`),
+    visible primary keys are set on `visible_pks` of view
     settings:
     CACHE_QUERYSET_ENABLED
-    CACHE_PER_USER_TIMEOUT_FUNC
+    CACHE_PER_USER_TIMEOUT_FUNC (gets key and model_class kwargs if it accepts them)
     CACHE_PER_USER_UNIQUE_ATTR
+    CACHE_PER_USER_OVERLAY
+    CACHE_TIMEOUT (timeout of per site table in overlay mode)
+    NOTE: settings are read once when view is decorated
     """
 
     def decorator(view_func):
-        @wraps(view_func)
-        def _wrapped_view(self, request, *args, **kwargs):
-            if hasattr(settings, 'CACHE_QUERYSET_ENABLED'):
-                enabled = settings.CACHE_QUERYSET_ENABLED
+        enabled = settings.CACHE_QUERYSET_ENABLED
+        timeout_func = settings.CACHE_PER_USER_TIMEOUT_FUNC
+        unique_attr = settings.CACHE_PER_USER_UNIQUE_ATTR
+        use_overlay = settings.CACHE_PER_USER_OVERLAY if overlay is None else overlay
+        site_timeout = settings.CACHE_TIMEOUT
+        adaptive = settings.CACHE_ADAPTIVE_TIMEOUT
+        if not enabled:
+            warnings.warn(
+                'Cache queryset is disabled from settings. Set CACHE_QUERYSET_ENABLED to True to activate.'
+            )
+
+        def set_uncached_queryset(self, request):
+            if not hasattr(self, 'model_class'):
+                raise AttributeError('model_class must be defined in {}'.format(type(self).__name__))
+            self.queryset = self.model_class.objects.all()
+            if use_overlay and hasattr(self, 'get_user_queryset'):
+                self.queryset = self.get_user_queryset(request)
+            if hasattr(self, 'queryset_filter'):
+                self.queryset = self.queryset.filter(**self.queryset_filter)
+
+        def get_cache_kwargs(self, request):
+            _check_model_class(self)
+            user_id = getattr(request.user, unique_attr)
+            if use_overlay:
+                key = make_overlay_key(user_id, self.model_class.CACHE_KEY)
+                site_key = make_site_key(self.model_class.CACHE_KEY)
+                get_user_queryset = getattr(self, 'get_user_queryset', None)
+                overlay_kwargs = dict(
+                    user_queryset=get_user_queryset(request) if get_user_queryset is not None else None,
+                    site_timeout=adaptive_timeout(key=site_key) if adaptive else site_timeout,
+                )
             else:
-                enabled = True
-            if enabled:
-                if not hasattr(self, 'model_class'):
-                    raise AttributeError('model_class must be defined in {}'.format(self.__name__))
-
-                if not hasattr(self.model_class, 'CACHE_KEY'):
-                    raise AttributeError("CACHE_KEY must be defined in {}".format(self.model_class.__name__))
-
-                if hasattr(settings, 'CACHE_PER_USER_TIMEOUT_FUNC'):
-                    timeout_func = settings.CACHE_PER_USER_TIMEOUT_FUNC
+                key = make_user_key(user_id, self.model_class.CACHE_KEY)
+                overlay_kwargs = {}
+            return dict(
+                **overlay_kwargs,
+                model_class=self.model_class,
+                set_cache_key=key,
+                timeout=get_timeout_for_user(
+                    user=request.user, func=timeout_func, key=key, model_class=self.model_class
+                ),
+                user_id=user_id,
+                indexed_fields=getattr(self, 'filterset_fields', None),
+                search_fields=getattr(self, 'search_fields', None),
+                lock=lock,
+                stale_timeout=stale_timeout,
+                xfetch_beta=xfetch_beta,
+                stale_while_revalidate=stale_while_revalidate,
+                lazy=lazy
+            )
+
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def _wrapped_view(self, request, *args, **kwargs):
+                if not enabled:
+                    set_uncached_queryset(self, request)
+                    return await view_func(self, request, *args, **kwargs)
+
+                if use_overlay:
+                    queryset, pks = await aget_overlay_from_cache(**get_cache_kwargs(self, request))
+                    _set_queryset(self, queryset, lazy, pks)
                 else:
-                    raise AttributeError(
-                        'CACHE_PER_USER_TIMEOUT_FUNC must be defined in settings.'
-                    )
+                    queryset = await aget_all_from_cache(**get_cache_kwargs(self, request))  # all
+                    _set_queryset(self, queryset, lazy)
+                return await view_func(self, request, *args, **kwargs)
 
-                if hasattr(settings, 'CACHE_PER_USER_UNIQUE_ATTR'):
-                    user_id = getattr(request.user, settings.CACHE_PER_USER_UNIQUE_ATTR)
-                else:
-                    warnings.warn(
-                        'CACHE_PER_USER_UNIQUE_ATTR not defined in settings. Changed to user default value.'
-                    )
-                    user_id = request.user.id
-
-                get_cache_key = f'*{user_id}*{self.model_class.CACHE_KEY}*'
-                set_cache_key = f'{user_id}-{self.model_class.CACHE_KEY}'
-                queryset = get_all_from_cache(
-                    model_class=self.model_class,
-                    get_cache_key=get_cache_key,
-                    set_cache_key=set_cache_key,
-                    timeout=get_timeout_for_user(user=request.user, func=timeout_func),
-                    lazy=lazy
-                )  # all
-
-                if hasattr(self, 'queryset_filter'):
-                    queryset = filter_from_cache(queryset, **self.queryset_filter, lazy=lazy)  # filtered
-
-                self.queryset = queryset
+            return _wrapped_view
 
+        @wraps(view_func)
+        def _wrapped_view(self, request, *args, **kwargs):
+            if not enabled:
+                set_uncached_queryset(self, request)
                 return view_func(self, request, *args, **kwargs)
 
+            if use_overlay:
+                queryset, pks = get_overlay_from_cache(**get_cache_kwargs(self, request))  # visible rows
+                _set_queryset(self, queryset, lazy, pks)
             else:
-                warnings.warn(
-                    'Cache queryset is disabled from settings. Set CACHE_QUERYSET_ENABLED to True to activate.'
-                )
-                self.queryset = self.model_class.objects.all()
-                if hasattr(self, 'queryset_filter'):
-                    self.queryset = self.queryset.filter(**self.queryset_filter)
-                return view_func(self, request, *args, **kwargs)
+                queryset = get_all_from_cache(**get_cache_kwargs(self, request))  # all
+                _set_queryset(self, queryset, lazy)
+            return view_func(self, request, *args, **kwargs)
 
         return _wrapped_view
 
     return decorator
 
 
-def cache_queryset_per_site(lazy=False):
+def cache_queryset_per_site(
+        lazy=False, lock=None, stale_timeout=None, xfetch_beta=None, stale_while_revalidate=None
+):
     """cache queryset for DRF views (per site)
     one cache key for whole site
+    stampede protection (lock, stale_timeout, xfetch_beta, stale_while_revalidate) see `get_all_from_cache`
+    async views (coroutine functions) read cache with `aget_all_from_cache`
     settings:
     CACHE_QUERYSET_ENABLED
     CACHE_TIMEOUT
+    CACHE_ADAPTIVE_TIMEOUT (timeout of key is chosen by `adaptive_timeout`)
+    NOTE: settings are read once when view is decorated
     """
 
     def decorator(view_func):
+        if not settings.CACHE_QUERYSET_ENABLED:
+            warnings.warn(
+                'Cache queryset is disabled from settings. Set CACHE_QUERYSET_ENABLED to True to activate.'
+            )
+            return view_func
+
+        timeout = settings.CACHE_TIMEOUT
+        adaptive = settings.CACHE_ADAPTIVE_TIMEOUT
+
+        def get_cache_kwargs(self):
+            _check_model_class(self)
+            key = make_site_key(self.model_class.CACHE_KEY)
+            return dict(
+                model_class=self.model_class,
+                set_cache_key=key,
+                timeout=adaptive_timeout(key=key) if adaptive else timeout,
+                indexed_fields=getattr(self, 'filterset_fields', None),
+                search_fields=getattr(self, 'search_fields', None),
+                lock=lock,
+                stale_timeout=stale_timeout,
+                xfetch_beta=xfetch_beta,
+                stale_while_revalidate=stale_while_revalidate,
+                lazy=lazy
+            )
+
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def _wrapped_view(self, request, *args, **kwargs):
+                queryset = await aget_all_from_cache(**get_cache_kwargs(self))  # all
+                _set_queryset(self, queryset, lazy)
+                return await view_func(self, request, *args, **kwargs)
+
+            return _wrapped_view
+
         @wraps(view_func)
         def _wrapped_view(self, request, *args, **kwargs):
-            if hasattr(settings, 'CACHE_QUERYSET_ENABLED'):
-                enabled = settings.CACHE_QUERYSET_ENABLED
-            else:
-                enabled = True
-
-            if enabled:
-                if not hasattr(self.model_class, 'CACHE_KEY'):
-                    raise AttributeError("CACHE_KEY must be defined in {}".format(self.model_class.__name__))
-
-                if hasattr(settings, 'CACHE_TIMEOUT'):
-                    timeout = settings.CACHE_TIMEOUT
-                else:
-                    warnings.warn(
-                        'CACHE_TIMEOUT is not defined in settings. Changed to use default value.'
-                    )
-                    timeout = 60
-
-                get_cache_key = f'*{self.model_class.CACHE_KEY}*'
-                set_cache_key = f'{self.model_class.CACHE_KEY}'
-                queryset = get_all_from_cache(
-                    model_class=self.model_class,
-                    get_cache_key=get_cache_key,
-                    set_cache_key=set_cache_key,
-                    timeout=timeout,
-                    lazy=lazy
-                )  # all
-
-                if hasattr(self, 'queryset_filter'):
-                    queryset = filter_from_cache(queryset, **self.queryset_filter, lazy=lazy)  # filtered
-
-                self.queryset = queryset
-
-                return view_func(self, request, *args, **kwargs)
-
-            else:
-                warnings.warn(
-                    'Cache queryset is disabled from settings. Set CACHE_QUERYSET_ENABLED to True to activate.'
-                )
-                return view_func(self, request, *args, **kwargs)
+            queryset = get_all_from_cache(**get_cache_kwargs(self))  # all
+            _set_queryset(self, queryset, lazy)
+            return view_func(self, request, *args, **kwargs)
 
         return _wrapped_view
 
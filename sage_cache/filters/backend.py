@@ -1,9 +1,11 @@
-import operator
-
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import QuerySet
 from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import SearchFilter
 
-from sage_cache.services.cache_funcs import filter_related_from_cache, filter_from_cache
+from sage_cache.services.lookup_funcs import LOOKUP_SEP, LOOKUPS, filter_by_lookups
+from sage_cache.services.redis_index_funcs import filter_pks, select_pks, split_lookups
 
 
 class CacheFilterBackend(DjangoFilterBackend):
@@ -41,39 +43,85 @@ class CacheFilterBackend(DjangoFilterBackend):
         """get filterset_fields from view"""
         return getattr(view, 'filterset_fields', None)
 
-    def get_filter_depth(self, filter_kwargs: dict, level=0):
-        """get depth of dictionary"""
-        if not isinstance(filter_kwargs, dict) or not filter_kwargs:
-            return level
-        return max(self.get_filter_depth(filter_kwargs[key], level + 1) for key in filter_kwargs)
+    def get_declared_lookups(self, view):
+        """{field: lookups} declared in filterset_fields
+        list form declares `exact` lookups, dict form (e.g {'price': ['exact', 'gte']}) the listed lookups
+        """
+        fields = self.get_filterset_fields(view) or []
+        if isinstance(fields, dict):
+            return {field: [lookup for lookup in lookups if lookup in LOOKUPS] for field, lookups in fields.items()}
+        return {field: ['exact'] for field in fields}
+
+    def get_filter_lookups(self, request, view):
+        """query params of declared lookups of filterset fields (e.g price, price__gte)
+        NOTE: other lookups (e.g undeclared `regex`) are ignored
+        """
+        lookups = {}
+        for field, field_lookups in self.get_declared_lookups(view).items():
+            for lookup in field_lookups:
+                param = field if lookup == 'exact' else LOOKUP_SEP.join([field, lookup])
+                value = request.query_params.get(param, '')
+                if value != '':
+                    lookups[param] = value
+        return lookups
+
+    def filter_lookups(self, queryset, view, lookups):
+        """filter queryset (QuerySet or cached objects) with lookups"""
+        if isinstance(queryset, QuerySet):
+            return queryset.filter(**lookups)
+        try:
+            return filter_by_lookups(queryset, model_class=view.model_class, **lookups)
+        except DjangoValidationError as e:
+            raise ValidationError(e.message_dict if hasattr(e, 'error_dict') else e.messages)
 
     def filter_queryset(self, request, queryset, view):
         """filter queryset from cache"""
-        filter_kwargs = {}
-        for param in request.query_params:
-            for field in self.get_filterset_fields(view):
-                if param.startswith(field):
-                    sub_fields = field.split('__')
-                    length = len(sub_fields)
-                    if length == 1:  # filter field has no foreign key
-                        filter_kwargs[sub_fields[0]] = request.query_params[param]
-                    else:  # filter field has foreign key
-                        for i in range(length):
-                            try:
-                                filter_kwargs[sub_fields[i]] = {sub_fields[i + 1]: None}
-                            except IndexError:
-                                filter_kwargs[sub_fields[i - 1]][sub_fields[i]] = request.query_params[param]
-
-        filter_depth = self.get_filter_depth(filter_kwargs)  # get depth of dict
-        if filter_depth == 1:  # filter has no foreign key
-            return filter_from_cache(queryset, **filter_kwargs)
-        return filter_related_from_cache(queryset, **filter_kwargs)  # filter with foreign key
+        return self.filter_lookups(queryset, view, self.get_filter_lookups(request, view))
+
+
+class RedisIndexFilterBackend(CacheFilterBackend):
+    """CacheFilterBackend evaluating lookups in redis secondary indexes
+    lookups on CACHE_REDIS_INDEXED_FIELDS of model are evaluated in redis (sets and sorted sets),
+    only matching rows are selected from cache, other lookups are filtered in python
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        """filter queryset with redis indexes and cache"""
+        lookups = self.get_filter_lookups(request, view)
+        try:
+            server_lookups, lookups = split_lookups(view.model_class, lookups)
+            pks = filter_pks(view.model_class, **server_lookups) if server_lookups else None
+        except DjangoValidationError as e:
+            raise ValidationError(e.message_dict if hasattr(e, 'error_dict') else e.messages)
+
+        if pks is None:  # indexes are being built
+            lookups.update(server_lookups)
+        else:
+            queryset = select_pks(queryset, pks)
+        return self.filter_lookups(queryset, view, lookups)
 
 
 class CacheSearchBackend(SearchFilter):
     """Integrated with cache
-    search in cache via `contains` operator
+    search in cache (all terms must match, each term in any of search fields)
+    search fields with database only prefixes (`@` full text search) are searched in database,
+    then matching rows are selected from cache
     """
+    search_lookups = {
+        '^': 'istartswith',
+        '=': 'iexact',
+        '$': 'iregex',
+    }
+    database_prefixes = ('@',)
+
+    def get_search_lookup(self, field_name):
+        """lookup expression of search field e.g '^title' -> 'title__istartswith'"""
+        lookup = self.search_lookups.get(field_name[0])
+        if lookup:
+            field_name = field_name[1:]
+        else:
+            lookup = 'icontains'
+        return LOOKUP_SEP.join([field_name, lookup])
 
     def filter_queryset(self, request, queryset, view):
         search_fields = self.get_search_fields(view, request)
@@ -82,19 +130,27 @@ class CacheSearchBackend(SearchFilter):
         if not search_fields or not search_terms:
             return queryset
 
-        filter_kwargs = {}
-        for field in search_fields:
-            sub_fields = field.split('__')
-            length = len(sub_fields)
-            for i in range(length):
-                try:
-                    filter_kwargs[sub_fields[i]] = {sub_fields[i + 1]: None}
-                except IndexError:
-                    if i == 0:
-                        filter_kwargs[sub_fields[i]] = search_terms[i]
-                    else:
-                        filter_kwargs[sub_fields[i - 1]][sub_fields[i]] = search_terms[i]
-
-        queryset = filter_from_cache(queryset, operator_=operator.contains, **filter_kwargs)
+        if isinstance(queryset, QuerySet):
+            return super().filter_queryset(request, queryset, view)
+
+        if any(str(field)[0] in self.database_prefixes for field in search_fields):
+            return self.filter_in_database(request, queryset, view)
+
+        lookups = [self.get_search_lookup(str(field)) for field in search_fields]
+        model_class = getattr(view, 'model_class', None)
+        for term in search_terms:
+            queryset = filter_by_lookups(
+                queryset, model_class=model_class, connector='OR', **{lookup: term for lookup in lookups}
+            )
 
         return queryset
+
+    def filter_in_database(self, request, queryset, view):
+        """search rows of model in database (`SearchFilter`) and select matching rows from cache"""
+        model_class = getattr(view, 'model_class', None)
+        if model_class is None:
+            if not queryset:
+                return queryset
+            model_class = type(queryset[0])
+        matched = super().filter_queryset(request, model_class._default_manager.all(), view)
+        return select_pks(queryset, set(matched.values_list('pk', flat=True)))
@@ -0,0 +1,35 @@
+from django.core.management.base import CommandError
+
+from sage_cache.management.commands.sage_cache_warm import Command as WarmCommand
+from sage_cache.services.delta_funcs import compact_delta_logs, compact_periodically, is_delta_enabled
+
+
+class Command(WarmCommand):
+    help = 'Fold change logs of CACHE_DELTA_LOG models into their cached snapshots and trim the logs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='app_label.ModelName (default all models with CACHE_DELTA_LOG)')
+        parser.add_argument('--periodic', action='store_true', help='keep compacting every --interval seconds')
+        parser.add_argument('--interval', type=float, default=60, help='seconds between periodic rounds')
+
+    def get_models(self, labels):
+        models = [model_class for model_class in super().get_models(labels) if is_delta_enabled(model_class)]
+        if labels and len(models) != len(labels):
+            raise CommandError('models must set CACHE_DELTA_LOG = True')
+        return models
+
+    def report(self, results):
+        for stats in results:
+            self.stdout.write(
+                '{model}: {keys} snapshots updated, {dropped} dropped, {trimmed} log entries trimmed '
+                'in {elapsed:.3f}s'.format(**stats)
+            )
+
+    def handle(self, *args, **options):
+        models = self.get_models(options['models'])
+        self.report(compact_delta_logs(models))
+        if options['periodic']:
+            try:
+                compact_periodically(options['interval'], models=models, callback=self.report)
+            except KeyboardInterrupt:
+                pass
@@ -0,0 +1,88 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from sage_cache import settings
+from sage_cache.services.redis_index_funcs import build_redis_index
+from sage_cache.services.warm_funcs import warm_models, warm_periodically
+from sage_cache.signals import get_cached_models
+
+
+class Command(BaseCommand):
+    help = 'Prefill caches of ModelCacheMixin models (site keys and registered keys, e.g per user keys)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='app_label.ModelName (default all cached models)')
+        parser.add_argument('--concurrency', type=int, default=None, help='parallel models (CACHE_WARM_CONCURRENCY)')
+        parser.add_argument('--chunk-size', type=int, default=None, help='rows per database read (CACHE_WARM_CHUNK_SIZE)')
+        parser.add_argument('--timeout', type=int, default=None, help='seconds values are fresh (CACHE_TIMEOUT)')
+        parser.add_argument('--storage', choices=['queryset', 'rows', 'chunked'], default=None)
+        parser.add_argument('--periodic', action='store_true', help='keep refreshing keys before they expire')
+        parser.add_argument(
+            '--redis-index', action='store_true',
+            help='(re)build redis indexes of models with CACHE_REDIS_INDEXED_FIELDS'
+        )
+        parser.add_argument('--interval', type=float, default=5, help='seconds between periodic rounds')
+        parser.add_argument(
+            '--before', type=float, default=None,
+            help='periodic mode refreshes keys expiring in these seconds (CACHE_WARM_REFRESH_BEFORE)'
+        )
+
+    def get_models(self, labels):
+        cached_models = get_cached_models()
+        if not labels:
+            return cached_models
+        models = []
+        for label in labels:
+            try:
+                model_class = apps.get_model(label)
+            except (LookupError, ValueError) as e:
+                raise CommandError(str(e))
+            if model_class not in cached_models:
+                raise CommandError('{} is not a ModelCacheMixin model with CACHE_KEY'.format(label))
+            models.append(model_class)
+        return models
+
+    def report(self, results):
+        for stats in results:
+            if 'error' in stats:
+                self.stderr.write('{model}: failed ({error})'.format(**stats))
+            elif stats['skipped']:
+                self.stdout.write('{model}: skipped, being recomputed by another worker'.format(**stats))
+            else:
+                self.stdout.write('{model}: {keys} keys in {elapsed:.3f}s'.format(**stats))
+
+    def build_indexes(self, models):
+        for model_class in models:
+            if not getattr(model_class, 'CACHE_REDIS_INDEXED_FIELDS', None):
+                continue
+            stats = build_redis_index(model_class)
+            label = model_class._meta.label
+            if stats is None:
+                self.stdout.write('{}: redis index skipped, being built by another worker'.format(label))
+            else:
+                self.stdout.write('{}: redis index of {rows} rows in {elapsed:.3f}s'.format(label, **stats))
+
+    def handle(self, *args, **options):
+        models = self.get_models(options['models'])
+        if options['redis_index']:
+            self.build_indexes(models)
+        kwargs = dict(
+            concurrency=options['concurrency'],
+            chunk_size=options['chunk_size'],
+            timeout=options['timeout'],
+            storage=options['storage'],
+        )
+
+        results = warm_models(models, **kwargs)
+        self.report(results)
+        if any('error' in stats for stats in results) and not options['periodic']:
+            raise CommandError('some models could not be warmed')
+
+        if options['periodic']:
+            before = settings.CACHE_WARM_REFRESH_BEFORE if options['before'] is None else options['before']
+            if options['interval'] >= before:
+                self.stderr.write('--interval should be shorter than --before to refresh keys before they expire')
+            try:
+                warm_periodically(options['interval'], within=before, models=models, callback=self.report, **kwargs)
+            except KeyboardInterrupt:
+                pass
@@ -1,5 +1,10 @@
 from django.core.cache import cache
 
+from sage_cache.services.bulk_funcs import get_many_from_cache
+from sage_cache.services.cache_funcs import filter_from_cache, filter_related_from_cache, get_all_from_cache
+from sage_cache.services.key_funcs import make_site_key
+from sage_cache.services.metrics import get_metrics
+
 
 class ModelCacheMixin:
     """Mixin for models that adds filtering on cached queryset.
@@ -18,14 +23,30 @@ class ModelCacheMixin:
         if not hasattr(cls, 'CACHE_KEY'):
             raise AttributeError("CACHE_KEY must be defined in {}".format(cls.__name__))
 
-        if hasattr(cls, 'CACHED_RELATED_OBJECT'):
-            queryset = cache.get_or_set(
-                cls.CACHE_KEY,
-                cls.objects.all().select_related(*cls.CACHED_RELATED_OBJECT),
-            )
-        else:
-            queryset = cache.get_or_set(cls.CACHE_KEY, cls.objects.all())
-        return list(queryset)
+        return get_all_from_cache(
+            model_class=cls,
+            set_cache_key=make_site_key(cls.CACHE_KEY),
+            timeout=cache.default_timeout
+        )
+
+    @classmethod
+    def get_many_from_cache(cls, *models):
+        """Returns instances of this model and other models stored in cache with one round trip
+        (missed models are queried concurrently and stored with one pipeline, see `bulk_funcs`)
+        :param models: other ModelCacheMixin models or their CACHE_KEYs
+        :return: dict of model (or CACHE_KEY) -> List of Model instances.
+        """
+        if not hasattr(cls, 'CACHE_KEY'):
+            raise AttributeError("CACHE_KEY must be defined in {}".format(cls.__name__))
+
+        return get_many_from_cache([cls, *models], timeout=cache.default_timeout)
+
+    @classmethod
+    def get_cache_metrics(cls):
+        """Returns recorded cache metrics of CACHE_KEY (needs CACHE_METRICS_ENABLED)
+        :return: dict of counters (hits, misses, ...) and histograms count/sum (redis_seconds, ...)
+        """
+        return get_metrics(cls.CACHE_KEY)
 
     @classmethod
     def filter_from_cache(cls, queryset=None, **kwargs):
@@ -33,8 +54,9 @@ class ModelCacheMixin:
         It currently supports 2 types of filter
         1. Equality Filter - e.g id = 1 and name = 'test'
            filter_from_cache(id=1, name= 'test')
-        2. In List Filter - e.g id in [1,2,3]
+        2. In List Filter - e.g id in [1,2,3] (list, tuple or set)
            filter_from_cache(id= [1,2,3])
+        Cached rows are filtered with their hash indexes (see `cache_funcs.filter_from_cache`)
         :param queryset: list of model instances that needs to be filtered.
                          If not present, filtering is done on all cached instances
         :param kwargs: dictionary containing filter property and values.
@@ -43,19 +65,7 @@ class ModelCacheMixin:
         if not queryset:
             queryset = cls.get_all_from_cache()
 
-        def filter_obj(obj):
-            select = True  # boolean indicating if the item should be selected
-            for filter_key, filter_value in kwargs.items():
-                if isinstance(filter_value, list):
-                    if getattr(obj, filter_key) not in filter_value:
-                        select = False
-                        break
-                elif getattr(obj, filter_key) != filter_value:
-                    select = False
-                    break
-            return select
-
-        return list(filter(filter_obj, queryset))
+        return list(filter_from_cache(queryset, **kwargs))
 
     @classmethod
     def filter_related_from_cache(cls, queryset=None, **kwargs):
@@ -66,6 +76,7 @@ class ModelCacheMixin:
            filter_from_cache(foreign_key= {"name": "test", "id": 5})
         2. In List Filter for foreign key's table- e.g id in [1,2,3]
            filter_from_cache(foreign_key={'id': [1,2,3]})
+        Cached rows are filtered with their hash indexes (see `cache_funcs.filter_related_from_cache`)
         :param queryset: list of model instances that needs to be filtered.
         :param kwargs: dictionary containing filter property and values.
         :return: List containing Model objects
@@ -73,17 +84,4 @@ class ModelCacheMixin:
         if not queryset:
             queryset = cls.get_all_from_cache()
 
-        for foreign_key, related_filters in kwargs.items():
-            related_objects_list = [getattr(obj, foreign_key) for obj in queryset]
-            # Filtering related objects based related object's attribute filters
-            filtered_related_objects = cls.filter_from_cache(
-                related_objects_list, **related_filters
-            )
-            # Filtering queryset based filtered related objects
-            queryset = list(
-                filter(
-                    lambda x: getattr(x, foreign_key) in filtered_related_objects,
-                    queryset,
-                )
-            )
-        return queryset
+        return list(filter_related_from_cache(queryset, **kwargs))
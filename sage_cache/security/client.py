@@ -0,0 +1,40 @@
+import logging
+from contextlib import suppress
+
+from django_redis.client import DefaultClient
+from django_redis.exceptions import CompressorError
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+
+class EncryptedClient(DefaultClient):
+    """django_redis client for `EncryptedPickleSerializer`
+    integers are encrypted too (DefaultClient stores them as plain redis integers),
+    so `incr`/`decr` read, change and write back values instead of using INCRBY (not atomic)
+    values which can't be decrypted are cache misses: `get` returns default, `get_many` leaves them out
+    """
+
+    def encode(self, value, *, allow_int=True):
+        return super().encode(value, allow_int=False)
+
+    def decode(self, value):
+        """decrypted value, raises ValueError for values which aren't encrypted (e.g plain integers)"""
+        with suppress(CompressorError):
+            value = self._compressor.decompress(value)
+        return self._serializer.loads(value)
+
+    def get(self, key, default=None, version=None, client=None):
+        try:
+            return super().get(key, default, version=version, client=client)
+        except ValueError as e:
+            logger.warning('cached value of `%s` is dropped: %s', key, e)
+            return default
+
+    def get_many(self, keys, version=None, client=None):
+        try:
+            return super().get_many(keys, version=version, client=client)
+        except ValueError:  # some values can't be decrypted, they're read one by one
+            values = {key: self.get(key, MISSING, version=version, client=client) for key in keys}
+            return {key: value for key, value in values.items() if value is not MISSING}
@@ -1,32 +1,158 @@
-import ast
+import hashlib
+import json
+import struct
+import threading
+import time
 
 from Crypto.Cipher import PKCS1_OAEP
+from Crypto.PublicKey import RSA
+from Crypto.Random import get_random_bytes
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from django.conf import settings
 
+MAGIC = b'SGE1'
+FINGERPRINT_SIZE = 8
+NONCE_SIZE = 12
+DATA_KEY_SIZE = 32  # AES-256
+MAX_DATA_KEY_USES = 2 ** 31  # random 96 bit GCM nonces are safe for 2**32 messages per key
+MAX_UNWRAPPED_KEYS = 256
+MESSAGE_STR = b's'
+MESSAGE_LIST = b'l'
 
-def encrypt_message(message):
-    """encrypt message based on RSA algorithm"""
+
+class DataKey:
+    """AES data key, its RSA wrapped form and fingerprint of the wrapping RSA key"""
+
+    def __init__(self, key: bytes, wrapped: bytes, fingerprint: bytes):
+        self.cipher = AESGCM(key)
+        self.wrapped = wrapped
+        self.fingerprint = fingerprint
+        self.header = MAGIC + fingerprint + struct.pack('>H', len(wrapped)) + wrapped
+        self.created = time.monotonic()
+        self.uses = 0
+
+
+_data_key = None
+_data_key_lock = threading.Lock()
+_unwrapped = {}  # (fingerprint, wrapped key) -> AESGCM cipher of data key
+
+
+def _import_key(key):
+    """RsaKey from RsaKey object or PEM/DER string"""
+    if isinstance(key, (str, bytes)):
+        return RSA.import_key(key)
+    return key
+
+
+def get_fingerprint(key):
+    """short fingerprint of RSA key (same for public and private key of a pair)"""
+    return hashlib.sha256(key.publickey().export_key('DER')).digest()[:FINGERPRINT_SIZE]
+
+
+def get_public_key():
     if not hasattr(settings, 'PUBLIC_KEY'):
         raise AttributeError('PUBLIC_KEY must be defined in settings')
-
-    public_key = settings.PUBLIC_KEY
-    encryptor = PKCS1_OAEP.new(public_key)
-    if type(message) in [list, tuple, set]:
-        encrypted_msg = [encryptor.encrypt(x.encode('UTF-8')) for x in message]
-    else:
-        encrypted_msg = encryptor.encrypt(message.encode('UTF-8'))
-    return encrypted_msg
+    return _import_key(settings.PUBLIC_KEY)
 
 
-def decrypt_message(encrypted_msg):
-    """decrypt message based on RSA algorithm"""
+def get_private_keys():
+    """{fingerprint: private key} of PRIVATE_KEY and CACHE_ENCRYPTION_OLD_PRIVATE_KEYS (rotated keys)"""
     if not hasattr(settings, 'PRIVATE_KEY'):
         raise AttributeError('PRIVATE_KEY must be defined in settings')
+    keys = [settings.PRIVATE_KEY] + list(getattr(settings, 'CACHE_ENCRYPTION_OLD_PRIVATE_KEYS', []))
+    return {get_fingerprint(key): key for key in map(_import_key, keys)}
+
+
+def get_data_key():
+    """current data key of process
+    a new data key is made and wrapped with PUBLIC_KEY (one RSA operation) when
+    it's older than CACHE_ENCRYPTION_KEY_ROTATION seconds or used for MAX_DATA_KEY_USES values
+    """
+    global _data_key
+    rotation = getattr(settings, 'CACHE_ENCRYPTION_KEY_ROTATION', 3600)
+    with _data_key_lock:
+        data_key = _data_key
+        if data_key is None or data_key.uses >= MAX_DATA_KEY_USES or (
+            rotation and time.monotonic() - data_key.created >= rotation
+        ):
+            public_key = get_public_key()
+            key = get_random_bytes(DATA_KEY_SIZE)
+            data_key = _data_key = DataKey(key, PKCS1_OAEP.new(public_key).encrypt(key), get_fingerprint(public_key))
+        data_key.uses += 1
+    return data_key
 
-    private_key = settings.PRIVATE_KEY
-    decryptor = PKCS1_OAEP.new(private_key)
-    if type(encrypted_msg) in [list, tuple, set]:
-        decoded_decrypted_msg = [decryptor.decrypt(ast.literal_eval(str(x.decode('UTF-8')))) for x in encrypted_msg]
-    else:
-        decoded_decrypted_msg = decryptor.decrypt(ast.literal_eval(str(encrypted_msg.decode('UTF-8'))))
-    return decoded_decrypted_msg
+
+def rotate_data_key():
+    """drop current data key, next value is encrypted with a new one (e.g after PUBLIC_KEY is changed)"""
+    global _data_key
+    with _data_key_lock:
+        _data_key = None
+
+
+def _unwrap(fingerprint: bytes, wrapped: bytes):
+    """cipher of a wrapped data key (RSA decrypt once per data key and process)"""
+    cipher = _unwrapped.get((fingerprint, wrapped))
+    if cipher is None:
+        private_key = get_private_keys().get(fingerprint)
+        if private_key is None:
+            raise ValueError('value is encrypted with an unknown RSA key')
+        cipher = AESGCM(PKCS1_OAEP.new(private_key).decrypt(wrapped))
+        if len(_unwrapped) >= MAX_UNWRAPPED_KEYS:
+            _unwrapped.clear()
+        _unwrapped[fingerprint, wrapped] = cipher
+    return cipher
+
+
+def is_encrypted(value):
+    """check value is made by `encrypt`"""
+    return isinstance(value, (bytes, bytearray, memoryview)) and bytes(value[:len(MAGIC)]) == MAGIC
+
+
+def encrypt(data: bytes):
+    """envelope encryption of data with AES-256-GCM in one pass
+    format: MAGIC | RSA key fingerprint | wrapped key length | wrapped data key | nonce | ciphertext and tag
+    header is authenticated (GCM associated data)
+    """
+    data_key = get_data_key()
+    nonce = get_random_bytes(NONCE_SIZE)
+    return b''.join((data_key.header, nonce, data_key.cipher.encrypt(nonce, data, data_key.header)))
+
+
+def decrypt(value: bytes):
+    """decrypt value made by `encrypt`
+    raises ValueError if value is not encrypted, tampered or its RSA key is unknown
+    """
+    value = bytes(value)
+    if not is_encrypted(value):
+        raise ValueError('value is not encrypted')
+    offset = len(MAGIC)
+    fingerprint = value[offset:offset + FINGERPRINT_SIZE]
+    offset += FINGERPRINT_SIZE
+    (length,) = struct.unpack('>H', value[offset:offset + 2])
+    offset += 2
+    wrapped = value[offset:offset + length]
+    offset += length
+    header = value[:offset]
+    nonce = value[offset:offset + NONCE_SIZE]
+    try:
+        return _unwrap(fingerprint, wrapped).decrypt(nonce, value[offset + NONCE_SIZE:], header)
+    except InvalidTag:
+        raise ValueError('value is tampered or corrupted')
+
+
+def encrypt_message(message):
+    """encrypt message (string or list/tuple/set of strings) as one envelope (see `encrypt`)"""
+    if type(message) in [list, tuple, set]:
+        return encrypt(MESSAGE_LIST + json.dumps(list(message)).encode('UTF-8'))
+    return encrypt(MESSAGE_STR + message.encode('UTF-8'))
+
+
+def decrypt_message(encrypted_msg):
+    """decrypt message made by `encrypt_message`
+    returns bytes (or list of bytes for encrypted lists)
+    """
+    data = decrypt(encrypted_msg)
+    if data[:1] == MESSAGE_LIST:
+        return [item.encode('UTF-8') for item in json.loads(data[1:])]
+    return data[1:]
@@ -0,0 +1,16 @@
+from django_redis.serializers.pickle import PickleSerializer
+
+from sage_cache.security.encryption import decrypt, encrypt
+
+
+class EncryptedPickleSerializer(PickleSerializer):
+    """django_redis serializer encrypting every cached value at rest (see `encryption.encrypt`)
+    raises ValueError for values which can't be decrypted (plaintext values stored before encryption
+    was enabled, unknown RSA key or tampered values), `client.EncryptedClient` reads them as cache misses
+    """
+
+    def dumps(self, value):
+        return encrypt(super().dumps(value))
+
+    def loads(self, value):
+        return super().loads(decrypt(value))
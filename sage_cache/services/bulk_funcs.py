@@ -0,0 +1,192 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import close_old_connections
+
+from sage_cache import settings
+from sage_cache.services.cache_funcs import (
+    aget_entries,
+    dump_for_cache,
+    get_entries,
+    get_queryset_for_cache,
+    get_storage,
+    load_cached,
+    make_meta,
+)
+from sage_cache.services.chunk_funcs import dump_chunks
+from sage_cache.services.delta_funcs import is_delta_enabled, update_snapshot
+from sage_cache.services.key_funcs import make_meta_key, make_site_key, register_model_keys
+from sage_cache.services.metrics import incr, observe, timer
+from sage_cache.services.stampede_funcs import is_expired
+from sage_cache.services.timeout_funcs import get_timeout_policy
+from sage_cache.signals import get_cached_models
+
+
+def get_model_classes(models):
+    """[(item, model class)] of models (model classes or CACHE_KEYs of ModelCacheMixin models)"""
+    by_cache_key = None
+    model_classes = []
+    for item in models:
+        if isinstance(item, str):
+            if by_cache_key is None:
+                by_cache_key = {model_class.CACHE_KEY: model_class for model_class in get_cached_models()}
+            if item not in by_cache_key:
+                raise LookupError(f'no cached model with CACHE_KEY `{item}`')
+            model_classes.append((item, by_cache_key[item]))
+        else:
+            if not hasattr(item, 'CACHE_KEY'):
+                raise AttributeError('CACHE_KEY must be defined in {}'.format(item.__name__))
+            model_classes.append((item, item))
+    return model_classes
+
+
+def _read_entry(model_class, key, value, meta, xfetch_beta):
+    """cached value of a fetched entry or None if it must be recomputed
+    snapshots of change logged models are brought up to date (see `update_snapshot`)
+    """
+    if value is None or is_expired(meta, beta=xfetch_beta):
+        return None
+    if is_delta_enabled(model_class):
+        return update_snapshot(key, value, meta, model_class)
+    return value
+
+
+def _compute(model_class, storage):
+    """(value stored in cache, recompute seconds) of model"""
+    started = time.perf_counter()
+    value = dump_for_cache(get_queryset_for_cache(model_class), storage=get_storage(model_class, storage))
+    return value, time.perf_counter() - started
+
+
+def _compute_in_thread(model_class, storage):
+    try:
+        close_old_connections()
+        return _compute(model_class, storage)
+    finally:
+        close_old_connections()
+
+
+def recompute_many(model_classes, timeout, storage: str = None, concurrency: int = None):
+    """compute values of model classes in a bounded thread pool and store them with one pipeline
+    returns {model class: value stored in cache}
+    NOTE: a single model is computed in the calling thread
+    """
+    model_classes = list(model_classes)
+    if not model_classes:
+        return {}
+    concurrency = concurrency or settings.CACHE_BULK_CONCURRENCY
+    if len(model_classes) == 1 or concurrency == 1:
+        results = [_compute(model_class, storage) for model_class in model_classes]
+    else:
+        with ThreadPoolExecutor(
+            max_workers=min(concurrency, len(model_classes)), thread_name_prefix='sage_cache_bulk'
+        ) as executor:
+            results = list(executor.map(_compute_in_thread, model_classes, [storage] * len(model_classes)))
+
+    stale_timeout = max(settings.CACHE_STALE_TIMEOUT or 0, settings.CACHE_STALE_WHILE_REVALIDATE or 0)
+    physical_timeout = timeout + stale_timeout if timeout and stale_timeout else timeout
+    policy = get_timeout_policy() if settings.CACHE_ADAPTIVE_TIMEOUT else None
+    values = {}
+    registered = {}
+    manifests = {}
+    computed = {}
+    for model_class, (value, delta) in zip(model_classes, results):
+        key = make_site_key(model_class.CACHE_KEY)
+        keys = registered.setdefault(model_class.CACHE_KEY, [])
+        computed[model_class] = entry = value
+        if get_storage(model_class, storage) == 'chunked':
+            entry, chunks = dump_chunks(key, value)
+            values.update(chunks)
+            keys.extend(chunks)
+            manifests[model_class.CACHE_KEY] = [key]
+        values[key] = entry
+        values[make_meta_key(key)] = make_meta(timeout, delta)
+        keys.append(key)
+        observe('recompute_seconds', model_class.CACHE_KEY, delta)
+        if policy is not None:
+            size = len(value) if isinstance(value, bytes) else None
+            policy.record_recompute(key, delta, size=size, timeout=timeout)
+    cache.set_many(values, physical_timeout)
+    register_model_keys(registered, timeout=physical_timeout, manifests=manifests)
+    return computed
+
+
+def _split(model_classes, entries, xfetch_beta):
+    """({model class: cached value} of hits, [model class] of misses) of fetched entries"""
+    policy = get_timeout_policy() if settings.CACHE_ADAPTIVE_TIMEOUT else None
+    hits, misses = {}, []
+    for model_class in model_classes:
+        key = make_site_key(model_class.CACHE_KEY)
+        value, meta = entries.get(key, (None, None))
+        cached = _read_entry(model_class, key, value, meta, xfetch_beta)
+        if cached is None:
+            incr('misses', model_class.CACHE_KEY)
+            misses.append(model_class)
+            if policy is not None:
+                policy.record_miss(key, missing=value is None)
+        else:
+            incr('hits', model_class.CACHE_KEY)
+            hits[model_class] = cached
+            if policy is not None:
+                policy.record_hit(key, meta)
+    return hits, misses
+
+
+def _load_all(pairs, values, lazy):
+    return {
+        item: load_cached(values[model_class], model_class, lazy, model_class.CACHE_KEY)
+        for item, model_class in pairs
+    }
+
+
+def get_many_from_cache(models, timeout=None, storage: str = None, lazy=False, concurrency: int = None,
+                        xfetch_beta=None):
+    """cached querysets of several models with one round trip
+    models: model classes or CACHE_KEYs of ModelCacheMixin models (site keys are read)
+    site keys and their metas are read with one MGET, missed (or expired) models are recomputed
+    concurrently (concurrency threads, default CACHE_BULK_CONCURRENCY) and stored with one pipeline
+    returns {item of models: queryset/list} (see `get_all_from_cache` for lazy and storage)
+    NOTE: timeout default is CACHE_TIMEOUT, xfetch_beta default is CACHE_XFETCH_BETA
+    NOTE: misses are recomputed without stampede lock, use `get_all_from_cache` for lock/stale options
+    """
+    pairs = get_model_classes(models)
+    model_classes = list(dict.fromkeys(model_class for _, model_class in pairs))
+    timeout = settings.CACHE_TIMEOUT if timeout is None else timeout
+    xfetch_beta = settings.CACHE_XFETCH_BETA if xfetch_beta is None else xfetch_beta
+    storage = 'queryset' if lazy else storage
+
+    with timer('redis_seconds', 'bulk'):
+        entries = get_entries([make_site_key(model_class.CACHE_KEY) for model_class in model_classes])
+    values, misses = _split(model_classes, entries, xfetch_beta)
+    values.update(recompute_many(misses, timeout, storage=storage, concurrency=concurrency))
+    return _load_all(pairs, values, lazy)
+
+
+async def aget_many_from_cache(models, timeout=None, storage: str = None, lazy=False, concurrency: int = None,
+                               xfetch_beta=None):
+    """async `get_many_from_cache`
+    hits are read with one MGET on asyncio redis client,
+    misses and change logged models are handled in one thread with `sync_to_async`
+    """
+    pairs = get_model_classes(models)
+    model_classes = list(dict.fromkeys(model_class for _, model_class in pairs))
+    timeout = settings.CACHE_TIMEOUT if timeout is None else timeout
+    xfetch_beta = settings.CACHE_XFETCH_BETA if xfetch_beta is None else xfetch_beta
+    storage = 'queryset' if lazy else storage
+
+    with timer('redis_seconds', 'bulk'):
+        entries = await aget_entries([make_site_key(model_class.CACHE_KEY) for model_class in model_classes])
+    deferred = [model_class for model_class in model_classes if is_delta_enabled(model_class)]
+    values, misses = _split([model_class for model_class in model_classes if model_class not in deferred],
+                            entries, xfetch_beta)
+
+    if deferred or misses:
+        def resolve():
+            hits, deferred_misses = _split(deferred, entries, xfetch_beta)
+            hits.update(recompute_many(misses + deferred_misses, timeout, storage=storage, concurrency=concurrency))
+            return hits
+
+        values.update(await sync_to_async(resolve)())
+    return _load_all(pairs, values, lazy)
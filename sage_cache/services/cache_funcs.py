@@ -1,152 +1,587 @@
+import logging
 import operator
+import time
+import uuid
 import warnings
 
+from asgiref.sync import sync_to_async
 from django.core.cache import cache
 from django.db.models import QuerySet
 
 from sage_cache import settings
+from sage_cache.services.chunk_funcs import ChunkedRows, dump_chunks, get_chunk_keys, is_manifest, merge_chunks
+from sage_cache.services.delta_funcs import get_delta_head, is_delta_enabled, update_snapshot
+from sage_cache.services.invalidation_funcs import (
+    run_async,
+    scan_and_unlink,
+    scan_and_unlink_many,
+    unlink_keys,
+)
+from sage_cache.services.key_funcs import (
+    get_async_redis_client,
+    register_key,
+    register_manifest,
+    get_keys_for_model,
+    get_keys_for_users,
+    get_keys_for_model_and_user,
+    drop_model_index,
+    drop_user_indexes,
+    make_meta_key,
+    unregister_keys,
+)
+from sage_cache.services.local_cache import get_local_cache
+from sage_cache.services.metrics import incr, observe, timed, timer
+from sage_cache.services.refresh_funcs import schedule_refresh
+from sage_cache.services.stampede_funcs import is_expired, recompute
+from sage_cache.services.timeout_funcs import get_timeout_policy
+from sage_cache.services.storage_funcs import (
+    CachedRows,
+    decode,
+    dump_queryset,
+    dump_rows,
+    encode,
+    is_encoded,
+    is_in_filter,
+)
 
+logger = logging.getLogger(__name__)
 
-def get_all_from_cache(model_class, timeout, get_cache_key, set_cache_key, **kwargs):
+
+def get_queryset_for_cache(model_class):
+    """queryset of model which is stored in cache"""
+    queryset = model_class.objects.all()
+    if hasattr(model_class, 'CACHED_RELATED_OBJECT'):
+        # select related
+        queryset = queryset.select_related(*model_class.CACHED_RELATED_OBJECT)
+    return queryset
+
+
+def get_storage(model_class, storage: str = None):
+    """storage format of model caches (storage or CACHE_STORAGE_FORMAT, always 'rows' with CACHE_DELTA_LOG)"""
+    if is_delta_enabled(model_class):
+        return 'rows'
+    return storage or settings.CACHE_STORAGE_FORMAT
+
+
+def dump_for_cache(queryset, storage: str = None, indexed_fields=None, search_fields=None, chunk_size=None):
+    """make value stored in cache
+    storage='queryset' pickles QuerySet object
+    storage='rows' stores compact column oriented values, hash and search indexes (see storage_funcs)
+    storage='chunked' returns rows payload which is split into chunks when it's stored (see chunk_funcs)
+    NOTE: with chunk_size, rows are read from database in chunks (not for storage='queryset')
+    NOTE: rows of CACHE_DELTA_LOG models store the change log head read before the query (see delta_funcs)
+    """
+    storage = storage or settings.CACHE_STORAGE_FORMAT
+    if storage == 'rows':
+        model_class = queryset.model
+        return dump_queryset(
+            queryset,
+            indexed_fields=indexed_fields,
+            search_fields=search_fields,
+            chunk_size=chunk_size,
+            delta_id=get_delta_head(model_class.CACHE_KEY) if is_delta_enabled(model_class) else None
+        )
+    if storage == 'chunked':
+        return dump_rows(queryset, indexed_fields=indexed_fields, search=False, chunk_size=chunk_size)
+    return queryset
+
+
+def load_from_cache(value, model_class, lazy=False):
+    """make queryset/list from value stored in cache (or local cache)
+    chunked entries are loaded as ChunkedRows (chunks are fetched on access)
+    """
+    if is_manifest(value):
+        return ChunkedRows(value, model_class=model_class)
+    if is_encoded(value):
+        value = decode(value)
+    if isinstance(value, dict):
+        rows = CachedRows(value, model_class=model_class)
+        if lazy:
+            pks = rows.column(model_class._meta.pk.attname)
+            return model_class.objects.filter(pk__in=pks)
+        return rows
+    return value if lazy else list(value)
+
+
+def load_cached(value, model_class, lazy, cache_key):
+    """`load_from_cache` recording payload size and deserialize time metrics"""
+    if settings.CACHE_METRICS_ENABLED and isinstance(value, bytes):
+        observe('payload_bytes', cache_key, len(value))
+    with timer('deserialize_seconds', cache_key):
+        return load_from_cache(value, model_class, lazy=lazy)
+
+
+def _get_metric_key(model_class, kwargs):
+    """CACHE_KEY label of metrics"""
+    return kwargs.get('cache_key') or getattr(model_class, 'CACHE_KEY', model_class.__name__)
+
+
+def _to_local(value):
+    """(local value, size) for local cache
+    rows payloads are kept decoded, QuerySets are kept pickled so every hit gets fresh instances
+    """
+    if isinstance(value, dict):
+        return value, 0
+    if is_encoded(value):
+        return decode(value), len(value)
+    encoded = encode(value, encoding='pickle', compression=None)
+    return encoded, len(encoded)
+
+
+def get_entry(key: str):
+    """get (value, meta) of key
+    meta: {'version': token, 'expires_at': timestamp, 'delta': recompute seconds} or None
+    when CACHE_L1_ENABLED, value is served from local cache while its version token is unchanged
+    chunked entries are returned as manifest (chunks are loaded on access, see `ChunkedRows`)
+    or as rows payload when they're kept in local cache (chunks are fetched with one MGET)
+    """
+    return get_entries([key])[key]
+
+
+def _from_local(keys, metas):
+    """{key: (value, meta)} of keys served from local cache (see `get_entry`)"""
+    local_cache = get_local_cache()
+    entries = {}
+    for key in keys:
+        meta = metas.get(make_meta_key(key))
+        value = local_cache.get(key, meta['version'] if meta else None)
+        if value is not None:
+            entries[key] = (value, meta)
+    return entries
+
+
+def _to_entries(keys, values, chunks=None):
+    """{key: (value, meta)} of keys from fetched values and metas
+    with chunks (fetched chunk values), chunked entries are merged into rows payloads
+    fetched values are kept in local cache when CACHE_L1_ENABLED
+    """
+    entries = {}
+    for key in keys:
+        value = values.get(key)
+        meta = values.get(make_meta_key(key))
+        size = 0
+        if is_manifest(value) and chunks is not None:
+            value, size = merge_chunks(value, chunks)
+        if settings.CACHE_L1_ENABLED and value is not None and meta is not None:
+            local_value, local_size = _to_local(value)
+            get_local_cache().set(key, local_value, meta['version'], size=size or local_size)
+        entries[key] = (value, meta)
+    return entries
+
+
+def get_entries(keys: list):
+    """{key: (value, meta)} of keys (see `get_entry`) with one MGET of values and metas
+    (with CACHE_L1_ENABLED, metas are read first and only values missing in local cache are fetched)
+    """
+    entries = {}
+    if settings.CACHE_L1_ENABLED:
+        entries = _from_local(keys, cache.get_many([make_meta_key(key) for key in keys]))
+    keys = [key for key in keys if key not in entries]
+    if not keys:
+        return entries
+
+    values = cache.get_many(keys + [make_meta_key(key) for key in keys])
+    chunks = None
+    if settings.CACHE_L1_ENABLED:
+        chunk_keys = [chunk for key in keys if is_manifest(values.get(key)) for chunk in get_chunk_keys(values[key])]
+        if chunk_keys:
+            chunks = cache.get_many(chunk_keys)
+    entries.update(_to_entries(keys, values, chunks))
+    return entries
+
+
+async def aget_many(keys: list):
+    """async `cache.get_many` with one MGET on asyncio redis client
+    values are decoded by the cache client (its serializer and compressor, e.g EncryptedPickleSerializer)
+    returns dict of found keys
+    NOTE: values which can't be decoded with ValueError (e.g undecryptable values) are left out
+    """
+    if not keys:
+        return {}
+    values = await get_async_redis_client().mget([cache.make_key(key) for key in keys])
+    found = {}
+    for key, value in zip(keys, values):
+        if value is None:
+            continue
+        try:
+            found[key] = cache.client.decode(value)
+        except ValueError as e:
+            logger.warning('cached value of `%s` is dropped: %s', key, e)
+    return found
+
+
+async def aget_entry(key: str):
+    """async `get_entry` (no threads, cache is read with asyncio redis client)
+    chunked entries are always returned as rows payload
+    """
+    return (await aget_entries([key]))[key]
+
+
+async def aget_entries(keys: list):
+    """async `get_entries` (one MGET of values and metas, one MGET of chunks of chunked entries)
+    chunked entries are always returned as rows payload
+    """
+    entries = {}
+    if settings.CACHE_L1_ENABLED:
+        entries = _from_local(keys, await aget_many([make_meta_key(key) for key in keys]))
+    keys = [key for key in keys if key not in entries]
+    if not keys:
+        return entries
+
+    values = await aget_many(keys + [make_meta_key(key) for key in keys])
+    chunk_keys = [chunk for key in keys if is_manifest(values.get(key)) for chunk in get_chunk_keys(values[key])]
+    entries.update(_to_entries(keys, values, await aget_many(chunk_keys)))
+    return entries
+
+
+def get_value(key: str):
+    """get value of key (see `get_entry`)"""
+    return get_entry(key)[0]
+
+
+def make_meta(timeout, delta: float = 0):
+    """new meta of a value which is fresh for timeout seconds"""
+    return {
+        'version': uuid.uuid4().hex,
+        'expires_at': time.time() + timeout if timeout else None,
+        'delta': delta,
+    }
+
+
+def set_entry(key: str, value, timeout, delta: float = 0, stale_timeout=None):
+    """set value of key and its meta
+    with stale_timeout, value is kept `stale_timeout` seconds after its logical expiry
+    to be served while it's recomputed
+    """
+    meta = make_meta(timeout, delta)
+    if timeout and stale_timeout:
+        timeout += stale_timeout
+    cache.set_many({key: value, make_meta_key(key): meta}, timeout)
+    return meta
+
+
+def set_value(key: str, value, timeout):
+    """set value of key (see `set_entry`)"""
+    set_entry(key, value, timeout)
+
+
+def _get_option(kwargs, name, default):
+    """kwarg value or default if it's not passed (or None)"""
+    value = kwargs.get(name)
+    return default if value is None else value
+
+
+def get_all_from_cache(model_class, timeout, get_cache_key=None, set_cache_key=None, **kwargs):
     """get/set all queryset from cache
     if lazy=True return QuerySet
-    else returns list
+    else returns list (CachedRows when storage='rows')
+    lookups are done on the exact `set_cache_key` and registered in key registry
+    (`cache_key`/`user_id` kwargs are used for model/user index sets)
+    stampede protection kwargs (defaults from settings):
+        lock: only one worker recomputes a missed key (CACHE_STAMPEDE_LOCK)
+        stale_timeout: seconds an expired value is served while it's recomputed (CACHE_STALE_TIMEOUT)
+        xfetch_beta: probabilistic early recompute, 0 disables (CACHE_XFETCH_BETA)
+        stale_while_revalidate: seconds an expired value is served right away while
+            it's refreshed in background thread pool (CACHE_STALE_WHILE_REVALIDATE)
+    NOTE: storage kwarg overrides CACHE_STORAGE_FORMAT, lazy mode always stores QuerySet
+    NOTE: in rows storage, CACHE_INDEXED_FIELDS of model (or `indexed_fields` kwarg) are indexed
+    and CACHE_SEARCH_FIELDS of model (or `search_fields` kwarg) get n-gram search indexes
     NOTE: get_cache_key can be a pattern for searching in cache. e.g: '*-products-*'
+    NOTE: get_cache_key runs a KEYS command on redis and is deprecated
+    """
+    with timer('redis_seconds', _get_metric_key(model_class, kwargs)):
+        if get_cache_key is not None and get_cache_key != set_cache_key:
+            warnings.warn(
+                'get_cache_key patterns are deprecated, pass the exact set_cache_key instead.',
+                DeprecationWarning
+            )
+            keys = cache.keys(get_cache_key)
+            value = cache.get(keys[0]) if keys else None
+            meta = None
+        else:
+            value, meta = get_entry(set_cache_key)
+
+    return _load_or_recompute(model_class, timeout, set_cache_key, value, meta, **kwargs)
+
+
+async def aget_all_from_cache(model_class, timeout, set_cache_key=None, **kwargs):
+    """async `get_all_from_cache`
+    cache hits are read with asyncio redis client and don't block the event loop or use threads,
+    misses (database queries) are recomputed in a thread with `sync_to_async`
+    NOTE: independent calls can be gathered, e.g `await asyncio.gather(aget_all_from_cache(...), ...)`
     """
+    metric_key = _get_metric_key(model_class, kwargs)
+    with timer('redis_seconds', metric_key):
+        value, meta = await aget_entry(set_cache_key)
+    xfetch_beta = _get_option(kwargs, 'xfetch_beta', settings.CACHE_XFETCH_BETA)
+    # snapshots of change logged models are updated in a thread (see `update_snapshot`)
+    if value is not None and not is_expired(meta, beta=xfetch_beta) and not is_delta_enabled(model_class):
+        incr('hits', metric_key)
+        if settings.CACHE_ADAPTIVE_TIMEOUT:
+            get_timeout_policy().record_hit(set_cache_key, meta)
+        return load_cached(value, model_class, kwargs.get('lazy', False), metric_key)
+
+    return await sync_to_async(_load_or_recompute)(model_class, timeout, set_cache_key, value, meta, **kwargs)
+
+
+def _load_or_recompute(model_class, timeout, set_cache_key, value, meta, **kwargs):
+    """load cached value or recompute it (see `get_all_from_cache` for kwargs)"""
     lazy = kwargs.get('lazy', False)
+    storage = get_storage(model_class, 'queryset' if lazy else kwargs.get('storage'))
+    cache_key = kwargs.get('cache_key', getattr(model_class, 'CACHE_KEY', None))
+    user_id = kwargs.get('user_id')
+    lock = _get_option(kwargs, 'lock', settings.CACHE_STAMPEDE_LOCK)
+    stale_timeout = _get_option(kwargs, 'stale_timeout', settings.CACHE_STALE_TIMEOUT)
+    xfetch_beta = _get_option(kwargs, 'xfetch_beta', settings.CACHE_XFETCH_BETA)
+    stale_while_revalidate = _get_option(
+        kwargs, 'stale_while_revalidate', settings.CACHE_STALE_WHILE_REVALIDATE
+    )
+    stale_timeout = max(stale_timeout or 0, stale_while_revalidate or 0)
+    metric_key = _get_metric_key(model_class, kwargs)
+    policy = get_timeout_policy() if settings.CACHE_ADAPTIVE_TIMEOUT else None
 
-    if hasattr(model_class, 'CACHED_RELATED_OBJECT'):
-        # select related
+    if value is not None and not is_expired(meta, beta=xfetch_beta):
+        if is_delta_enabled(model_class):
+            # apply logged changes, snapshots which can't be updated are recomputed
+            value = update_snapshot(set_cache_key, value, meta, model_class)
+        if value is not None:
+            incr('hits', metric_key)
+            if policy is not None:
+                policy.record_hit(set_cache_key, meta)
+            return load_cached(value, model_class, lazy, metric_key)
 
-        keys = cache.keys(get_cache_key)
-        if keys:
-            queryset = cache.get(keys[0])
-        else:
-            cache.set(
-                set_cache_key,
-                model_class.objects.all().select_related(**model_class.CACHED_RELATED_OBJECT),
-                timeout
-            )
-            queryset = cache.get(set_cache_key)
+    def compute():
+        return dump_for_cache(
+            get_queryset_for_cache(model_class),
+            storage=storage,
+            indexed_fields=kwargs.get('indexed_fields'),
+            search_fields=kwargs.get('search_fields')
+        )
 
-    else:
-        keys = cache.keys(get_cache_key)
-        if keys:
-            queryset = cache.get(keys[0])
-        else:
-            cache.set(
-                set_cache_key,
-                model_class.objects.all(),
-                timeout
-            )
-            queryset = cache.get(set_cache_key)
+    def store(new_value, delta):
+        observe('recompute_seconds', metric_key, delta)
+        keys = [set_cache_key]
+        physical_timeout = timeout + stale_timeout if timeout and stale_timeout else timeout
+        if storage == 'chunked':
+            new_value, chunks = dump_chunks(set_cache_key, new_value)
+            cache.set_many(chunks, physical_timeout)
+            keys.extend(chunks)
+            if settings.CACHE_METRICS_ENABLED:
+                observe('payload_bytes', metric_key, sum(len(chunk) for chunk in chunks.values()))
+        elif settings.CACHE_METRICS_ENABLED and isinstance(new_value, bytes):
+            observe('payload_bytes', metric_key, len(new_value))
+        set_entry(set_cache_key, new_value, timeout, delta=delta, stale_timeout=stale_timeout)
+        register_key(keys, cache_key=cache_key, user_id=user_id, timeout=physical_timeout)
+        if storage == 'chunked' and cache_key is not None:
+            register_manifest(set_cache_key, cache_key, timeout=physical_timeout)
+        if policy is not None:
+            size = len(new_value) if isinstance(new_value, bytes) else None
+            policy.record_recompute(set_cache_key, delta, size=size, timeout=timeout)
 
-    return queryset if lazy else list(queryset)
+    if value is not None and stale_while_revalidate:
+        # serve stale value, one worker refreshes it in background
+        schedule_refresh(
+            set_cache_key,
+            lambda: recompute(set_cache_key, compute, store, stale=value, lock=True, cache_key=metric_key)
+        )
+        incr('stale_hits', metric_key)
+        if policy is not None:
+            policy.record_hit(set_cache_key)
+        return load_cached(value, model_class, lazy, metric_key)
+
+    incr('misses', metric_key)
+    if policy is not None:
+        policy.record_miss(set_cache_key, missing=value is None)
+    value = recompute(
+        set_cache_key,
+        compute,
+        store,
+        read=lambda: get_value(set_cache_key),
+        stale=value,
+        lock=lock,
+        cache_key=metric_key
+    )
+    return load_cached(value, model_class, lazy, metric_key)
+
+
+def _match(get_value, operator_, filters):
+    """check filters on values returned by get_value(filter_key)
+    operator.contains/operator.or_ select item if any filter matches
+    list, tuple and set filter values are matched with `in` (see `is_in_filter`)
+    """
+    select = True
+    for filter_key, filter_value in filters.items():
+        select = True  # boolean indicating if the item should be selected
+        if is_in_filter(filter_value):
+            if get_value(filter_key) not in filter_value:
+                select = False
+                if operator_ not in [operator.contains, operator.or_]:
+                    break
+        elif not operator_(get_value(filter_key), filter_value):
+            select = False
+            if operator_ not in [operator.contains, operator.or_]:
+                break
+        if operator_ in [operator.contains, operator.or_]:
+            if select:
+                break
+    return select
+
+
+def filter_rows(rows, operator_=operator.eq, **filters):
+    """filter CachedRows without building model instances
+    equality/`in` filters on indexed fields are dictionary lookups and set intersections,
+    other filters on stored fields are checked on raw columns
+    returns None if a filter key is not a stored field
+    """
+    if operator_ is operator.eq:
+        indexed = rows.filter_indexed(**filters)
+        if indexed is not None:
+            return indexed
 
+    if not all(name in rows.fields for name in filters):
+        return None
 
+    columns = {name: rows.columns[rows.fields.index(name)] for name in filters}
+    positions = [
+        position for position in rows.get_positions()
+        if _match(lambda name: columns[name][position], operator_, filters)
+    ]
+    return rows.subset(positions)
+
+
+@timed('filter_seconds')
 def filter_from_cache(queryset, operator_=operator.eq, **kwargs):
     """filter queryset from cache
     filter based on `operator_` (must be from operator module)
     if lazy=True return QuerySet
-    else returns list
+    else returns list (CachedRows when queryset is CachedRows)
     """
-    lazy = kwargs.get('lazy', False)
+    lazy = kwargs.pop('lazy', False)
 
     if lazy and not isinstance(queryset, QuerySet):
         raise TypeError('in lazy mode just QuerySet is allowed')
 
-    def filter_obj(obj):
-        select = True
-        for filter_key, filter_value in kwargs.items():
-            select = True  # boolean indicating if the item should be selected
-            if isinstance(filter_value, list):
-                if getattr(obj, filter_key) not in filter_value:
-                    select = False
-                    if operator_ not in [operator.contains, operator.or_]:
-                        break
-            elif not operator_(getattr(obj, filter_key), filter_value):
-                select = False
-                if operator_ not in [operator.contains, operator.or_]:
-                    break
-            if operator_ in [operator.contains, operator.or_]:
-                if select:
-                    break
-        return select
+    if lazy:
+        return queryset.filter(**kwargs)
 
-    return list(filter(filter_obj, queryset)) if not lazy else queryset.filter(**kwargs)
+    if isinstance(queryset, ChunkedRows):
+        queryset = queryset.rows()
 
+    if isinstance(queryset, CachedRows):
+        rows = filter_rows(queryset, operator_, **kwargs)
+        if rows is not None:
+            return rows
 
+    return list(filter(lambda obj: _match(lambda name: getattr(obj, name), operator_, kwargs), queryset))
+
+
+@timed('filter_seconds')
 def filter_related_from_cache(queryset, **kwargs):
     """filter related from cache
     if lazy=True return QuerySet
-    else returns list
+    else returns list (CachedRows when queryset is CachedRows)
     """
-    lazy = kwargs.get('lazy', False)
+    lazy = kwargs.pop('lazy', False)
 
     if lazy and not isinstance(queryset, QuerySet):
         raise TypeError('in lazy mode just QuerySet is allowed')
 
-    if not lazy:
-        for foreign_key, related_filters in kwargs.items():
-            related_objects_list = [getattr(obj, foreign_key) for obj in queryset]
-            # Filtering related objects based related object's attribute filters
-            filtered_related_objects = filter_from_cache(
-                related_objects_list, **related_filters
-            )
-            # Filtering queryset based filtered related objects
-            queryset = list(
-                filter(
-                    lambda x: getattr(x, foreign_key) in filtered_related_objects,
-                    queryset,
-                )
-            )
-    else:
-        queryset = queryset.filter(**kwargs)
+    if lazy:
+        return queryset.filter(**kwargs)
+
+    if isinstance(queryset, ChunkedRows):
+        queryset = queryset.rows()
+
+    if isinstance(queryset, CachedRows):
+        # related fields are stored as 'foreign_key__field' columns
+        filters = {
+            '{}__{}'.format(foreign_key, name): value
+            for foreign_key, related_filters in kwargs.items()
+            for name, value in related_filters.items()
+        }
+        rows = filter_rows(queryset, **filters)
+        if rows is not None:
+            return rows
+
+    for foreign_key, related_filters in kwargs.items():
+        related_objects = {getattr(obj, foreign_key) for obj in queryset}
+        related_objects.discard(None)
+        # Filtering related objects based related object's attribute filters
+        filtered_related_objects = set(filter_from_cache(list(related_objects), **related_filters))
+        # Filtering queryset based filtered related objects
+        queryset = [obj for obj in queryset if getattr(obj, foreign_key) in filtered_related_objects]
 
     return queryset
 
 
-def clear_cache_for_users(users: list, pattern: str = '*{}*'):
+def _get_unique_attr():
+    """unique attr of user used in per user cache keys"""
+    if hasattr(settings, 'CACHE_PER_USER_UNIQUE_ATTR'):
+        return settings.CACHE_PER_USER_UNIQUE_ATTR
+    warnings.warn(
+        'CACHE_PER_USER_UNIQUE_ATTR is not defined in settings, Changed to use default value `id`.'
+    )
+    return 'id'
+
+
+def clear_cache_for_users(users: list, pattern: str = None):
     """removes all caches related to users arg
+    keys are resolved from key registry (no KEYS command) and removed with pipelined UNLINK
+    returns stats dict: scanned, deleted, elapsed
     NOTE: Default value of CACHE_PER_USER_UNIQUE_ATTR is 'id'
-    NOTE: You can change default search pattern
+    NOTE: You can pass a search pattern e.g '*{}*' (runs SCAN command)
     """
-    if hasattr(settings, 'CACHE_PER_USER_UNIQUE_ATTR'):
-        unique_attr = settings.CACHE_PER_USER_UNIQUE_ATTR
-    else:
-        warnings.warn(
-            'CACHE_PER_USER_UNIQUE_ATTR is not defined in settings, Changed to use default value `id`.'
-        )
-        unique_attr = 'id'
+    unique_attr = _get_unique_attr()
+    user_ids = [getattr(user, unique_attr) for user in users]
+
+    if pattern is not None:
+        return scan_and_unlink_many([pattern.format(user_id) for user_id in user_ids])
 
-    for user in users:
-        query = pattern.format(getattr(user, unique_attr))
-        keys = cache.keys(query)
-        cache.delete_many(keys)
+    stats = unlink_keys(get_keys_for_users(user_ids))
+    drop_user_indexes(user_ids)
+    return stats
 
 
-def clear_cache_for_model(cache_key: str, pattern: str = '*{}*'):
+def clear_cache_for_model(cache_key: str, pattern: str = None):
     """removes all caches of this model
-    NOTE: You can change default search pattern
+    keys are resolved from key registry (no KEYS command) and removed with pipelined UNLINK
+    returns stats dict: scanned, deleted, elapsed
+    NOTE: You can pass a search pattern e.g '*{}*' (runs SCAN command)
     """
-    query = pattern.format(cache_key)
-    keys = cache.keys(query)
-    cache.delete_many(keys)
+    if pattern is not None:
+        return scan_and_unlink(pattern.format(cache_key))
 
+    stats = unlink_keys(get_keys_for_model(cache_key))
+    drop_model_index(cache_key)
+    return stats
 
-def clear_model_cache_for_user(user, cache_key: str, pattern: str = '*{}*{}*'):
+
+def clear_model_cache_for_user(user, cache_key: str, pattern: str = None):
     """removes user's caches (filtered for cache_key)
-    NOTE: You can change default search pattern
+    keys are resolved from key registry (no KEYS command) and removed with pipelined UNLINK
+    returns stats dict: scanned, deleted, elapsed
+    NOTE: You can pass a search pattern e.g '*{}*{}*' (runs SCAN command)
     NOTE: Default value of CACHE_PER_USER_UNIQUE_ATTR is 'id'
     """
-    if hasattr(settings, 'CACHE_PER_USER_UNIQUE_ATTR'):
-        unique_attr = settings.CACHE_PER_USER_UNIQUE_ATTR
-    else:
-        warnings.warn(
-            'CACHE_PER_USER_UNIQUE_ATTR is not defined in settings, Changed to use default value.'
-        )
-        unique_attr = 'id'
+    user_id = getattr(user, _get_unique_attr())
 
-    query = pattern.format(getattr(user, unique_attr), cache_key)
-    keys = cache.keys(query)
-    cache.delete_many(keys)
+    if pattern is not None:
+        return scan_and_unlink(pattern.format(user_id, cache_key))
+
+    keys = get_keys_for_model_and_user(cache_key, user_id)
+    unregister_keys(keys, cache_key=cache_key, user_id=user_id)
+    return unlink_keys(keys)
+
+
+def clear_cache_for_users_async(users: list, pattern: str = None):
+    """`clear_cache_for_users` in background thread
+    returns Future of stats dict
+    """
+    return run_async(clear_cache_for_users, list(users), pattern=pattern)
+
+
+def clear_cache_for_model_async(cache_key: str, pattern: str = None):
+    """`clear_cache_for_model` in background thread
+    returns Future of stats dict
+    """
+    return run_async(clear_cache_for_model, cache_key, pattern=pattern)
@@ -0,0 +1,388 @@
+import bisect
+import itertools
+import time
+import uuid
+from collections.abc import Sequence
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from sage_cache import settings
+from sage_cache.services.invalidation_funcs import unlink_keys
+from sage_cache.services.key_funcs import (
+    get_keys_for_model,
+    get_manifest_keys,
+    is_chunk_key,
+    is_object_key,
+    is_overlay_key,
+    make_chunk_key,
+    make_meta_key,
+    register_key,
+    unregister_keys,
+)
+from sage_cache.services.stampede_funcs import acquire_lock, release_lock, wait_for_lock
+from sage_cache.services.storage_funcs import (
+    CachedRows,
+    build_indexes,
+    decode,
+    dump_rows,
+    append_rows,
+    encode,
+    merge_columns,
+    replace_rows,
+    split_columns,
+)
+
+OLD_CHUNK_TIMEOUT = 30  # seconds replaced chunks are kept for readers of the previous manifest
+
+
+def is_manifest(value):
+    """check value is the manifest of a chunked entry"""
+    return isinstance(value, dict) and value.get('format') == 'chunked'
+
+
+def get_chunk_key(manifest, number: int):
+    """key of a chunk of manifest (every chunk has its own version, a rewritten chunk gets a new key)"""
+    return make_chunk_key(manifest['key'], manifest['versions'][number], number)
+
+
+def get_chunk_keys(manifest):
+    """keys of all chunks of manifest"""
+    return [get_chunk_key(manifest, number) for number in range(len(manifest['counts']))]
+
+
+def get_pk_range(columns, pk_position: int):
+    """[min pk, max pk] of chunk columns or None for an empty chunk"""
+    pks = columns[pk_position] if columns else ()
+    return [min(pks), max(pks)] if pks else None
+
+
+def find_chunks(manifest, pks):
+    """sorted numbers of chunks which may hold rows of pks (pk is in [min pk, max pk] of chunk)"""
+    pks = list(pks)
+    return [
+        number for number, pk_range in enumerate(manifest['ranges'])
+        if pk_range is not None and any(pk_range[0] <= pk <= pk_range[1] for pk in pks)
+    ]
+
+
+def dump_chunks(key: str, payload, chunk_size: int = None):
+    """split rows payload (see `dump_rows`) into chunks of chunk_size consecutive rows (queryset order is kept)
+    returns (manifest, {chunk key: encoded chunk})
+    manifest is stored in key, chunks are stored in their own keys
+    manifest holds row count and primary key range of every chunk (used to find chunks of changed rows)
+    NOTE: default chunk_size is CACHE_CHUNK_SIZE
+    """
+    chunk_size = chunk_size or settings.CACHE_CHUNK_SIZE
+    fields = payload['fields']
+    columns = payload['columns']
+    manifest = {
+        'format': 'chunked',
+        'key': key,
+        'version': uuid.uuid4().hex,
+        'model': payload['model'],
+        'fields': fields,
+        'related': payload['related'],
+        'indexed': list(payload.get('indexes', {})),
+        'pk': apps.get_model(payload['model'])._meta.pk.attname,
+    }
+    pk_position = fields.index(manifest['pk'])
+    chunks = split_columns(columns, chunk_size)
+    manifest['counts'] = [len(chunk[pk_position]) for chunk in chunks]
+    manifest['ranges'] = [get_pk_range(chunk, pk_position) for chunk in chunks]
+    manifest['versions'] = [manifest['version']] * len(chunks)
+    return manifest, {
+        chunk_key: encode(chunk)
+        for chunk_key, chunk in zip(get_chunk_keys(manifest), chunks)
+    }
+
+
+def merge_chunks(manifest, values: dict):
+    """build rows payload from manifest and fetched chunks {chunk key: encoded chunk}
+    returns (payload, size in bytes) or (None, 0) if a chunk is missing
+    """
+    chunks = []
+    size = 0
+    for chunk_key in get_chunk_keys(manifest):
+        value = values.get(chunk_key)
+        if value is None:
+            return None, 0
+        size += len(value)
+        chunks.append(decode(value))
+
+    fields = manifest['fields']
+    columns = merge_columns(chunks)
+    return {
+        'model': manifest['model'],
+        'fields': fields,
+        'related': manifest['related'],
+        'columns': columns,
+        'indexes': build_indexes(fields, columns, manifest['indexed']),
+    }, size
+
+
+class ChunkedRows(Sequence):
+    """lazy sequence of model instances over a chunked entry
+    chunks are fetched (one MGET per access) and decoded only when their rows are accessed,
+    e.g a page of DRF pagination (`rows[20:40]`) only loads the chunks holding these rows
+    when a chunk is missing (evicted or entry is removed), the entry is reloaded as a whole (see `reload`)
+    NOTE: `rows()` loads all chunks as CachedRows (used by filters)
+    """
+
+    def __init__(self, manifest, model_class=None, using=DEFAULT_DB_ALIAS):
+        self.model = model_class or apps.get_model(manifest['model'])
+        self.using = using
+        self._set_manifest(manifest)
+
+    def _set_manifest(self, manifest):
+        self.manifest = manifest
+        self.fields = manifest['fields']
+        self.counts = manifest['counts']
+        self.offsets = list(itertools.accumulate([0] + self.counts[:-1]))
+        self._chunks = {}  # chunk number -> CachedRows
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._get_rows(range(*index.indices(len(self))))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('ChunkedRows index out of range')
+        rows = self._get_rows([index])
+        if not rows:  # entry is reloaded with less rows
+            raise IndexError('ChunkedRows index out of range')
+        return rows[0]
+
+    def __iter__(self):
+        number = 0
+        while number < len(self.counts):
+            manifest = self.manifest
+            self.load_chunks([number])
+            if self.manifest is not manifest:  # reloaded, continue from the same position in new entry
+                number = bisect.bisect_right(self.offsets, sum(manifest['counts'][:number])) - 1
+            yield from self._chunks[number]
+            number += 1
+
+    def _get_rows(self, indexes):
+        """rows at indexes, loading their chunks with one MGET"""
+        manifest = self.manifest
+        located = [self._locate(index) for index in indexes]
+        self.load_chunks({number for number, _ in located})
+        if self.manifest is not manifest:  # reloaded, rows are located in new entry
+            located = [self._locate(index) for index in indexes if index < len(self)]
+        return [self._chunks[number][row] for number, row in located]
+
+    def __repr__(self):
+        return '<ChunkedRows {} ({} rows, {} chunks)>'.format(self.model._meta.label, len(self), len(self.counts))
+
+    def _locate(self, index):
+        """(chunk number, row in chunk) of index"""
+        number = bisect.bisect_right(self.offsets, index) - 1
+        return number, index - self.offsets[number]
+
+    def _make_rows(self, columns):
+        payload = {
+            'model': self.manifest['model'],
+            'fields': self.fields,
+            'related': self.manifest['related'],
+            'columns': columns,
+        }
+        return CachedRows(payload, model_class=self.model, using=self.using)
+
+    def load_chunks(self, numbers):
+        """fetch and decode chunks which are not loaded yet (one MGET)
+        if a chunk is missing, the entry is reloaded (all chunks are loaded, manifest may change)
+        """
+        missing = [number for number in numbers if number not in self._chunks]
+        if not missing:
+            return
+        chunk_keys = {get_chunk_key(self.manifest, number): number for number in missing}
+        values = cache.get_many(list(chunk_keys))
+        if len(values) != len(chunk_keys):
+            self.reload()
+            return
+        for chunk_key, number in chunk_keys.items():
+            self._chunks[number] = self._make_rows(decode(values[chunk_key]))
+
+    def reload(self):
+        """load entry again after a chunk of manifest is missing
+        a newer manifest of the entry is used if all its chunks are stored, else rows are read from database
+        by the holder of recompute lock of key, other readers wait for it and use the manifest it stored
+        """
+        key = self.manifest['key']
+        newer = self._read_newer(key)
+        if newer is None:
+            token = acquire_lock(key)
+            if token is None:
+                newer, token = wait_for_lock(key, lambda: self._read_newer(key))
+            else:
+                newer = self._read_newer(key)  # may be stored right before the lock is acquired
+            if newer is None:
+                try:
+                    newer = self._recompute(key)
+                finally:
+                    release_lock(key, token)
+        self._set_chunks(*newer)
+
+    def _read_newer(self, key):
+        """(manifest, chunk payloads) of a newer manifest of key with all its chunks stored or None"""
+        current = cache.get(key)
+        if not is_manifest(current) or current['versions'] == self.manifest['versions']:
+            return None
+        chunk_keys = get_chunk_keys(current)
+        values = cache.get_many(chunk_keys)
+        if len(values) != len(chunk_keys):
+            return None
+        return current, [decode(values[chunk_key]) for chunk_key in chunk_keys]
+
+    def _recompute(self, key):
+        """(manifest, chunk payloads) read from database and stored as a new chunked entry
+        NOTE: entry is only stored while the key exists and isn't rewritten meanwhile
+        """
+        from sage_cache.services.cache_funcs import get_queryset_for_cache  # cache_funcs uses this module
+
+        current = cache.get(key)
+        payload = dump_rows(get_queryset_for_cache(self.model), indexed_fields=self.manifest['indexed'], search=False)
+        manifest, chunks = dump_chunks(key, payload)
+        ttl = cache.ttl(key)
+        if ttl != 0 and cache.get(key) == current:
+            cache.set_many(chunks, ttl)
+            cache.set(key, manifest, ttl)
+            register_key(list(chunks), cache_key=self.model.CACHE_KEY, timeout=ttl)
+            _touch_meta(key, ttl)
+        return manifest, [decode(chunk) for chunk in chunks.values()]
+
+    def _set_chunks(self, manifest, chunks):
+        self._set_manifest(manifest)
+        for number, columns in enumerate(chunks):
+            self._chunks[number] = self._make_rows(columns)
+
+    def get_chunk_numbers(self, pks):
+        """numbers of chunks holding rows of pks"""
+        return find_chunks(self.manifest, pks)
+
+    def rows(self, numbers=None):
+        """rows of chunks (default all chunks) as CachedRows with hash indexes"""
+        numbers = range(len(self.counts)) if numbers is None else numbers
+        self.load_chunks(numbers)
+        columns = merge_columns([self._chunks[number].columns for number in numbers])
+        rows = self._make_rows(columns)
+        rows.indexes = build_indexes(self.fields, columns, self.manifest['indexed'])
+        return rows
+
+
+def _touch_meta(key: str, ttl):
+    """set a new version token in meta of key (invalidates local caches of entry)"""
+    meta_key = make_meta_key(key)
+    meta = cache.get(meta_key)
+    if meta is not None:
+        meta['version'] = uuid.uuid4().hex
+        cache.set(meta_key, meta, ttl)
+
+
+def _fetch_rows(model_class, fields, pk_position, pks):
+    """{pk: value tuple} of current rows of pks"""
+    rows = model_class.objects.filter(pk__in=pks).values_list(*fields)
+    return {row[pk_position]: row for row in rows}
+
+
+def _update_entry(key: str, model_class, pks, fetched: dict):
+    """rewrite chunks of pks in chunked entry (and chunk row counts of its manifest)
+    fetched caches rows of pks per field list (entries of a model share their rows)
+    returns number of rewritten chunks or None if entry can't be updated (not chunked, missing or locked)
+    """
+    lock_id = f'{key}:chunks'
+    token = acquire_lock(lock_id)
+    if token is None:  # another worker is rewriting entry
+        return None
+
+    try:
+        manifest = cache.get(key)
+        ttl = cache.ttl(key)
+        if not is_manifest(manifest) or ttl == 0:
+            return None
+
+        fields = manifest['fields']
+        pk_position = fields.index(manifest['pk'])
+        if tuple(fields) not in fetched:
+            fetched[tuple(fields)] = _fetch_rows(model_class, fields, pk_position, pks)
+        rows = fetched[tuple(fields)]
+
+        # changed rows are replaced in place, new rows are appended to the last chunk
+        changed = {pk: rows.get(pk) for pk in pks}
+        last = len(manifest['counts']) - 1
+        numbers = find_chunks(manifest, pks)
+        if any(pk in rows for pk in pks) and last not in numbers:
+            numbers.append(last)
+        chunk_keys = {number: get_chunk_key(manifest, number) for number in numbers}
+        values = cache.get_many(list(chunk_keys.values()))
+        if len(values) != len(chunk_keys):
+            return None
+
+        chunks = {}
+        found = set()
+        for number, chunk_key in chunk_keys.items():
+            columns, chunk_found = replace_rows(decode(values[chunk_key]), pk_position, changed)
+            found.update(chunk_found)
+            if chunk_found:
+                chunks[number] = columns
+        added = [row for pk, row in changed.items() if row is not None and pk not in found]
+        if added:
+            columns = chunks[last] if last in chunks else decode(values[chunk_keys[last]])
+            chunks[last] = append_rows(columns, added)
+
+        # rewritten chunks get new keys, readers of the previous manifest still read old chunks until they expire
+        old_keys = [chunk_keys[number] for number in chunks]
+        for number, columns in chunks.items():
+            manifest['counts'][number] = len(columns[pk_position])
+            manifest['ranges'][number] = get_pk_range(columns, pk_position)
+            manifest['versions'][number] = uuid.uuid4().hex
+        chunks = {get_chunk_key(manifest, number): encode(columns) for number, columns in chunks.items()}
+        if not chunks:
+            return 0
+        cache.set_many(chunks, ttl)
+        cache.set(key, manifest, ttl)
+        register_key(list(chunks), cache_key=model_class.CACHE_KEY, timeout=ttl)
+        for chunk_key in old_keys:
+            cache.expire(chunk_key, min(ttl, OLD_CHUNK_TIMEOUT) if ttl else OLD_CHUNK_TIMEOUT)
+        unregister_keys(old_keys, cache_key=model_class.CACHE_KEY)
+        _touch_meta(key, ttl)
+        return len(chunks)
+    finally:
+        release_lock(lock_id, token)
+
+
+def update_chunks(cache_key: str, model_class, pks):
+    """rewrite only the chunks holding changed rows (pks) in chunked entries of model
+    changed rows are read again from database, deleted rows are removed
+    chunked entries are read from manifest index set of model (see `register_manifest`),
+    other entries of model (and chunked entries which can't be updated) are removed
+    NOTE: object caches and per user overlays are not touched, they're invalidated by signals
+    returns stats dict: scanned, deleted, updated (chunks), elapsed
+    """
+    started = time.perf_counter()
+    pks = list(pks)
+    manifests = get_manifest_keys(cache_key)
+    stale = [
+        key for key in set(get_keys_for_model(cache_key)) - set(manifests)
+        if not (is_chunk_key(key) or is_object_key(key) or is_overlay_key(key))
+    ]
+
+    updated = 0
+    fetched = {}
+    for key in manifests:
+        chunks = _update_entry(key, model_class, pks, fetched)
+        if chunks is None:
+            stale.append(key)
+        else:
+            updated += chunks
+
+    unregister_keys(stale, cache_key=cache_key)
+    stats = unlink_keys(stale)
+    stats['updated'] = updated
+    stats['elapsed'] = time.perf_counter() - started
+    return stats
@@ -0,0 +1,312 @@
+import bisect
+import threading
+import time
+import uuid
+
+from django.core.cache import cache
+
+from sage_cache import settings
+from sage_cache.services.key_funcs import (
+    get_keys_for_model,
+    get_redis_client,
+    is_chunk_key,
+    make_delta_key,
+    make_meta_key,
+)
+from sage_cache.services.stampede_funcs import acquire_lock, release_lock
+from sage_cache.services.storage_funcs import (
+    build_indexes,
+    build_search_index,
+    decode,
+    encode,
+    get_field_names,
+    get_related_paths,
+    is_encoded,
+    make_ngrams,
+)
+
+BASE = b'base'  # log entry snapshots start from when log is empty
+CHANGE = b'change'
+MISSING = object()  # old value of appended rows
+
+
+def is_delta_enabled(model_class):
+    """check model keeps a change log (CACHE_DELTA_LOG of model)
+    NOTE: snapshots of these models are always stored in rows format
+    """
+    return bool(getattr(model_class, 'CACHE_DELTA_LOG', False))
+
+
+def get_delta_head(cache_key: str):
+    """id of last entry of change log of CACHE_KEY, a base entry is added to an empty log
+    snapshots store the head read before their database query (see `dump_for_cache`)
+    """
+    client = get_redis_client()
+    log_key = make_delta_key(cache_key)
+    entries = client.xrevrange(log_key, count=1)
+    if entries:
+        return entries[0][0].decode()
+    return client.xadd(log_key, {'op': BASE}).decode()
+
+
+def dump_change(change):
+    """change log entry data of change
+    encoded payload goes through the cache client (serializer and compressor), so entries are encrypted
+    like cached values when `EncryptedPickleSerializer` is used
+    """
+    return cache.client.encode(encode(change, compression=None), allow_int=False)
+
+
+def load_change(data: bytes):
+    """change of change log entry data made by `dump_change`"""
+    return decode(cache.client.decode(data))
+
+
+def append_delta(model_class, pks):
+    """append current rows of pks (saved or deleted instances) to change log of model in one entry
+    nothing is logged (or queried) while no snapshot uses the log
+    returns entry id or None
+    """
+    client = get_redis_client()
+    log_key = make_delta_key(model_class.CACHE_KEY)
+    if not client.exists(log_key):
+        return None
+
+    fields = get_field_names(model_class, get_related_paths(model_class))
+    pk_position = fields.index(model_class._meta.pk.attname)
+    rows = [list(row) for row in model_class.objects.filter(pk__in=pks).values_list(*fields)]
+    found = {row[pk_position] for row in rows}
+    change = {'fields': fields, 'rows': rows, 'deleted': [pk for pk in pks if pk not in found]}
+    entry_id = client.xadd(
+        log_key,
+        {'op': CHANGE, 'data': dump_change(change)},
+        maxlen=settings.CACHE_DELTA_MAX_LENGTH,
+        approximate=True
+    )
+    return entry_id.decode()
+
+
+def read_delta(cache_key: str, delta_id: str):
+    """changes logged after entry delta_id as (last entry id, [change, ...])
+    returns None if entries after delta_id are trimmed or can't be decrypted (snapshot must be recomputed)
+    """
+    entries = get_redis_client().xrange(make_delta_key(cache_key), min=delta_id)
+    if not entries or entries[0][0].decode() != delta_id:
+        return None
+    try:
+        changes = [load_change(data[b'data']) for _, data in entries[1:] if data.get(b'op') == CHANGE]
+    except ValueError:
+        return None
+    return entries[-1][0].decode(), changes
+
+
+def _reindex(index, position, old, new):
+    """move position from posting list of old to new in a copied hash index
+    posting lists are copied before they're changed
+    """
+    if old is not MISSING and old == new:
+        return
+    if old is not MISSING and old in index:
+        index[old] = [item for item in index[old] if item != position]
+    index[new] = list(index.get(new, ()))
+    bisect.insort(index[new], position)
+
+
+def _research(index, position, old, new):
+    """move position between n-gram posting lists of old and new text in a copied search index"""
+    old_grams = make_ngrams(old) if old is not None and old is not MISSING else set()
+    new_grams = make_ngrams(new) if new is not None else set()
+    for gram in old_grams - new_grams:
+        index[gram] = [item for item in index.get(gram, ()) if item != position]
+    for gram in new_grams - old_grams:
+        index[gram] = list(index.get(gram, ()))
+        bisect.insort(index[gram], position)
+
+
+def apply_changes(model_class, payload, changes):
+    """new rows payload with changes applied (upserted rows are replaced in place or appended)
+    hash and search indexes are updated for changed rows, deletes rebuild them
+    payload is not modified (it may be shared by local cache)
+    returns None if changes are logged with other fields (e.g after a migration)
+    """
+    fields = payload['fields']
+    pk_position = fields.index(model_class._meta.pk.attname)
+    latest = {}
+    for change in changes:
+        if change['fields'] != fields:
+            return None
+        for row in change['rows']:
+            latest[row[pk_position]] = row
+        for pk in change['deleted']:
+            latest[pk] = None
+
+    payload = dict(payload)
+    if not latest:
+        return payload
+
+    columns = [list(column) for column in payload['columns']]
+    pk_column = columns[pk_position]
+    positions = {pk: position for position, pk in enumerate(pk_column) if pk in latest}
+    deleted = {pk for pk, row in latest.items() if row is None and pk in positions}
+    indexes = {name: dict(index) for name, index in payload.get('indexes', {}).items()}
+    search = {name: dict(index) for name, index in payload.get('search', {}).items()}
+    incremental = not deleted
+
+    for pk, row in latest.items():
+        if row is None:
+            continue
+        position = positions.get(pk)
+        if position is None:
+            position = len(pk_column)
+            old = [MISSING] * len(fields)
+            for column, value in zip(columns, row):
+                column.append(value)
+        else:
+            old = [column[position] for column in columns]
+            for column, value in zip(columns, row):
+                column[position] = value
+        if incremental:
+            for name, index in indexes.items():
+                field_position = fields.index(name)
+                _reindex(index, position, old[field_position], row[field_position])
+            for name, index in search.items():
+                field_position = fields.index(name)
+                _research(index, position, old[field_position], row[field_position])
+
+    if deleted:
+        keep = [position for position, pk in enumerate(pk_column) if pk not in deleted]
+        columns = [[column[position] for position in keep] for column in columns]
+        indexes = build_indexes(fields, columns, list(indexes))
+        search = {name: build_search_index(columns[fields.index(name)]) for name in search}
+
+    payload.update(columns=columns, indexes=indexes, search=search)
+    return payload
+
+
+def write_snapshot(key: str, payload, meta):
+    """store updated snapshot in key with its remaining ttl
+    meta gets a new version token, so local caches drop the old snapshot
+    """
+    ttl = cache.ttl(key)
+    if ttl == 0:  # key is expired or removed
+        return
+    meta = dict(meta or {}, version=uuid.uuid4().hex)
+    cache.set_many({key: encode(payload), make_meta_key(key): meta}, ttl)
+
+
+def write_back(key: str, payload, meta):
+    """write caught up snapshot back once (under a lock, only while key still holds the snapshot which was read)
+    returns True if snapshot is written
+    """
+    lock_id = f'{key}:delta'
+    token = acquire_lock(lock_id)
+    if token is None:  # another reader is writing it back
+        return False
+
+    try:
+        stored = cache.get(make_meta_key(key))
+        if meta is not None and (stored or {}).get('version') != meta.get('version'):
+            return False  # key is rewritten (or removed) after it was read
+        write_snapshot(key, payload, meta)
+        return True
+    finally:
+        release_lock(lock_id, token)
+
+
+def is_snapshot(payload):
+    """check payload is a rows payload with a change log position"""
+    return isinstance(payload, dict) and 'delta_id' in payload
+
+
+def catch_up(model_class, payload):
+    """(payload with changes logged after its delta_id, number of applied changes)
+    payload is None if snapshot can't be updated (log is trimmed, fields changed)
+    """
+    delta = read_delta(model_class.CACHE_KEY, payload['delta_id'])
+    if delta is None:
+        return None, 0
+    last_id, changes = delta
+    if last_id == payload['delta_id']:
+        return payload, 0
+
+    payload = apply_changes(model_class, payload, changes)
+    if payload is not None:
+        payload['delta_id'] = last_id
+    return payload, len(changes)
+
+
+def update_snapshot(key: str, value, meta, model_class):
+    """apply changes logged after cached snapshot value of key was computed
+    snapshots behind CACHE_DELTA_COMPACT_AFTER changes or more are written back (see `write_back`),
+    so changes are applied once instead of on every read
+    returns up to date rows payload or None if value can't be updated (not a snapshot, log is trimmed)
+    """
+    payload = decode(value) if is_encoded(value) else value
+    if not is_snapshot(payload):
+        return None
+
+    payload, count = catch_up(model_class, payload)
+    if payload is not None and count >= settings.CACHE_DELTA_COMPACT_AFTER:
+        write_back(key, payload, meta)
+    return payload
+
+
+def compact_delta_log(model_class):
+    """fold change log of model into its cached snapshots and trim the log
+    snapshots which can't be updated are removed (recomputed on next read)
+    returns stats dict: model, keys (written back), dropped, trimmed (log entries), elapsed
+    """
+    started = time.perf_counter()
+    cache_key = model_class.CACHE_KEY
+    client = get_redis_client()
+    log_key = make_delta_key(cache_key)
+    stats = {'model': model_class._meta.label, 'keys': 0, 'dropped': 0, 'trimmed': 0, 'elapsed': 0.0}
+
+    head = client.xrevrange(log_key, count=1)
+    if not head:
+        return stats
+    head = head[0][0].decode()
+
+    dropped = []
+    for key in get_keys_for_model(cache_key):
+        if is_chunk_key(key):
+            continue
+        values = cache.get_many([key, make_meta_key(key)])
+        payload = values.get(key)
+        payload = decode(payload) if is_encoded(payload) else payload
+        if not is_snapshot(payload) or payload['delta_id'] == head:
+            continue  # not a snapshot (e.g object entry) or up to date
+        updated, _ = catch_up(model_class, payload)
+        if updated is None:
+            dropped.append(key)
+        else:
+            write_snapshot(key, updated, values.get(make_meta_key(key)))
+            stats['keys'] += 1
+
+    if dropped:
+        cache.delete_many(dropped)
+    stats['dropped'] = len(dropped)
+    # entries older than head are folded into all snapshots, head is kept for snapshots starting from it
+    stats['trimmed'] = client.xtrim(log_key, minid=head, approximate=False)
+    stats['elapsed'] = time.perf_counter() - started
+    return stats
+
+
+def compact_delta_logs(models=None):
+    """run `compact_delta_log` for models (default all models with CACHE_DELTA_LOG)"""
+    from sage_cache.signals import get_cached_models  # signals use this module
+
+    models = [model for model in get_cached_models() if is_delta_enabled(model)] if models is None else models
+    return [compact_delta_log(model_class) for model_class in models]
+
+
+def compact_periodically(interval: float, models=None, stop: threading.Event = None, callback=None):
+    """run `compact_delta_logs` every interval seconds until stop is set
+    callback(results) is called after every round
+    """
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        results = compact_delta_logs(models)
+        if callback is not None:
+            callback(results)
+        stop.wait(interval)
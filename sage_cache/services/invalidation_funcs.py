@@ -0,0 +1,114 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+
+from sage_cache import settings
+from sage_cache.services.key_funcs import get_redis_client, make_meta_key
+
+_executor = None
+
+
+def get_executor():
+    """shared thread pool for background invalidation jobs"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.CACHE_INVALIDATION_WORKERS,
+            thread_name_prefix='sage_cache_invalidation'
+        )
+    return _executor
+
+
+def make_pattern(pattern: str):
+    """make redis pattern with cache prefix/version (same as `cache.keys()`)"""
+    client = getattr(cache, 'client', None)
+    if hasattr(client, 'make_pattern'):
+        return str(client.make_pattern(pattern))
+    return cache.make_key(pattern)
+
+
+def _chunks(iterable, size):
+    """yield lists of `size` items from iterable"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _unlink_chunks(client, chunks):
+    """UNLINK each chunk of raw keys in one pipeline
+    returns (keys seen, keys deleted)
+    """
+    seen = deleted = 0
+    for chunk in chunks:
+        seen += len(chunk)
+        pipe = client.pipeline(transaction=False)
+        pipe.unlink(*chunk)
+        deleted += pipe.execute()[0]
+    return seen, deleted
+
+
+def unlink_keys(keys: list, batch_size: int = None):
+    """delete cache keys with pipelined UNLINK (memory is freed in background)
+    keys are cache keys (not prefixed redis keys)
+    metadata keys of keys are removed too, they are not counted in stats
+    returns stats dict: scanned, deleted, elapsed
+    """
+    started = time.perf_counter()
+    keys = list(keys)
+    batch_size = batch_size or settings.CACHE_UNLINK_BATCH_SIZE
+    client = get_redis_client()
+    raw_keys = (cache.make_key(key) for key in keys)
+    scanned, deleted = _unlink_chunks(client, _chunks(raw_keys, batch_size))
+    meta_keys = (cache.make_key(make_meta_key(key)) for key in keys)
+    _unlink_chunks(client, _chunks(meta_keys, batch_size))
+    return {
+        'scanned': scanned,
+        'deleted': deleted,
+        'elapsed': time.perf_counter() - started,
+    }
+
+
+def scan_and_unlink(pattern: str, count: int = None, batch_size: int = None):
+    """delete cache keys matching pattern
+    uses cursor based SCAN (non-blocking) and streams matched keys in chunks to pipelined UNLINK
+    NOTE: `count` is the SCAN COUNT hint (default CACHE_SCAN_COUNT)
+    NOTE: metadata keys of matched keys (e.g expiry of stale values) are scanned and removed too,
+    they are not counted in stats
+    returns stats dict: scanned, deleted, elapsed
+    """
+    started = time.perf_counter()
+    count = count or settings.CACHE_SCAN_COUNT
+    batch_size = batch_size or settings.CACHE_UNLINK_BATCH_SIZE
+    client = get_redis_client()
+    matched = client.scan_iter(match=make_pattern(pattern), count=count)
+    scanned, deleted = _unlink_chunks(client, _chunks(matched, batch_size))
+    matched = client.scan_iter(match=make_pattern(make_meta_key(pattern)), count=count)
+    _unlink_chunks(client, _chunks(matched, batch_size))
+    return {
+        'scanned': scanned,
+        'deleted': deleted,
+        'elapsed': time.perf_counter() - started,
+    }
+
+
+def scan_and_unlink_many(patterns: list, count: int = None, batch_size: int = None):
+    """run `scan_and_unlink` for each pattern and merge stats"""
+    stats = {'scanned': 0, 'deleted': 0, 'elapsed': 0.0}
+    for pattern in patterns:
+        result = scan_and_unlink(pattern, count=count, batch_size=batch_size)
+        for name in stats:
+            stats[name] += result[name]
+    return stats
+
+
+def run_async(func, *args, **kwargs):
+    """run invalidation job off the request thread
+    returns concurrent.futures.Future (result is stats dict)
+    """
+    return get_executor().submit(func, *args, **kwargs)
@@ -0,0 +1,258 @@
+import asyncio
+import re
+import weakref
+
+import redis.asyncio
+from django.conf import settings as django_settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+from sage_cache import settings
+
+_async_clients = weakref.WeakKeyDictionary()
+CONNECTION_OPTIONS = ('USERNAME', 'PASSWORD', 'SOCKET_TIMEOUT', 'SOCKET_CONNECT_TIMEOUT')
+SYNC_POOL_KWARGS = ('connection_class', 'parser_class')  # classes of the sync client
+
+
+def get_redis_client():
+    """get raw redis client of default cache"""
+    return get_redis_connection('default')
+
+
+def get_redis_url():
+    """url of redis server used by async client
+    CACHE_ASYNC_REDIS_URL or first LOCATION of default cache
+    """
+    if settings.CACHE_ASYNC_REDIS_URL:
+        return settings.CACHE_ASYNC_REDIS_URL
+    location = django_settings.CACHES['default']['LOCATION']
+    if isinstance(location, str):
+        location = re.split('[;,]', location)
+    return location[0]
+
+
+def get_async_connection_kwargs():
+    """connection pool kwargs of async client
+    connection options of default cache (django-redis USERNAME, PASSWORD, SOCKET_TIMEOUT, SOCKET_CONNECT_TIMEOUT and
+    CONNECTION_POOL_KWARGS e.g ssl or max_connections) updated with CACHE_ASYNC_CONNECTION_KWARGS
+    NOTE: connection/parser classes of CONNECTION_POOL_KWARGS are sync classes, they're not used
+    """
+    options = django_settings.CACHES['default'].get('OPTIONS', {})
+    kwargs = {name.lower(): options[name] for name in CONNECTION_OPTIONS if options.get(name)}
+    kwargs.update(
+        (name, value) for name, value in options.get('CONNECTION_POOL_KWARGS', {}).items()
+        if name not in SYNC_POOL_KWARGS
+    )
+    kwargs.update(settings.CACHE_ASYNC_CONNECTION_KWARGS)
+    return kwargs
+
+
+def get_async_redis_client():
+    """get raw asyncio redis client of default cache (see `get_async_connection_kwargs`)
+    NOTE: one client (connection pool) per event loop, asyncio connections can't be shared between loops
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        pool = redis.asyncio.ConnectionPool.from_url(get_redis_url(), **get_async_connection_kwargs())
+        client = _async_clients[loop] = redis.asyncio.Redis(connection_pool=pool)
+    return client
+
+
+def make_site_key(cache_key: str):
+    """deterministic cache key for per site caches"""
+    return f'{cache_key}'
+
+
+def make_user_key(user_id, cache_key: str):
+    """deterministic cache key for per user caches"""
+    return f'{user_id}-{cache_key}'
+
+
+def make_meta_key(key: str):
+    """key of the metadata of a cache key (version token, expiry and recompute time)"""
+    return f'{settings.CACHE_KEY_REGISTRY_PREFIX}:meta:{key}'
+
+
+def make_lock_key(key: str):
+    """key of the recompute lock of a cache key"""
+    return f'{settings.CACHE_KEY_REGISTRY_PREFIX}:lock:{key}'
+
+
+def make_chunk_key(key: str, version: str, number: int):
+    """key of a chunk of a chunked cache key"""
+    return f'{settings.CACHE_KEY_REGISTRY_PREFIX}:chunk:{key}:{version}:{number}'
+
+
+def make_object_key(cache_key: str, field: str, value):
+    """key of a single object cache entry e.g (cache_key, 'id', 5) or (cache_key, 'slug', 'red-phone')"""
+    return f'{settings.CACHE_KEY_REGISTRY_PREFIX}:obj:{cache_key}:{field}:{value}'
+
+
+def make_overlay_key(user_id, cache_key: str):
+    """key of the visible primary keys of a user over the per site cache of a model"""
+    return f'{settings.CACHE_KEY_REGISTRY_PREFIX}:pks:{make_user_key(user_id, cache_key)}'
+
+
+def is_chunk_key(key: str):
+    """check key is made by `make_chunk_key`"""
+    return key.startswith(f'{settings.CACHE_KEY_REGISTRY_PREFIX}:chunk:')
+
+
+def is_object_key(key: str):
+    """check key is made by `make_object_key`"""
+    return key.startswith(f'{settings.CACHE_KEY_REGISTRY_PREFIX}:obj:')
+
+
+def is_overlay_key(key: str):
+    """check key is made by `make_overlay_key`"""
+    return key.startswith(f'{settings.CACHE_KEY_REGISTRY_PREFIX}:pks:')
+
+
+def make_field_index_key(cache_key: str, *parts):
+    """key of a redis secondary index of model e.g (cache_key, 'price') or (cache_key, 'category_id', 3)"""
+    suffix = ':'.join(str(part) for part in parts)
+    return cache.make_key(f'{settings.CACHE_KEY_REGISTRY_PREFIX}:idx:{cache_key}:{suffix}')
+
+
+def make_delta_key(cache_key: str):
+    """key of the change log (stream) of a model"""
+    return cache.make_key(f'{settings.CACHE_KEY_REGISTRY_PREFIX}:delta:{cache_key}')
+
+
+def make_model_index_key(cache_key: str):
+    """key of the set which holds all keys of a model"""
+    return cache.make_key(f'{settings.CACHE_KEY_REGISTRY_PREFIX}:model:{cache_key}')
+
+
+def make_manifest_index_key(cache_key: str):
+    """key of the set which holds chunked entry keys (manifests) of a model"""
+    return cache.make_key(f'{settings.CACHE_KEY_REGISTRY_PREFIX}:manifests:{cache_key}')
+
+
+def make_user_index_key(user_id):
+    """key of the set which holds all keys of a user"""
+    return cache.make_key(f'{settings.CACHE_KEY_REGISTRY_PREFIX}:user:{user_id}')
+
+
+def make_tag_index_key(tag: str):
+    """key of the set which holds all page keys of a tag"""
+    return cache.make_key(f'{settings.CACHE_KEY_REGISTRY_PREFIX}:tag:{tag}')
+
+
+def register_key(key, cache_key: str = None, user_id=None, timeout=None):
+    """add key (or list of keys) to model/user index sets
+    index sets live at least as long as the registered key
+    """
+    keys = [key] if isinstance(key, str) else list(key)
+    members = {}
+    if cache_key is not None:
+        members[make_model_index_key(cache_key)] = keys
+    if user_id is not None:
+        members[make_user_index_key(user_id)] = keys
+    _add_to_indexes(members, timeout)
+
+
+def register_manifest(key: str, cache_key: str, timeout=None):
+    """add key of a chunked entry to manifest index set of model (entries rewritten by `update_chunks`)"""
+    _add_to_indexes({make_manifest_index_key(cache_key): [key]}, timeout)
+
+
+def register_model_keys(keys: dict, timeout=None, manifests: dict = None):
+    """`register_key` of keys of several models ({CACHE_KEY: list of keys}) with two pipelines
+    manifests: {CACHE_KEY: list of chunked entry keys} (see `register_manifest`)
+    """
+    members = {make_model_index_key(cache_key): list(items) for cache_key, items in keys.items() if items}
+    members.update(
+        (make_manifest_index_key(cache_key), list(items)) for cache_key, items in (manifests or {}).items() if items
+    )
+    _add_to_indexes(members, timeout)
+
+
+def _add_to_indexes(members: dict, timeout=None):
+    """add keys to index sets ({index key: keys}), index sets live at least as long as the keys"""
+    if not members:
+        return
+
+    client = get_redis_client()
+    pipe = client.pipeline(transaction=False)
+    for index_key, keys in members.items():
+        pipe.sadd(index_key, *keys)
+        pipe.ttl(index_key)
+    results = pipe.execute()
+
+    pipe = client.pipeline(transaction=False)
+    for index_key, ttl in zip(members, results[1::2]):
+        if timeout is None:
+            pipe.persist(index_key)
+        elif ttl < timeout:
+            pipe.expire(index_key, int(timeout))
+    pipe.execute()
+
+
+def get_keys_for_model(cache_key: str):
+    """returns registered keys of model"""
+    members = get_redis_client().smembers(make_model_index_key(cache_key))
+    return [member.decode() for member in members]
+
+
+def get_manifest_keys(cache_key: str):
+    """returns registered chunked entry keys of model"""
+    members = get_redis_client().smembers(make_manifest_index_key(cache_key))
+    return [member.decode() for member in members]
+
+
+def get_keys_for_user(user_id):
+    """returns registered keys of user"""
+    members = get_redis_client().smembers(make_user_index_key(user_id))
+    return [member.decode() for member in members]
+
+
+def get_keys_for_users(user_ids: list):
+    """returns registered keys of users (one pipeline for all users)"""
+    pipe = get_redis_client().pipeline(transaction=False)
+    for user_id in user_ids:
+        pipe.smembers(make_user_index_key(user_id))
+    keys = set()
+    for members in pipe.execute():
+        keys.update(member.decode() for member in members)
+    return list(keys)
+
+
+def get_keys_for_model_and_user(cache_key: str, user_id):
+    """returns registered keys of model for user"""
+    members = get_redis_client().sinter(
+        make_model_index_key(cache_key),
+        make_user_index_key(user_id)
+    )
+    return [member.decode() for member in members]
+
+
+def drop_model_index(cache_key: str):
+    """remove index sets of model"""
+    get_redis_client().delete(make_model_index_key(cache_key), make_manifest_index_key(cache_key))
+
+
+def drop_user_index(user_id):
+    """remove index set of user"""
+    get_redis_client().delete(make_user_index_key(user_id))
+
+
+def drop_user_indexes(user_ids: list):
+    """remove index sets of users"""
+    if user_ids:
+        get_redis_client().unlink(*[make_user_index_key(user_id) for user_id in user_ids])
+
+
+def unregister_keys(keys: list, cache_key: str = None, user_id=None):
+    """remove keys from model/user index sets"""
+    if not keys:
+        return
+
+    pipe = get_redis_client().pipeline(transaction=False)
+    if cache_key is not None:
+        pipe.srem(make_model_index_key(cache_key), *keys)
+        pipe.srem(make_manifest_index_key(cache_key), *keys)
+    if user_id is not None:
+        pipe.srem(make_user_index_key(user_id), *keys)
+    pipe.execute()
@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.exceptions import ImproperlyConfigured
+
+from sage_cache import settings
+
+EVICTION_POLICIES = ('lru', 'fifo')
+
+
+class LocalCache:
+    """bounded in-process cache (L1) in front of redis
+    every entry is stored with the redis version token it was loaded with,
+    an entry is only returned while its version is still the current one
+    NOTE: entries bigger than max_entry_bytes are not stored
+    NOTE: eviction policy is 'lru' (least recently used) or 'fifo' (oldest first)
+    """
+
+    def __init__(self, max_entries=128, max_entry_bytes=None, max_bytes=None, timeout=None, policy='lru'):
+        if policy not in EVICTION_POLICIES:
+            raise ImproperlyConfigured(
+                'CACHE_L1_EVICTION_POLICY must be one of {}'.format(', '.join(EVICTION_POLICIES))
+            )
+        self.max_entries = max_entries
+        self.max_entry_bytes = max_entry_bytes
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.policy = policy
+        self._entries = OrderedDict()  # key -> (value, version, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, version):
+        """returns value of key if it is loaded with `version` and not expired else None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, entry_version, expires_at, size = entry
+            if entry_version != version or (expires_at is not None and expires_at <= time.monotonic()):
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            if self.policy == 'lru':
+                self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, version, size=0):
+        """store value of key with version
+        returns False when entry is too big to store
+        """
+        if self.max_entry_bytes is not None and size > self.max_entry_bytes:
+            return False
+        if self.max_bytes is not None and size > self.max_bytes:
+            return False
+
+        expires_at = time.monotonic() + self.timeout if self.timeout else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, version, expires_at, size)
+            self._bytes += size
+            self._evict()
+        return True
+
+    def delete(self, key):
+        """remove key"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        """remove all entries"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """hit/miss counters and memory usage"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+        }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[3]
+
+    def _evict(self):
+        while self._entries and (
+            (self.max_entries is not None and len(self._entries) > self.max_entries) or
+            (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            # both policies evict from the head, lru moves hits to the tail
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+
+
+_local_cache = None
+_local_cache_lock = threading.Lock()
+
+
+def get_local_cache():
+    """process wide LocalCache configured from settings"""
+    global _local_cache
+    if _local_cache is None:
+        with _local_cache_lock:
+            if _local_cache is None:
+                _local_cache = LocalCache(
+                    max_entries=settings.CACHE_L1_MAX_ENTRIES,
+                    max_entry_bytes=settings.CACHE_L1_MAX_ENTRY_BYTES,
+                    max_bytes=settings.CACHE_L1_MAX_BYTES,
+                    timeout=settings.CACHE_L1_TIMEOUT,
+                    policy=settings.CACHE_L1_EVICTION_POLICY,
+                )
+    return _local_cache
@@ -0,0 +1,267 @@
+import datetime
+import functools
+import re
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, FieldError, ValidationError
+from django.utils import timezone
+
+from sage_cache.services.chunk_funcs import ChunkedRows
+from sage_cache.services.metrics import timed
+from sage_cache.services.storage_funcs import CachedRows
+
+LOOKUP_SEP = '__'
+
+
+def _lower(value):
+    return str(value).lower()
+
+
+def _in(a, b):
+    return a in b
+
+
+def _exact(a, b):
+    return a == b
+
+
+def _iexact(a, b):
+    return a is not None and _lower(a) == b
+
+
+def _contains(a, b):
+    return a is not None and b in str(a)
+
+
+def _icontains(a, b):
+    return a is not None and b in _lower(a)
+
+
+def _startswith(a, b):
+    return a is not None and str(a).startswith(b)
+
+
+def _istartswith(a, b):
+    return a is not None and _lower(a).startswith(b)
+
+
+def _endswith(a, b):
+    return a is not None and str(a).endswith(b)
+
+
+def _iendswith(a, b):
+    return a is not None and _lower(a).endswith(b)
+
+
+def _gt(a, b):
+    return a is not None and a > b
+
+
+def _gte(a, b):
+    return a is not None and a >= b
+
+
+def _lt(a, b):
+    return a is not None and a < b
+
+
+def _lte(a, b):
+    return a is not None and a <= b
+
+
+def _regex(a, b):
+    return a is not None and b.search(str(a)) is not None
+
+
+def _range(a, b):
+    return a is not None and b[0] <= a <= b[1]
+
+
+def _isnull(a, b):
+    return (a is None) == b
+
+
+LOOKUPS = {
+    'exact': _exact,
+    'iexact': _iexact,
+    'contains': _contains,
+    'icontains': _icontains,
+    'in': _in,
+    'gt': _gt,
+    'gte': _gte,
+    'lt': _lt,
+    'lte': _lte,
+    'startswith': _startswith,
+    'istartswith': _istartswith,
+    'endswith': _endswith,
+    'iendswith': _iendswith,
+    'regex': _regex,
+    'iregex': _regex,
+    'range': _range,
+    'isnull': _isnull,
+}
+TEXT_LOOKUPS = ('contains', 'startswith', 'endswith')
+SEARCH_LOOKUPS = ('exact', 'iexact', 'contains', 'icontains', 'startswith', 'istartswith', 'endswith', 'iendswith')
+CASE_INSENSITIVE_LOOKUPS = ('iexact', 'icontains', 'istartswith', 'iendswith')
+TRUE_VALUES = ('1', 'true', 'True', 'yes', 'on')
+
+
+def _split(value):
+    """split comma separated query param values"""
+    if isinstance(value, str):
+        return [item for item in value.split(',') if item != '']
+    return list(value)
+
+
+class CompiledLookup:
+    """a lookup expression (e.g 'category__title__icontains') compiled for a model
+    attrs: attribute path on model instances
+    column: column name in cached rows payload
+    """
+
+    def __init__(self, model_class, expression):
+        parts = expression.split(LOOKUP_SEP)
+        lookup = 'exact'
+        if len(parts) > 1 and parts[-1] in LOOKUPS:
+            lookup = parts.pop()
+
+        current = model_class
+        field = None
+        for i, name in enumerate(parts):
+            if current is None:
+                raise FieldError('can not resolve `{}` in {}'.format(expression, model_class.__name__))
+            try:
+                field = current._meta.get_field(name)
+            except FieldDoesNotExist:
+                raise FieldError('can not resolve `{}` in {}'.format(expression, model_class.__name__))
+            if field.is_relation and not (field.many_to_one or field.one_to_one) or not field.concrete:
+                raise FieldError('only forward foreign keys can be traversed in `{}`'.format(expression))
+            current = field.related_model if i < len(parts) - 1 else None
+
+        # foreign key at the end compares its raw value e.g category -> category_id
+        attrs = parts[:-1] + [field.attname]
+        self.expression = expression
+        self.lookup = lookup
+        self.field = field
+        self.attrs = attrs
+        self.column = LOOKUP_SEP.join(attrs)
+        self.test = LOOKUPS[lookup]
+
+    def to_python(self, value):
+        """convert query param value to python value of field"""
+        if value is None or value == '':
+            return None
+        try:
+            value = self.field.to_python(value)
+        except ValidationError as e:
+            raise ValidationError({self.expression: e.messages})
+        if isinstance(value, datetime.datetime) and settings.USE_TZ and timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value
+
+    def prepare(self, value):
+        """convert value for this lookup (done once per request)"""
+        if self.lookup == 'isnull':
+            return value in TRUE_VALUES if isinstance(value, str) else bool(value)
+        if self.lookup == 'in':
+            return {self.to_python(item) for item in _split(value)}
+        if self.lookup == 'range':
+            values = _split(value)
+            if len(values) != 2:
+                raise ValidationError({self.expression: ['range lookup needs 2 values']})
+            return self.to_python(values[0]), self.to_python(values[1])
+        if self.lookup in ('regex', 'iregex'):
+            try:
+                return re.compile(str(value), re.IGNORECASE if self.lookup == 'iregex' else 0)
+            except re.error as e:
+                raise ValidationError({self.expression: [f'invalid regular expression: {e}']})
+        if self.lookup in CASE_INSENSITIVE_LOOKUPS:
+            return _lower(value)
+        if self.lookup in TEXT_LOOKUPS:
+            return str(value)
+        return self.to_python(value)
+
+    def get_value(self, obj):
+        """value of attribute path on instance (None if a relation is empty)"""
+        for attr in self.attrs:
+            if obj is None:
+                return None
+            obj = getattr(obj, attr)
+        return obj
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_lookup(model_class, expression: str):
+    """compiled lookup (cached, compiled once per model and expression)"""
+    return CompiledLookup(model_class, expression)
+
+
+def compile_filters(model_class, lookups: dict):
+    """[(compiled lookup, prepared value)] for lookups"""
+    filters = []
+    for expression, value in lookups.items():
+        compiled = compile_lookup(model_class, expression)
+        filters.append((compiled, compiled.prepare(value)))
+    return filters
+
+
+def _positions(rows, compiled, value):
+    """payload row positions of CachedRows matching one lookup
+    text lookups on fields with search indexes only check rows containing n-grams of value
+    """
+    if compiled.lookup in ('exact', 'in') and rows.is_indexed(compiled.column):
+        return rows.lookup(compiled.column, list(value) if compiled.lookup == 'in' else value)
+    column = rows.columns[rows.fields.index(compiled.column)]
+    test = compiled.test
+    positions = rows.get_positions()
+    if compiled.lookup in SEARCH_LOOKUPS and isinstance(value, str) and rows.is_searchable(compiled.column):
+        candidates = rows.search(compiled.column, value)
+        if rows.positions is not None:
+            candidates.intersection_update(positions)
+        positions = candidates
+    return {position for position in positions if test(column[position], value)}
+
+
+@timed('filter_seconds')
+def filter_by_lookups(queryset, model_class=None, connector='AND', **lookups):
+    """filter cached objects with django lookup expressions
+    e.g filter_by_lookups(products, price__gte=10, category__title__icontains='book')
+    supported lookups: exact, iexact, contains, icontains, in, gt, gte, lt, lte,
+    startswith, istartswith, endswith, iendswith, regex, iregex, range, isnull
+    connector 'AND' selects objects matching all lookups, 'OR' any of them
+    returns CachedRows (for CachedRows) or list
+    """
+    if not lookups:
+        return queryset
+
+    if isinstance(queryset, ChunkedRows):
+        queryset = queryset.rows()
+
+    if isinstance(queryset, CachedRows):
+        model_class = queryset.model
+    elif model_class is None:
+        if not queryset:
+            return list(queryset)
+        model_class = type(queryset[0])
+
+    filters = compile_filters(model_class, lookups)
+
+    if isinstance(queryset, CachedRows) and all(compiled.column in queryset.fields for compiled, _ in filters):
+        positions = None
+        for compiled, value in filters:
+            matched = _positions(queryset, compiled, value)
+            if positions is None:
+                positions = matched
+            elif connector == 'OR':
+                positions |= matched
+            else:
+                positions &= matched
+        if queryset.positions is not None:
+            positions &= set(queryset.positions)
+        return queryset.subset(sorted(positions))
+
+    combine = any if connector == 'OR' else all
+    return [
+        obj for obj in queryset
+        if combine(compiled.test(compiled.get_value(obj), value) for compiled, value in filters)
+    ]
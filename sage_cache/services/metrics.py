@@ -0,0 +1,275 @@
+import abc
+import bisect
+import contextlib
+import functools
+import logging
+import socket
+import threading
+import time
+
+from django.dispatch import Signal
+from django.http import Http404, HttpResponse
+from django.utils.module_loading import import_string
+
+from sage_cache import settings
+
+logger = logging.getLogger(__name__)
+
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1KB .. 256MB
+COUNTERS = ('hits', 'misses', 'stale_hits', 'stampede_waits')
+HISTOGRAMS = {
+    'redis_seconds': TIME_BUCKETS,
+    'deserialize_seconds': TIME_BUCKETS,
+    'filter_seconds': TIME_BUCKETS,
+    'recompute_seconds': TIME_BUCKETS,
+    'stampede_wait_seconds': TIME_BUCKETS,
+    'payload_bytes': SIZE_BUCKETS,
+}
+NULL_TIMER = contextlib.nullcontext()
+
+# sent by SignalExporter for every recorded value, kwargs: name, kind ('counter' or 'histogram'), cache_key, value
+metric_recorded = Signal()
+
+
+class MetricsExporter(abc.ABC):
+    """base class of exporters (CACHE_METRICS_EXPORTERS)
+    counter() and histogram() are called for every recorded value when CACHE_METRICS_ENABLED
+    NOTE: exporters missing one of them can't be instantiated (fails when exporters are built)
+    """
+
+    @abc.abstractmethod
+    def counter(self, name, cache_key, value):
+        """add value to counter name of cache_key"""
+
+    @abc.abstractmethod
+    def histogram(self, name, cache_key, value):
+        """record value in histogram name of cache_key"""
+
+
+class PrometheusExporter(MetricsExporter):
+    """in-process counters and histograms rendered in prometheus text format (see `metrics_view`)"""
+
+    def __init__(self):
+        self._counters = {}  # (name, cache_key) -> value
+        self._histograms = {}  # (name, cache_key) -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def counter(self, name, cache_key, value):
+        with self._lock:
+            self._counters[name, cache_key] = self._counters.get((name, cache_key), 0) + value
+
+    def histogram(self, name, cache_key, value):
+        buckets = HISTOGRAMS.get(name, TIME_BUCKETS)
+        with self._lock:
+            histogram = self._histograms.get((name, cache_key))
+            if histogram is None:
+                histogram = self._histograms[name, cache_key] = [[0] * len(buckets), 0, 0]
+            position = bisect.bisect_left(buckets, value)
+            if position < len(buckets):
+                histogram[0][position] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def get_stats(self, cache_key=None):
+        """{'counters': {name: value}, 'histograms': {name: {'count', 'sum'}}} of cache_key (default all keys)"""
+        stats = {'counters': {}, 'histograms': {}}
+        with self._lock:
+            for (name, key), value in self._counters.items():
+                if cache_key is None or key == cache_key:
+                    stats['counters'][name] = stats['counters'].get(name, 0) + value
+            for (name, key), (_, total, count) in self._histograms.items():
+                if cache_key is None or key == cache_key:
+                    histogram = stats['histograms'].setdefault(name, {'count': 0, 'sum': 0})
+                    histogram['count'] += count
+                    histogram['sum'] += total
+        return stats
+
+    def reset(self):
+        """remove all recorded values"""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self, prefix='sage_cache'):
+        """metrics in prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, (list(buckets), total, count)) for key, (buckets, total, count) in self._histograms.items()
+            )
+
+        lines = []
+        previous = None
+        for (name, cache_key), value in counters:
+            metric = f'{prefix}_{name}_total'
+            if name != previous:
+                lines.append(f'# TYPE {metric} counter')
+                previous = name
+            lines.append(f'{metric}{{cache_key="{_escape(cache_key)}"}} {value}')
+
+        for (name, cache_key), (counts, total, count) in histograms:
+            metric = f'{prefix}_{name}'
+            if name != previous:
+                lines.append(f'# TYPE {metric} histogram')
+                previous = name
+            label = f'cache_key="{_escape(cache_key)}"'
+            cumulative = 0
+            for bound, bucket_count in zip(HISTOGRAMS.get(name, TIME_BUCKETS), counts):
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f'{metric}_sum{{{label}}} {total}')
+            lines.append(f'{metric}_count{{{label}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+class StatsdExporter(MetricsExporter):
+    """send values to statsd over UDP (CACHE_METRICS_STATSD_HOST/PORT/PREFIX)
+    e.g `sage_cache.hits.product:1|c`, `sage_cache.redis_seconds.product:1.2|ms`
+    """
+
+    def __init__(self, host=None, port=None, prefix=None):
+        self.address = (host or settings.CACHE_METRICS_STATSD_HOST, port or settings.CACHE_METRICS_STATSD_PORT)
+        self.prefix = prefix or settings.CACHE_METRICS_STATSD_PREFIX
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+    def send(self, name, cache_key, value, kind):
+        cache_key = ''.join('_' if char in ':|@' else char for char in str(cache_key))
+        try:
+            self.socket.sendto(f'{self.prefix}.{name}.{cache_key}:{value}|{kind}'.encode(), self.address)
+        except OSError:  # statsd is down or buffer is full, values are dropped
+            pass
+
+    def counter(self, name, cache_key, value):
+        self.send(name, cache_key, value, 'c')
+
+    def histogram(self, name, cache_key, value):
+        if name.endswith('_seconds'):
+            self.send(name, cache_key, round(value * 1000, 3), 'ms')
+        else:
+            self.send(name, cache_key, value, 'h')
+
+
+class SignalExporter(MetricsExporter):
+    """send `metric_recorded` signal for every recorded value"""
+
+    def counter(self, name, cache_key, value):
+        self.send(name, 'counter', cache_key, value)
+
+    def histogram(self, name, cache_key, value):
+        self.send(name, 'histogram', cache_key, value)
+
+    def send(self, name, kind, cache_key, value):
+        for receiver, response in metric_recorded.send_robust(
+            sender=type(self), name=name, kind=kind, cache_key=cache_key, value=value
+        ):
+            if isinstance(response, Exception):
+                logger.error('metric_recorded receiver %r failed', receiver, exc_info=response)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+@functools.lru_cache(maxsize=None)
+def _build_exporters(paths):
+    return [import_string(path)() for path in paths]
+
+
+def get_exporters():
+    """exporter instances of CACHE_METRICS_EXPORTERS (built once per process)"""
+    return _build_exporters(tuple(settings.CACHE_METRICS_EXPORTERS))
+
+
+def get_prometheus_exporter():
+    """PrometheusExporter of CACHE_METRICS_EXPORTERS or None"""
+    for exporter in get_exporters():
+        if isinstance(exporter, PrometheusExporter):
+            return exporter
+    return None
+
+
+def incr(name, cache_key, value=1):
+    """add value to counter name of cache_key (no-op unless CACHE_METRICS_ENABLED)"""
+    if not settings.CACHE_METRICS_ENABLED:
+        return
+    for exporter in get_exporters():
+        exporter.counter(name, cache_key, value)
+
+
+def observe(name, cache_key, value):
+    """record value in histogram name of cache_key (no-op unless CACHE_METRICS_ENABLED)"""
+    if not settings.CACHE_METRICS_ENABLED:
+        return
+    for exporter in get_exporters():
+        exporter.histogram(name, cache_key, value)
+
+
+class _Timer:
+    __slots__ = ('name', 'cache_key', 'started')
+
+    def __init__(self, name, cache_key):
+        self.name = name
+        self.cache_key = cache_key
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, self.cache_key, time.perf_counter() - self.started)
+
+
+def timer(name, cache_key):
+    """context manager recording its run time (seconds) in histogram name of cache_key"""
+    if not settings.CACHE_METRICS_ENABLED:
+        return NULL_TIMER
+    return _Timer(name, cache_key)
+
+
+def get_metric_key(obj):
+    """CACHE_KEY label of a model class, QuerySet, CachedRows/ChunkedRows or list of instances"""
+    model_class = obj if isinstance(obj, type) else getattr(obj, 'model', None)
+    if model_class is None:
+        if not isinstance(obj, (list, tuple)) or not obj:
+            return 'unknown'
+        model_class = type(obj[0])
+    return getattr(model_class, 'CACHE_KEY', model_class.__name__)
+
+
+def timed(name):
+    """decorator recording run time of function in histogram name,
+    labeled with CACHE_KEY of its first argument (see `get_metric_key`)
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(queryset, *args, **kwargs):
+            if not settings.CACHE_METRICS_ENABLED:
+                return func(queryset, *args, **kwargs)
+            with _Timer(name, get_metric_key(queryset)):
+                return func(queryset, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def get_metrics(cache_key=None):
+    """recorded counters and histogram count/sum of cache_key (default all keys)
+    NOTE: needs PrometheusExporter in CACHE_METRICS_EXPORTERS
+    """
+    exporter = get_prometheus_exporter()
+    if exporter is None:
+        return {'counters': {}, 'histograms': {}}
+    return exporter.get_stats(cache_key)
+
+
+def metrics_view(request):
+    """prometheus scrape endpoint e.g `path('metrics/', metrics_view)`"""
+    exporter = get_prometheus_exporter()
+    if exporter is None:
+        raise Http404('PrometheusExporter is not in CACHE_METRICS_EXPORTERS')
+    return HttpResponse(exporter.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,143 @@
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+
+from sage_cache import settings
+from sage_cache.services.cache_funcs import get_queryset_for_cache
+from sage_cache.services.invalidation_funcs import unlink_keys
+from sage_cache.services.key_funcs import make_object_key, register_key
+from sage_cache.services.metrics import incr, timer
+from sage_cache.services.storage_funcs import CachedRows, get_field_names, get_related_paths
+
+
+def get_lookup_field(model_class, field: str = 'pk'):
+    """model field of a lookup field name ('pk' is the primary key field)"""
+    if field == 'pk':
+        return model_class._meta.pk
+    return model_class._meta.get_field(field)
+
+
+def get_object_lookup_fields(model_class):
+    """attnames of lookup fields objects of model are cached by
+    (CACHE_OBJECT_LOOKUP_FIELDS of model, default primary key)
+    """
+    names = getattr(model_class, 'CACHE_OBJECT_LOOKUP_FIELDS', None) or ['pk']
+    return [get_lookup_field(model_class, name).attname for name in names]
+
+
+def is_object_lookup_field(model_class, field: str):
+    """check objects of model are cached by field (only keys of these fields are removed on saves)"""
+    if '__' in field:
+        return False
+    try:
+        attname = get_lookup_field(model_class, field).attname
+    except FieldDoesNotExist:
+        return False
+    return attname in get_object_lookup_fields(model_class)
+
+
+def get_object_keys(instance):
+    """object keys of instance (one per lookup field)"""
+    model_class = type(instance)
+    return [
+        make_object_key(model_class.CACHE_KEY, name, getattr(instance, name))
+        for name in get_object_lookup_fields(model_class)
+    ]
+
+
+def _make_keys(model_class, field, values):
+    """(attname of field, {object key: lookup value}) of lookup values
+    values are converted to python (e.g '5' of url kwargs and 5 have the same key)
+    raises ImproperlyConfigured if field is not in CACHE_OBJECT_LOOKUP_FIELDS of model
+    (object keys of other fields are not removed when the instance is saved)
+    """
+    if not is_object_lookup_field(model_class, field):
+        raise ImproperlyConfigured(
+            '`{}` is not in CACHE_OBJECT_LOOKUP_FIELDS of {}'.format(field, model_class.__name__)
+        )
+    model_field = get_lookup_field(model_class, field)
+    keys = {}
+    for value in values:
+        value = model_field.to_python(value)
+        keys[make_object_key(model_class.CACHE_KEY, model_field.attname, value)] = value
+    return model_field.attname, keys
+
+
+def _load_object(model_class, payload):
+    """instance of a single object payload or None (object does not exist)"""
+    rows = CachedRows(payload, model_class=model_class)
+    return rows[0] if len(rows) else None
+
+
+def _fetch_objects(model_class, attname, keys: dict, timeout):
+    """read objects of {object key: lookup value} from database with one query and cache them
+    with one pipeline, missing objects are cached too (as empty payloads)
+    returns {object key: instance or None}
+    """
+    related = get_related_paths(model_class)
+    fields = get_field_names(model_class, related)
+    position = fields.index(attname)
+    queryset = get_queryset_for_cache(model_class).filter(**{f'{attname}__in': list(keys.values())})
+    rows = {row[position]: row for row in queryset.values_list(*fields)}
+
+    payloads = {}
+    for key, value in keys.items():
+        row = rows.get(value)
+        payloads[key] = {
+            'model': model_class._meta.label,
+            'fields': fields,
+            'related': related,
+            'columns': [[item] for item in row] if row is not None else [[] for _ in fields],
+        }
+    cache.set_many(payloads, timeout)
+    # registered keys are removed with the other caches of model (`clear_cache_for_model`)
+    register_key(list(payloads), cache_key=model_class.CACHE_KEY, timeout=timeout)
+    return {key: _load_object(model_class, payload) for key, payload in payloads.items()}
+
+
+def get_objects_from_cache(model_class, values, field: str = 'pk', timeout=None):
+    """get objects of model by lookup values (e.g pks of a serializer) with one MGET
+    missed objects are read with one database query and cached per object
+    returns {lookup value: instance} in order of values (missing objects are skipped)
+    NOTE: default timeout is CACHE_TIMEOUT
+    """
+    timeout = settings.CACHE_TIMEOUT if timeout is None else timeout
+    attname, keys = _make_keys(model_class, field, values)
+    if not keys:
+        return {}
+
+    cache_key = model_class.CACHE_KEY
+    with timer('redis_seconds', cache_key):
+        payloads = cache.get_many(list(keys))
+    objects = {key: _load_object(model_class, payload) for key, payload in payloads.items()}
+    incr('hits', cache_key, len(objects))
+
+    missing = {key: value for key, value in keys.items() if key not in objects}
+    if missing:
+        incr('misses', cache_key, len(missing))
+        objects.update(_fetch_objects(model_class, attname, missing, timeout))
+    return {value: objects[key] for key, value in keys.items() if objects[key] is not None}
+
+
+def get_object_from_cache(model_class, value, field: str = 'pk', timeout=None):
+    """get object of model by lookup value (one GET and decode on hits)
+    returns instance or None if object does not exist (missing objects are cached too)
+    """
+    timeout = settings.CACHE_TIMEOUT if timeout is None else timeout
+    attname, keys = _make_keys(model_class, field, [value])
+    key = next(iter(keys))
+
+    with timer('redis_seconds', model_class.CACHE_KEY):
+        payload = cache.get(key)
+    if payload is not None:
+        incr('hits', model_class.CACHE_KEY)
+        return _load_object(model_class, payload)
+
+    incr('misses', model_class.CACHE_KEY)
+    return _fetch_objects(model_class, attname, keys, timeout)[key]
+
+
+def clear_cache_for_objects(instances):
+    """removes object caches of instances (all lookup fields)
+    returns stats dict: scanned, deleted, elapsed
+    """
+    return unlink_keys([key for instance in instances for key in get_object_keys(instance)])
@@ -0,0 +1,171 @@
+import pickle
+from array import array
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db.models import QuerySet
+
+from sage_cache import settings
+from sage_cache.services.cache_funcs import aget_all_from_cache, aget_many, get_all_from_cache
+from sage_cache.services.invalidation_funcs import unlink_keys
+from sage_cache.services.key_funcs import (
+    get_keys_for_model,
+    is_overlay_key,
+    make_overlay_key,
+    make_site_key,
+    register_key,
+    unregister_keys,
+)
+from sage_cache.services.redis_index_funcs import select_pks
+
+BITMAP = b'b'
+ARRAY = b'a'
+PICKLE = b'p'
+
+
+class Bitmap:
+    """set of non negative integer primary keys stored as bits (bit pk is set for visible rows)"""
+    __slots__ = ('bits', '_count')
+
+    def __init__(self, bits: bytes):
+        self.bits = bits
+        self._count = None
+
+    @classmethod
+    def from_pks(cls, pks):
+        bits = bytearray((max(pks) >> 3) + 1) if pks else bytearray()
+        for pk in pks:
+            bits[pk >> 3] |= 1 << (pk & 7)
+        return cls(bytes(bits))
+
+    def __contains__(self, pk):
+        if type(pk) is not int or pk < 0:
+            return False
+        index = pk >> 3
+        return index < len(self.bits) and self.bits[index] >> (pk & 7) & 1 == 1
+
+    def __iter__(self):
+        for index, byte in enumerate(self.bits):
+            if byte:
+                for bit in range(8):
+                    if byte >> bit & 1:
+                        yield index << 3 | bit
+
+    def __len__(self):
+        if self._count is None:
+            self._count = bin(int.from_bytes(self.bits, 'little')).count('1')
+        return self._count
+
+
+def encode_pks(pks):
+    """compact bytes of primary keys
+    non negative integers are stored as a bitmap when it's smaller than an array of 64 bit integers
+    (dense pks), other integers as a sorted array, other pks (e.g uuid, str) are pickled
+    """
+    pks = list(pks)
+    if pks and all(type(pk) is int for pk in pks):
+        if min(pks) >= 0 and max(pks) >> 3 < len(pks) * 8:
+            return BITMAP + Bitmap.from_pks(pks).bits
+        return ARRAY + array('q', sorted(pks)).tobytes()
+    return PICKLE + pickle.dumps(pks, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def decode_pks(value: bytes):
+    """set of primary keys (Bitmap or frozenset) made by `encode_pks`"""
+    kind, data = value[:1], value[1:]
+    if kind == BITMAP:
+        return Bitmap(data)
+    if kind == ARRAY:
+        return frozenset(array('q', data))
+    return frozenset(pickle.loads(data))
+
+
+def compute_pks(user_queryset):
+    """encoded primary keys of user_queryset (one `values_list` query)"""
+    return encode_pks(user_queryset.values_list('pk', flat=True))
+
+
+def store_pks(key: str, value: bytes, timeout, cache_key: str = None, user_id=None):
+    """set encoded primary keys of key and register it in model/user index sets"""
+    cache.set(key, value, timeout)
+    register_key(key, cache_key=cache_key, user_id=user_id, timeout=timeout)
+
+
+def get_user_pks(user_queryset, key: str, timeout, cache_key: str = None, user_id=None):
+    """visible primary keys of a user cached in key (computed from user_queryset on misses)
+    key is registered in model/user index sets, so it's removed with caches of model or user
+    """
+    value = cache.get(key)
+    if value is None:
+        value = compute_pks(user_queryset)
+        store_pks(key, value, timeout, cache_key=cache_key, user_id=user_id)
+    return decode_pks(value)
+
+
+async def aget_user_pks(user_queryset, key: str, timeout, cache_key: str = None, user_id=None):
+    """async `get_user_pks` (hits are read with asyncio redis client)"""
+    value = (await aget_many([key])).get(key)
+    if value is None:
+        value = await sync_to_async(compute_pks)(user_queryset)
+        await sync_to_async(store_pks)(key, value, timeout, cache_key=cache_key, user_id=user_id)
+    return decode_pks(value)
+
+
+def apply_overlay(queryset, pks):
+    """rows of per site queryset (QuerySet, CachedRows, ChunkedRows or list) visible in pks"""
+    if isinstance(queryset, QuerySet):
+        return queryset.filter(pk__in=list(pks))
+    return select_pks(queryset, pks)
+
+
+def _get_overlay_kwargs(model_class, timeout, user_id, set_cache_key, site_timeout):
+    cache_key = model_class.CACHE_KEY
+    return (
+        dict(
+            key=set_cache_key or make_overlay_key(user_id, cache_key),
+            timeout=timeout,
+            cache_key=cache_key,
+            user_id=user_id,
+        ),
+        settings.CACHE_TIMEOUT if site_timeout is None else site_timeout,
+    )
+
+
+def get_overlay_from_cache(model_class, timeout, user_queryset=None, user_id=None, set_cache_key=None,
+                           site_timeout=None, **kwargs):
+    """per user view of model: per site cache of model intersected with visible primary keys of user
+    table is cached once (site key, site_timeout default CACHE_TIMEOUT) and per user just primary keys of
+    user_queryset (e.g `Product.objects.filter(owner=user)`) are cached for timeout seconds
+    without user_queryset all rows are visible
+    returns (rows, visible pks or None), kwargs are passed to `get_all_from_cache`
+    """
+    overlay_kwargs, site_timeout = _get_overlay_kwargs(model_class, timeout, user_id, set_cache_key, site_timeout)
+    queryset = get_all_from_cache(
+        model_class, site_timeout, set_cache_key=make_site_key(model_class.CACHE_KEY), **kwargs
+    )
+    if user_queryset is None:
+        return queryset, None
+    pks = get_user_pks(user_queryset, **overlay_kwargs)
+    return apply_overlay(queryset, pks), pks
+
+
+async def aget_overlay_from_cache(model_class, timeout, user_queryset=None, user_id=None, set_cache_key=None,
+                                  site_timeout=None, **kwargs):
+    """async `get_overlay_from_cache`"""
+    overlay_kwargs, site_timeout = _get_overlay_kwargs(model_class, timeout, user_id, set_cache_key, site_timeout)
+    queryset = await aget_all_from_cache(
+        model_class, site_timeout, set_cache_key=make_site_key(model_class.CACHE_KEY), **kwargs
+    )
+    if user_queryset is None:
+        return queryset, None
+    pks = await aget_user_pks(user_queryset, **overlay_kwargs)
+    return apply_overlay(queryset, pks), pks
+
+
+def clear_overlays(cache_key: str):
+    """remove visible primary keys of all users of model (e.g after rows are changed)
+    returns stats dict: scanned, deleted, elapsed
+    """
+    keys = [key for key in get_keys_for_model(cache_key) if is_overlay_key(key)]
+    unregister_keys(keys, cache_key=cache_key)
+    return unlink_keys(keys)
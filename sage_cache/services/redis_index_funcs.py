@@ -0,0 +1,365 @@
+import datetime
+import decimal
+import time
+import uuid
+
+from django.db import models
+from django.db.models import QuerySet
+
+from sage_cache import settings
+from sage_cache.services.chunk_funcs import ChunkedRows
+from sage_cache.services.invalidation_funcs import make_pattern
+from sage_cache.services.key_funcs import get_redis_client, make_field_index_key
+from sage_cache.services.lookup_funcs import compile_filters, compile_lookup
+from sage_cache.services.refresh_funcs import schedule_refresh
+from sage_cache.services.stampede_funcs import acquire_lock, release_lock
+from sage_cache.services.storage_funcs import CachedRows
+
+NULL = '\x00'  # member of None values
+NUMERIC_FIELDS = (models.IntegerField, models.FloatField, models.DecimalField, models.DateField)
+SET_LOOKUPS = ('exact', 'in', 'isnull')
+NUMERIC_LOOKUPS = ('exact', 'in', 'isnull', 'gt', 'gte', 'lt', 'lte', 'range')
+BATCH_SIZE = 1000
+BUILD_TIMEOUT = 600  # seconds a build holds its lock (and rows saved meanwhile are queued)
+OLD_GENERATION_TIMEOUT = 60  # seconds keys of a replaced generation are kept for running queries
+
+
+def get_redis_indexed_fields(model_class):
+    """{attname: 'numeric' or 'set'} of CACHE_REDIS_INDEXED_FIELDS of model
+    numeric fields (numbers, dates) are indexed in sorted sets, others (e.g foreign keys, choices) in sets
+    """
+    fields = {}
+    for name in getattr(model_class, 'CACHE_REDIS_INDEXED_FIELDS', []):
+        field = model_class._meta.get_field(name)
+        numeric = isinstance(field, NUMERIC_FIELDS) and not field.is_relation
+        fields[field.attname] = 'numeric' if numeric else 'set'
+    return fields
+
+
+def _score(value):
+    """sorted set score of a numeric/date value"""
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    if isinstance(value, datetime.date):
+        return float(value.toordinal())
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return value
+
+
+def _member(value):
+    """set key part of a value"""
+    if value is None:
+        return NULL
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def _get_index_timeout():
+    """seconds index keys live (built generation pointer lives CACHE_REDIS_INDEX_TIMEOUT seconds)
+    index keys live twice as long, keys written at the start of a build must outlive the pointer
+    """
+    timeout = settings.CACHE_REDIS_INDEX_TIMEOUT
+    return None if timeout is None else int(timeout) * 2
+
+
+def _expire(pipe, key, timeout):
+    """set ttl of an index key (index keys don't expire without timeout)"""
+    if timeout is not None:
+        pipe.expire(key, timeout)
+
+
+def _index_row(pipe, prefix, fields, pk, row, timeout=None):
+    """add row (attname -> value) to indexes, remember its index entries in row hash
+    prefix: (CACHE_KEY, generation) of index keys
+    """
+    entries = {}
+    key = make_field_index_key(*prefix, 'all')
+    pipe.sadd(key, pk)
+    _expire(pipe, key, timeout)
+    for name, kind in fields.items():
+        value = row[name]
+        if kind == 'numeric' and value is not None:
+            score = _score(value)
+            key = make_field_index_key(*prefix, name)
+            pipe.zadd(key, {pk: score})
+            entries[name] = score
+        else:
+            member = _member(value)
+            key = make_field_index_key(*prefix, name, member)
+            pipe.sadd(key, pk)
+            entries[name] = member
+        _expire(pipe, key, timeout)
+    if entries:
+        key = make_field_index_key(*prefix, 'row', pk)
+        pipe.hset(key, mapping=entries)
+        _expire(pipe, key, timeout)
+
+
+def _unindex_row(pipe, prefix, fields, pk, entries):
+    """remove row from indexes with entries of its row hash"""
+    pipe.srem(make_field_index_key(*prefix, 'all'), pk)
+    for name, kind in fields.items():
+        member = entries.get(name.encode())
+        if member is None:
+            continue
+        if kind == 'numeric' and member != NULL.encode():
+            pipe.zrem(make_field_index_key(*prefix, name), pk)
+        else:
+            pipe.srem(make_field_index_key(*prefix, name, member.decode()), pk)
+    pipe.delete(make_field_index_key(*prefix, 'row', pk))
+
+
+def _get_names(model_class, fields):
+    pk_name = model_class._meta.pk.attname
+    return [pk_name] + [name for name in fields if name != pk_name]
+
+
+def _reindex(client, model_class, fields, generation, pks):
+    """reindex rows of pks from database in indexes of generation"""
+    cache_key = model_class.CACHE_KEY
+    prefix = (cache_key, generation)
+    names = _get_names(model_class, fields)
+    rows = {
+        values[0]: dict(zip(names, values))
+        for values in model_class.objects.filter(pk__in=pks).values_list(*names)
+    }
+
+    pipe = client.pipeline(transaction=False)
+    for pk in pks:
+        pipe.hgetall(make_field_index_key(*prefix, 'row', pk))
+    old_entries = pipe.execute()
+
+    timeout = _get_index_timeout()
+    pipe = client.pipeline(transaction=True)
+    for pk, entries in zip(pks, old_entries):
+        if entries:
+            _unindex_row(pipe, prefix, fields, pk, entries)
+        if pk in rows:
+            _index_row(pipe, prefix, fields, pk, rows[pk], timeout)
+    pipe.execute()
+
+
+def get_generation(model_class):
+    """generation (key prefix) of built redis indexes of model or None"""
+    generation = get_redis_client().get(make_field_index_key(model_class.CACHE_KEY, 'built'))
+    return generation.decode() if generation is not None else None
+
+
+def is_redis_indexed(model_class):
+    """check redis indexes of model are built"""
+    return get_generation(model_class) is not None
+
+
+def _add_pending(client, cache_key, pks):
+    """add pks to pending set of a running build (replayed by the build before and after it's swapped in)
+    building marker is watched, so pks are never added after the build has read its pending set for the last time
+    """
+    building_key = make_field_index_key(cache_key, 'building')
+
+    def add(pipe):
+        generation = pipe.get(building_key)
+        pipe.multi()
+        if generation is not None:
+            pending_key = make_field_index_key(cache_key, generation.decode(), 'pending')
+            pipe.sadd(pending_key, *pks)
+            pipe.expire(pending_key, BUILD_TIMEOUT)
+
+    client.transaction(add, building_key)
+
+
+def _replay_pending(client, model_class, fields, generation):
+    """reindex rows changed while generation was built"""
+    pending_key = make_field_index_key(model_class.CACHE_KEY, generation, 'pending')
+    to_python = model_class._meta.pk.to_python
+    while True:
+        pks = client.spop(pending_key, BATCH_SIZE)
+        if not pks:
+            return
+        _reindex(client, model_class, fields, generation, [to_python(pk.decode()) for pk in pks])
+
+
+def _expire_generation(client, cache_key, generation):
+    """let keys of a replaced generation expire (queries which read the old pointer can still finish)"""
+    pattern = make_pattern(f'{settings.CACHE_KEY_REGISTRY_PREFIX}:idx:{cache_key}:{generation}:*')
+    pipe = client.pipeline(transaction=False)
+    for key in client.scan_iter(match=pattern, count=settings.CACHE_SCAN_COUNT):
+        pipe.expire(key, OLD_GENERATION_TIMEOUT)
+    pipe.execute()
+
+
+def build_redis_index(model_class):
+    """(re)build redis secondary indexes of CACHE_REDIS_INDEXED_FIELDS of model from database
+    indexes are built in a new generation (key prefix) and swapped in atomically when they're complete,
+    the previous generation serves queries meanwhile, rows saved during the build are reindexed before the swap
+    returns stats dict: rows, elapsed or None if index is being built by another worker
+    NOTE: large tables should be indexed off the request path, e.g `sage_cache_warm --redis-index`
+    """
+    started = time.perf_counter()
+    cache_key = model_class.CACHE_KEY
+    fields = get_redis_indexed_fields(model_class)
+    lock_id = f'{cache_key}:redis_index'
+    token = acquire_lock(lock_id, timeout=BUILD_TIMEOUT)
+    if token is None:
+        return None
+
+    try:
+        client = get_redis_client()
+        generation = uuid.uuid4().hex
+        building_key = make_field_index_key(cache_key, 'building')
+        client.set(building_key, generation, ex=BUILD_TIMEOUT)
+
+        count = 0
+        timeout = _get_index_timeout()
+        prefix = (cache_key, generation)
+        names = _get_names(model_class, fields)
+        pipe = client.pipeline(transaction=False)
+        for values in model_class.objects.values_list(*names).iterator(chunk_size=BATCH_SIZE):
+            _index_row(pipe, prefix, fields, values[0], dict(zip(names, values)), timeout)
+            count += 1
+            if count % BATCH_SIZE == 0:
+                pipe.execute()
+        pipe.execute()
+        _replay_pending(client, model_class, fields, generation)
+
+        previous = get_generation(model_class)
+        pipe = client.pipeline(transaction=True)
+        pipe.set(make_field_index_key(cache_key, 'built'), generation, ex=settings.CACHE_REDIS_INDEX_TIMEOUT)
+        pipe.delete(building_key)
+        pipe.execute()
+        _replay_pending(client, model_class, fields, generation)
+        if previous is not None:
+            _expire_generation(client, cache_key, previous)
+    finally:
+        release_lock(lock_id, token)
+
+    return {'rows': count, 'elapsed': time.perf_counter() - started}
+
+
+def schedule_redis_index_build(model_class):
+    """build redis indexes of model in background thread pool (once at a time per process)
+    returns True if build is scheduled
+    """
+    return schedule_refresh(f'{model_class.CACHE_KEY}:redis_index', lambda: build_redis_index(model_class))
+
+
+def update_redis_index(model_class, pks):
+    """reindex rows of pks (saved or deleted instances) from database
+    rows are queued for a running build too (see `build_redis_index`)
+    """
+    fields = get_redis_indexed_fields(model_class)
+    if not fields:
+        return
+
+    client = get_redis_client()
+    pks = list(pks)
+    _add_pending(client, model_class.CACHE_KEY, pks)
+    generation = get_generation(model_class)
+    if generation is not None:
+        _reindex(client, model_class, fields, generation, pks)
+
+
+def split_lookups(model_class, lookups: dict):
+    """(lookups evaluated in redis, other lookups) of lookup expressions"""
+    fields = get_redis_indexed_fields(model_class)
+    server, local = {}, {}
+    for expression, value in lookups.items():
+        compiled = compile_lookup(model_class, expression)
+        kind = fields.get(compiled.column)
+        supported = NUMERIC_LOOKUPS if kind == 'numeric' else SET_LOOKUPS
+        if kind and compiled.lookup in supported:
+            server[expression] = value
+        else:
+            local[expression] = value
+    return server, local
+
+
+def filter_pks(model_class, **lookups):
+    """primary keys matching all lookups, evaluated in redis
+    (SINTER of sets for equality filters, ZRANGEBYSCORE of sorted sets for ranges)
+    lookups must be supported (see `split_lookups`)
+    returns set of pks or None if indexes are not built (they're built in background thread pool)
+    """
+    generation = get_generation(model_class)
+    if generation is None:
+        schedule_redis_index_build(model_class)
+        return None
+
+    cache_key = model_class.CACHE_KEY
+    prefix = (cache_key, generation)
+    fields = get_redis_indexed_fields(model_class)
+    pipe = get_redis_client().pipeline(transaction=False)
+    intersect = []  # set keys of equality filters (one SINTER)
+    commands = []  # number of pipelined commands of each other filter
+
+    for compiled, value in compile_filters(model_class, lookups):
+        name, lookup = compiled.column, compiled.lookup
+        if lookup == 'isnull':
+            null_key = make_field_index_key(*prefix, name, NULL)
+            if value:
+                intersect.append(null_key)
+            else:
+                pipe.sdiff(make_field_index_key(*prefix, 'all'), null_key)
+                commands.append(1)
+        elif fields[name] == 'set':
+            if lookup == 'exact':
+                intersect.append(make_field_index_key(*prefix, name, _member(value)))
+            else:
+                keys = [make_field_index_key(*prefix, name, _member(item)) for item in value]
+                if keys:
+                    pipe.sunion(*keys)
+                commands.append(len(keys[:1]))
+        else:
+            zset_key = make_field_index_key(*prefix, name)
+            if lookup in ('exact', 'in'):
+                values = [value] if lookup == 'exact' else list(value)
+                for item in values:
+                    pipe.zrangebyscore(zset_key, _score(item), _score(item))
+                commands.append(len(values))
+            else:
+                low, high = '-inf', '+inf'
+                if lookup == 'range':
+                    low, high = _score(value[0]), _score(value[1])
+                elif lookup in ('gt', 'gte'):
+                    low = _score(value) if lookup == 'gte' else f'({_score(value)}'
+                else:
+                    high = _score(value) if lookup == 'lte' else f'({_score(value)}'
+                pipe.zrangebyscore(zset_key, low, high)
+                commands.append(1)
+
+    if intersect:
+        pipe.sinter(*intersect)
+    results = pipe.execute()
+
+    matched = []
+    position = 0
+    for count in commands:
+        members = set()
+        for result in results[position:position + count]:
+            members.update(result)
+        matched.append(members)
+        position += count
+    if intersect:
+        matched.append(set(results[-1]))
+
+    pks = set.intersection(*matched) if matched else set()
+    to_python = model_class._meta.pk.to_python
+    return {to_python(pk.decode()) for pk in pks}
+
+
+def select_pks(queryset, pks):
+    """rows of queryset (QuerySet, CachedRows, ChunkedRows or list) with primary key in pks
+    cached order is kept, chunked entries only load chunks holding pks
+    """
+    if isinstance(queryset, QuerySet):
+        return queryset.filter(pk__in=pks)
+
+    if isinstance(queryset, ChunkedRows):
+        queryset = queryset.rows(queryset.get_chunk_numbers(pks))
+
+    if isinstance(queryset, CachedRows):
+        column = queryset.columns[queryset.fields.index(queryset.model._meta.pk.attname)]
+        return queryset.subset([position for position in queryset.get_positions() if column[position] in pks])
+
+    return [obj for obj in queryset if obj.pk in pks]
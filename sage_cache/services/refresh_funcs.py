@@ -0,0 +1,65 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+from sage_cache import settings
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def get_executor():
+    """bounded thread pool for background refresh (CACHE_REFRESH_WORKERS threads)"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.CACHE_REFRESH_WORKERS,
+                    thread_name_prefix='sage_cache_refresh'
+                )
+    return _executor
+
+
+def get_pending():
+    """keys which are being refreshed in this process"""
+    with _pending_lock:
+        return set(_pending)
+
+
+def _run(key, func):
+    try:
+        close_old_connections()
+        func()
+    except Exception:
+        logger.exception('background refresh of `%s` failed', key)
+    finally:
+        close_old_connections()
+        with _pending_lock:
+            _pending.discard(key)
+
+
+def schedule_refresh(key: str, func):
+    """run func in background thread pool to refresh key
+    a key is refreshed once at a time per process and at most CACHE_REFRESH_QUEUE_SIZE
+    refreshes are pending, others are dropped (value is refreshed by a later request)
+    returns True if refresh is scheduled
+    """
+    with _pending_lock:
+        if key in _pending or len(_pending) >= settings.CACHE_REFRESH_QUEUE_SIZE:
+            return False
+        _pending.add(key)
+
+    try:
+        get_executor().submit(_run, key, func)
+    except RuntimeError:  # interpreter is shutting down
+        with _pending_lock:
+            _pending.discard(key)
+        return False
+    return True
@@ -0,0 +1,176 @@
+import asyncio
+import math
+import random
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+from sage_cache import settings
+from sage_cache.services.key_funcs import get_redis_client, make_lock_key
+from sage_cache.services.metrics import incr, timer
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def acquire_lock(key: str, timeout: float = None):
+    """acquire recompute lock of cache key (SET NX PX with a random token)
+    returns token or None if lock is held by another worker
+    NOTE: lock expires after `timeout` seconds (default CACHE_STAMPEDE_LOCK_TIMEOUT)
+    """
+    timeout = timeout or settings.CACHE_STAMPEDE_LOCK_TIMEOUT
+    token = uuid.uuid4().hex
+    acquired = get_redis_client().set(
+        cache.make_key(make_lock_key(key)), token, nx=True, px=int(timeout * 1000)
+    )
+    return token if acquired else None
+
+
+def release_lock(key: str, token: str):
+    """release lock of cache key if it's still held with token"""
+    get_redis_client().eval(RELEASE_LOCK_SCRIPT, 1, cache.make_key(make_lock_key(key)), token)
+
+
+def should_recompute_early(meta, beta: float, now: float = None):
+    """probabilistic early expiration (XFetch)
+    recompute before expiry with a probability growing with recompute time (delta) and beta
+    """
+    if not meta or not beta or meta.get('expires_at') is None:
+        return False
+    now = now or time.time()
+    delta = meta.get('delta') or 0
+    return now - delta * beta * math.log(1 - random.random()) >= meta['expires_at']
+
+
+def is_expired(meta, beta: float = None, now: float = None):
+    """check logical expiry of a cached value (values without metadata never expire logically)"""
+    if not meta or meta.get('expires_at') is None:
+        return False
+    now = now or time.time()
+    if now >= meta['expires_at']:
+        return True
+    return should_recompute_early(meta, beta, now=now)
+
+
+def get_wait_timeout(timeout: float = None):
+    """seconds waiters wait for the lock holder (CACHE_STAMPEDE_WAIT_TIMEOUT, default CACHE_STAMPEDE_LOCK_TIMEOUT)"""
+    if timeout is not None:
+        return timeout
+    if settings.CACHE_STAMPEDE_WAIT_TIMEOUT is not None:
+        return settings.CACHE_STAMPEDE_WAIT_TIMEOUT
+    return settings.CACHE_STAMPEDE_LOCK_TIMEOUT
+
+
+def wait_for_value(read, timeout: float = None, interval: float = None):
+    """poll read() until it returns a value or timeout (seconds) passes"""
+    timeout = get_wait_timeout(timeout)
+    interval = interval or settings.CACHE_STAMPEDE_WAIT_INTERVAL
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(interval)
+        value = read()
+        if value is not None:
+            return value
+    return None
+
+
+async def await_for_value(read, timeout: float = None, interval: float = None):
+    """async `wait_for_value`, read is a coroutine function"""
+    timeout = get_wait_timeout(timeout)
+    interval = interval or settings.CACHE_STAMPEDE_WAIT_INTERVAL
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(interval)
+        value = await read()
+        if value is not None:
+            return value
+    return None
+
+
+def wait_for_lock(key: str, read, timeout: float = None, lock_timeout: float = None, interval: float = None):
+    """wait for the worker holding recompute lock of key
+    polls read() until it returns a value, when the lock is released (or expires) without a value it's acquired
+    returns (value, None) or (None, token of the acquired lock)
+    raises TimeoutError after timeout seconds (see `get_wait_timeout`)
+    """
+    timeout = get_wait_timeout(timeout)
+    interval = interval or settings.CACHE_STAMPEDE_WAIT_INTERVAL
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(interval)
+        value = read()
+        if value is not None:
+            return value, None
+        token = acquire_lock(key, timeout=lock_timeout)
+        if token is not None:
+            value = read()  # value may be stored right before the lock is released
+            if value is None:
+                return None, token
+            release_lock(key, token)
+            return value, None
+    raise TimeoutError(f'`{key}` is not recomputed by lock holder in {timeout} seconds')
+
+
+async def await_for_lock(key: str, read, timeout: float = None, lock_timeout: float = None,
+                         interval: float = None):
+    """async `wait_for_lock`, read is a coroutine function"""
+    timeout = get_wait_timeout(timeout)
+    interval = interval or settings.CACHE_STAMPEDE_WAIT_INTERVAL
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(interval)
+        value = await read()
+        if value is not None:
+            return value, None
+        token = await sync_to_async(acquire_lock, thread_sensitive=False)(key, timeout=lock_timeout)
+        if token is not None:
+            value = await read()
+            if value is None:
+                return None, token
+            await sync_to_async(release_lock, thread_sensitive=False)(key, token)
+            return value, None
+    raise TimeoutError(f'`{key}` is not recomputed by lock holder in {timeout} seconds')
+
+
+def recompute(key: str, compute, store, read=None, stale=None, lock=False, lock_timeout=None, wait_timeout=None,
+              cache_key=None):
+    """recompute value of cache key
+    compute() returns new value, store(value, delta) saves it (delta: recompute time in seconds)
+    with lock=True only one worker recomputes (single flight), others
+    return `stale` value if they have one, or wait for read() to return the new value
+    (a waiter takes over the lock if it's released without a value, see `wait_for_lock`)
+    NOTE: waiters raise TimeoutError after wait_timeout, they never recompute without the lock
+    NOTE: cache_key is the CACHE_KEY label of stampede wait metrics
+    """
+    if not lock:
+        return _compute_and_store(compute, store)
+
+    token = acquire_lock(key, timeout=lock_timeout)
+    if token is None:
+        if stale is not None:
+            return stale
+        incr('stampede_waits', cache_key)
+        with timer('stampede_wait_seconds', cache_key):
+            value, token = wait_for_lock(
+                key, read or (lambda: None), timeout=wait_timeout, lock_timeout=lock_timeout
+            )
+        if token is None:
+            return value
+
+    try:
+        return _compute_and_store(compute, store)
+    finally:
+        release_lock(key, token)
+
+
+def _compute_and_store(compute, store):
+    started = time.perf_counter()
+    value = compute()
+    store(value, time.perf_counter() - started)
+    return value
@@ -0,0 +1,504 @@
+import datetime
+import decimal
+import pickle
+import uuid
+import zlib
+from collections.abc import Sequence
+
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
+
+from sage_cache import settings
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import lz4.frame as lz4
+except ImportError:  # pragma: no cover
+    lz4 = None
+
+MAGIC = b'SGC1'
+
+ENCODINGS = {'pickle': b'p', 'msgpack': b'm'}
+COMPRESSIONS = {None: b'-', 'zlib': b'z', 'lz4': b'l'}
+DEFAULT = object()  # use value of settings
+NGRAM_SIZE = 3  # length of n-grams in search indexes
+SEARCH_FIELD_PREFIXES = '^=@$'  # search_fields prefixes of DRF SearchFilter
+IN_FILTER_TYPES = (list, tuple, set, frozenset)  # filter values matched with `in` instead of equality
+
+# msgpack ext type codes
+EXT_DATETIME = 1
+EXT_DATE = 2
+EXT_TIME = 3
+EXT_DECIMAL = 4
+EXT_UUID = 5
+EXT_TIMEDELTA = 6
+
+
+def is_in_filter(value):
+    """check filter value is matched with `in` (list, tuple or set of values)"""
+    return isinstance(value, IN_FILTER_TYPES)
+
+
+def _msgpack_default(obj):
+    """encode python types which msgpack does not support"""
+    if isinstance(obj, datetime.datetime):
+        return msgpack.ExtType(EXT_DATETIME, obj.isoformat().encode())
+    if isinstance(obj, datetime.date):
+        return msgpack.ExtType(EXT_DATE, obj.isoformat().encode())
+    if isinstance(obj, datetime.time):
+        return msgpack.ExtType(EXT_TIME, obj.isoformat().encode())
+    if isinstance(obj, decimal.Decimal):
+        return msgpack.ExtType(EXT_DECIMAL, str(obj).encode())
+    if isinstance(obj, uuid.UUID):
+        return msgpack.ExtType(EXT_UUID, obj.bytes)
+    if isinstance(obj, datetime.timedelta):
+        return msgpack.ExtType(
+            EXT_TIMEDELTA, msgpack.packb([obj.days, obj.seconds, obj.microseconds])
+        )
+    raise TypeError('can not encode {} with msgpack'.format(type(obj).__name__))
+
+
+def _msgpack_ext_hook(code, data):
+    """decode ext types of `_msgpack_default`"""
+    if code == EXT_DATETIME:
+        return datetime.datetime.fromisoformat(data.decode())
+    if code == EXT_TIMEDELTA:
+        days, seconds, microseconds = msgpack.unpackb(data)
+        return datetime.timedelta(days=days, seconds=seconds, microseconds=microseconds)
+    if code == EXT_DATE:
+        return datetime.date.fromisoformat(data.decode())
+    if code == EXT_TIME:
+        return datetime.time.fromisoformat(data.decode())
+    if code == EXT_DECIMAL:
+        return decimal.Decimal(data.decode())
+    if code == EXT_UUID:
+        return uuid.UUID(bytes=data)
+    return msgpack.ExtType(code, data)
+
+
+def encode(obj, encoding: str = None, compression=DEFAULT):
+    """encode obj to bytes with header (magic, encoding, compression)"""
+    encoding = encoding or settings.CACHE_STORAGE_ENCODING
+    if compression is DEFAULT:
+        compression = settings.CACHE_STORAGE_COMPRESSION
+    if encoding not in ENCODINGS:
+        raise ImproperlyConfigured('unknown cache storage encoding `{}`'.format(encoding))
+    if compression not in COMPRESSIONS:
+        raise ImproperlyConfigured('unknown cache storage compression `{}`'.format(compression))
+
+    if encoding == 'msgpack':
+        if msgpack is None:
+            raise ImproperlyConfigured('msgpack must be installed to use msgpack encoding')
+        data = msgpack.packb(obj, default=_msgpack_default, use_bin_type=True)
+    else:
+        data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    if compression == 'zlib':
+        data = zlib.compress(data, settings.CACHE_STORAGE_COMPRESSION_LEVEL)
+    elif compression == 'lz4':
+        if lz4 is None:
+            raise ImproperlyConfigured('lz4 must be installed to use lz4 compression')
+        data = lz4.compress(data)
+
+    return MAGIC + ENCODINGS[encoding] + COMPRESSIONS[compression] + data
+
+
+def is_encoded(value):
+    """check value is encoded by `encode`"""
+    return isinstance(value, bytes) and value[:len(MAGIC)] == MAGIC
+
+
+def decode(value: bytes):
+    """decode bytes made by `encode`"""
+    offset = len(MAGIC)
+    encoding = value[offset:offset + 1]
+    compression = value[offset + 1:offset + 2]
+    data = value[offset + 2:]
+
+    if compression == COMPRESSIONS['zlib']:
+        data = zlib.decompress(data)
+    elif compression == COMPRESSIONS['lz4']:
+        data = lz4.decompress(data)
+
+    if encoding == ENCODINGS['msgpack']:
+        return msgpack.unpackb(data, ext_hook=_msgpack_ext_hook, raw=False, strict_map_key=False)
+    return pickle.loads(data)
+
+
+def get_field_names(model_class, related_paths=()):
+    """concrete field attnames of model and its select_related paths
+    e.g ['id', 'title', 'category_id', 'category__id', 'category__title']
+    """
+    names = [field.attname for field in model_class._meta.concrete_fields]
+    for path in related_paths:
+        current = model_class
+        for name in path.split('__'):
+            current = current._meta.get_field(name).related_model
+        names.extend(
+            '{}__{}'.format(path, field.attname) for field in current._meta.concrete_fields
+        )
+    return names
+
+
+def get_related_paths(model_class, related_paths=None):
+    """select_related paths stored with rows (default CACHED_RELATED_OBJECT of model)
+    parents of nested paths are added before them ('category__parent' needs 'category' to be built first)
+    """
+    if related_paths is None:
+        related_paths = getattr(model_class, 'CACHED_RELATED_OBJECT', [])
+    expanded = set()
+    for path in related_paths:
+        names = path.split('__')
+        expanded.update('__'.join(names[:i]) for i in range(1, len(names) + 1))
+    return sorted(expanded, key=lambda path: (path.count('__'), path))
+
+
+def build_indexes(fields, columns, indexed_fields):
+    """hash indexes {field: {value: [row positions]}} over columns
+    NOTE: fields with unhashable values (e.g JSONField) are not indexed
+    """
+    indexes = {}
+    for name in indexed_fields:
+        if name not in fields:
+            continue
+        index = {}
+        try:
+            for position, value in enumerate(columns[fields.index(name)]):
+                index.setdefault(value, []).append(position)
+        except TypeError:
+            continue
+        indexes[name] = index
+    return indexes
+
+
+def make_ngrams(value, size: int = NGRAM_SIZE):
+    """lowercased character n-grams of value (value itself if it is shorter than size)"""
+    text = str(value).lower()
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def build_search_index(column, size: int = NGRAM_SIZE):
+    """inverted index {n-gram: [row positions]} over text values of a column"""
+    index = {}
+    for position, value in enumerate(column):
+        if value is None:
+            continue
+        for gram in make_ngrams(value, size):
+            index.setdefault(gram, []).append(position)
+    return index
+
+
+def search_index(index, term: str, size: int = NGRAM_SIZE):
+    """row positions which may contain term (case insensitive) in an index made by `build_search_index`
+    posting lists of n-grams of term are intersected (shortest first),
+    terms shorter than size use posting lists of all n-grams containing them
+    NOTE: candidates must be verified, n-grams of term can be found apart in a value
+    """
+    term = term.lower()
+    if len(term) < size:
+        positions = set()
+        for gram, postings in index.items():
+            if term in gram:
+                positions.update(postings)
+        return positions
+
+    grams = sorted(make_ngrams(term, size), key=lambda gram: len(index.get(gram, ())))
+    positions = set(index.get(grams[0], ()))
+    for gram in grams[1:]:
+        if not positions:
+            break
+        positions.intersection_update(index.get(gram, ()))
+    return positions
+
+
+def get_indexed_fields(model_class, fields, extra_fields=()):
+    """column names to index for model
+    from CACHE_INDEXED_FIELDS of model (or extra_fields e.g filterset_fields of view)
+    foreign keys are resolved to their attname ('category' -> 'category_id')
+    """
+    names = list(getattr(model_class, 'CACHE_INDEXED_FIELDS', [])) or list(extra_fields or [])
+    indexed_fields = []
+    for name in names:
+        if name not in fields and '__' not in name:
+            try:
+                name = model_class._meta.get_field(name).attname
+            except Exception:
+                continue
+        if name in fields and name not in indexed_fields:
+            indexed_fields.append(name)
+    return indexed_fields
+
+
+def get_search_fields(model_class, fields, extra_fields=()):
+    """column names with search indexes for model
+    from CACHE_SEARCH_FIELDS of model (or extra_fields e.g search_fields of view, '^title' -> 'title')
+    """
+    names = list(getattr(model_class, 'CACHE_SEARCH_FIELDS', [])) or list(extra_fields or [])
+    search_fields = []
+    for name in names:
+        name = str(name).lstrip(SEARCH_FIELD_PREFIXES)
+        if name in fields and name not in search_fields:
+            search_fields.append(name)
+    return search_fields
+
+
+def dump_rows(queryset, related_paths=None, indexed_fields=None, search_fields=None, search=True, chunk_size=None,
+              delta_id=None):
+    """make a column oriented payload from queryset values
+    payload: {'model': label, 'fields': [...], 'related': [...], 'columns': [[...], ...],
+    'indexes': {...}, 'search': {...}}
+    NOTE: search=False skips search indexes (e.g chunked entries)
+    NOTE: with chunk_size, rows are streamed from database with `iterator(chunk_size)` into columns
+    NOTE: delta_id (change log position of snapshot, see delta_funcs) is stored in payload
+    """
+    model_class = queryset.model
+    related_paths = get_related_paths(model_class, related_paths)
+    fields = get_field_names(model_class, related_paths)
+    if chunk_size:
+        columns = [[] for _ in fields]
+        appends = [column.append for column in columns]
+        for row in queryset.values_list(*fields).iterator(chunk_size=chunk_size):
+            for append, value in zip(appends, row):
+                append(value)
+    else:
+        rows = list(queryset.values_list(*fields))
+        columns = [list(column) for column in zip(*rows)] if rows else [[] for _ in fields]
+    payload = {
+        'model': model_class._meta.label,
+        'fields': fields,
+        'related': list(related_paths),
+        'columns': columns,
+        'indexes': build_indexes(
+            fields, columns, get_indexed_fields(model_class, fields, indexed_fields)
+        ),
+        'search': {
+            name: build_search_index(columns[fields.index(name)])
+            for name in get_search_fields(model_class, fields, search_fields)
+        } if search else {},
+    }
+    if delta_id is not None:
+        payload['delta_id'] = delta_id
+    return payload
+
+
+class CachedRows(Sequence):
+    """lazy sequence of model instances over a column oriented payload
+    instances are built (once) only for accessed rows
+    `positions` makes a view over a subset of payload rows (e.g filter result)
+    """
+
+    def __init__(self, payload, model_class=None, using=DEFAULT_DB_ALIAS, positions=None):
+        self.payload = payload
+        self.model = model_class or apps.get_model(payload['model'])
+        self.fields = payload['fields']
+        self.related = payload['related']
+        self.columns = payload['columns']
+        self.indexes = payload.get('indexes', {})
+        self.search_indexes = payload.get('search', {})
+        self.using = using
+        self.positions = positions
+        self._instances = {}
+        self._plan = None
+
+    def __len__(self):
+        if self.positions is not None:
+            return len(self.positions)
+        return len(self.columns[0]) if self.columns else 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get_instance(self._position(i)) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('CachedRows index out of range')
+        return self._get_instance(self._position(index))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self._get_instance(self._position(index))
+
+    def __repr__(self):
+        return '<CachedRows {} ({} rows)>'.format(self.model._meta.label, len(self))
+
+    def _position(self, index):
+        """payload row position of index"""
+        return index if self.positions is None else self.positions[index]
+
+    def get_positions(self):
+        """payload row positions of this sequence"""
+        if self.positions is None:
+            return range(len(self))
+        return self.positions
+
+    def subset(self, positions):
+        """CachedRows over given payload row positions (built instances are shared)"""
+        rows = CachedRows(self.payload, model_class=self.model, using=self.using, positions=positions)
+        rows._instances = self._instances
+        rows._plan = self._plan
+        return rows
+
+    def column(self, name):
+        """raw values of a field (without building instances)"""
+        column = self.columns[self.fields.index(name)]
+        if self.positions is None:
+            return column
+        return [column[position] for position in self.positions]
+
+    def row(self, index):
+        """raw value tuple of a row"""
+        position = self._position(index)
+        return tuple(column[position] for column in self.columns)
+
+    def is_indexed(self, name):
+        """check field has a hash index"""
+        return name in self.indexes
+
+    def lookup(self, name, value):
+        """payload row positions where field equals value (or is in value, see `is_in_filter`)"""
+        index = self.indexes[name]
+        if is_in_filter(value):
+            positions = set()
+            for item in value:
+                positions.update(index.get(item, ()))
+            return positions
+        return set(index.get(value, ()))
+
+    def is_searchable(self, name):
+        """check field has a search index"""
+        return name in self.search_indexes
+
+    def search(self, name, term: str):
+        """payload row positions which may contain term in field (see `search_index`)"""
+        return search_index(self.search_indexes[name], term)
+
+    def filter_indexed(self, **kwargs):
+        """filter with hash indexes (equality and `in` filters)
+        returns None if a field is not indexed
+        """
+        if not kwargs or not all(self.is_indexed(name) for name in kwargs):
+            return None
+
+        positions = None
+        for name, value in kwargs.items():
+            matched = self.lookup(name, value)
+            positions = matched if positions is None else positions & matched
+            if not positions:
+                break
+        if self.positions is not None:
+            positions &= set(self.positions)
+        return self.subset(sorted(positions))
+
+    def get_plan(self):
+        """(model, path, field names, column positions) for model and related paths"""
+        if self._plan is None:
+            groups = {'': (self.model, [], [])}
+            for path in self.related:
+                current = self.model
+                for name in path.split('__'):
+                    current = current._meta.get_field(name).related_model
+                groups[path] = (current, [], [])
+            for position, name in enumerate(self.fields):
+                path, _, attname = name.rpartition('__')
+                groups[path][1].append(attname)
+                groups[path][2].append(position)
+            self._plan = [
+                (model_class, path, names, positions)
+                for path, (model_class, names, positions) in groups.items()
+            ]
+        return self._plan
+
+    def _get_instance(self, index):
+        instance = self._instances.get(index)
+        if instance is not None:
+            return instance
+
+        built = {}
+        for model_class, path, names, positions in self.get_plan():
+            values = [self.columns[position][index] for position in positions]
+            if path and values[names.index(model_class._meta.pk.attname)] is None:
+                obj = None
+            else:
+                obj = model_class.from_db(self.using, names, values)
+            built[path] = obj
+            if path:
+                parent_path, _, name = path.rpartition('__')
+                parent = built.get(parent_path)
+                if parent is not None:
+                    parent._meta.get_field(name).set_cached_value(parent, obj)
+
+        instance = self._instances[index] = built['']
+        return instance
+
+
+def split_columns(columns, chunk_size: int):
+    """split columns into column lists of chunk_size consecutive rows (order of rows is kept)"""
+    count = len(columns[0]) if columns else 0
+    return [
+        [column[start:start + chunk_size] for column in columns]
+        for start in range(0, count, chunk_size)
+    ] or [[[] for _ in columns]]
+
+
+def merge_columns(chunks):
+    """concatenate column lists of chunks"""
+    columns = [[] for _ in chunks[0]] if chunks else []
+    for chunk in chunks:
+        for values, column in zip(columns, chunk):
+            values.extend(column)
+    return columns
+
+
+def replace_rows(columns, pk_position: int, rows: dict):
+    """replace rows in place, rows: {pk: value tuple or None (deleted row)}
+    returns (new columns, set of pks found in columns)
+    """
+    found = set()
+    replaced = [[] for _ in columns]
+    for position, pk in enumerate(columns[pk_position]):
+        if pk in rows:
+            found.add(pk)
+            row = rows[pk]
+            if row is None:
+                continue
+        else:
+            row = [column[position] for column in columns]
+        for values, value in zip(replaced, row):
+            values.append(value)
+    return replaced, found
+
+
+def append_rows(columns, rows):
+    """append rows (value tuples) to columns"""
+    for row in rows:
+        for values, value in zip(columns, row):
+            values.append(value)
+    return columns
+
+
+def dump_queryset(queryset, encoding: str = None, compression=DEFAULT, indexed_fields=None, search_fields=None,
+                  chunk_size=None, delta_id=None):
+    """encode queryset as compact rows payload"""
+    return encode(
+        dump_rows(
+            queryset,
+            indexed_fields=indexed_fields,
+            search_fields=search_fields,
+            chunk_size=chunk_size,
+            delta_id=delta_id
+        ),
+        encoding=encoding,
+        compression=compression
+    )
+
+
+def load_queryset(value, model_class=None):
+    """decode value made by `dump_queryset` as CachedRows"""
+    return CachedRows(decode(value), model_class=model_class)
@@ -0,0 +1,97 @@
+import time
+
+from django.core.cache import cache
+from django.db import models
+from django.utils.cache import get_cache_key, get_max_age
+
+from sage_cache.services.key_funcs import get_redis_client, make_tag_index_key
+
+# add page key ARGV[1] to tag set, set lives at least ARGV[2] seconds
+# (a tag set is shared by pages with different timeouts, its ttl is only extended)
+TAG_PAGE_SCRIPT = """
+local ttl = redis.call('TTL', KEYS[1])
+redis.call('SADD', KEYS[1], ARGV[1])
+if ttl == -2 or (ttl >= 0 and ttl < tonumber(ARGV[2])) then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return ttl
+"""
+
+
+def make_tag(tag, pk=None):
+    """tag name of a model class ('shop.product'), model instance or model and pk ('shop.product:5') or string"""
+    if isinstance(tag, models.Model):
+        tag, pk = type(tag), tag.pk
+    if isinstance(tag, type) and issubclass(tag, models.Model):
+        tag = tag._meta.label_lower
+    return str(tag) if pk is None else f'{tag}:{pk}'
+
+
+def make_tags(tags):
+    """unique tag names of tags (see `make_tag`)"""
+    return sorted({make_tag(tag) for tag in tags or []})
+
+
+def get_view_tags(tags, view, request, args, kwargs):
+    """tag names of a page, tags is a list or callable(view, request, *args, **kwargs) returning a list"""
+    if callable(tags):
+        tags = tags(view, request, *args, **kwargs)
+    return make_tags(tags)
+
+
+def tag_page(request, key_prefix, response, tags, timeout, stale_timeout=0):
+    """add page key of response (stored by page cache middleware) to sets of tags
+    tag sets live at least as long as the page (max-age of response or timeout, plus stale_timeout)
+    """
+    if not tags:
+        return
+    page_key = get_cache_key(request, key_prefix=key_prefix, method=request.method, cache=cache)
+    if page_key is None:  # response is not cacheable
+        return
+    max_age = get_max_age(response)
+    timeout = timeout if max_age is None else max_age
+    if timeout is not None:
+        timeout += stale_timeout
+
+    raw_key = cache.make_key(page_key)
+    pipe = get_redis_client().pipeline(transaction=False)
+    for tag in tags:
+        tag_key = make_tag_index_key(tag)
+        if timeout is None:
+            pipe.sadd(tag_key, raw_key)
+            pipe.persist(tag_key)
+        else:
+            pipe.eval(TAG_PAGE_SCRIPT, 1, tag_key, raw_key, max(int(timeout), 1))
+    pipe.execute()
+
+
+def invalidate_tags(tags):
+    """delete pages of tags (both per user and per site pages)
+    page keys are read with one SUNION, then pages are unlinked and removed from tag sets in one pipeline
+    (pages tagged in between are kept in their tag sets)
+    returns stats dict: scanned, deleted, elapsed
+    """
+    started = time.perf_counter()
+    tag_keys = [make_tag_index_key(tag) for tag in make_tags(tags)]
+    if not tag_keys:
+        return {'scanned': 0, 'deleted': 0, 'elapsed': 0.0}
+
+    client = get_redis_client()
+    page_keys = list(client.sunion(*tag_keys))
+    deleted = 0
+    if page_keys:
+        pipe = client.pipeline(transaction=True)
+        pipe.unlink(*page_keys)
+        for tag_key in tag_keys:
+            pipe.srem(tag_key, *page_keys)
+        deleted = pipe.execute()[0]
+    return {
+        'scanned': len(page_keys),
+        'deleted': deleted,
+        'elapsed': time.perf_counter() - started,
+    }
+
+
+def get_pages_for_tag(tag):
+    """returns page keys (redis keys) of tag"""
+    return [member.decode() for member in get_redis_client().smembers(make_tag_index_key(make_tag(tag)))]
@@ -1,17 +1,187 @@
-import importlib
+import functools
+import inspect
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from django.utils.module_loading import import_string
 
 from sage_cache import settings
 
+COST_REFERENCE = 0.05  # recompute seconds of a key which keeps its timeout
+SIZE_REFERENCE = 64 * 1024  # payload bytes of a key which keeps its timeout
+WEIGHT_RANGE = (0.5, 2)  # bounds of cost and size weights
+
+
 def default_timeout(user):
     """sample get timeout func for user"""
     return settings.CACHE_TIMEOUT
 
 
-def get_timeout_for_user(user, func):
-    """gets a func for calculating timeout for user"""
-    module = func.split('.')
-    function = module.pop(-1)
-    import_string = '.'.join(module)
-    module = importlib.import_module(import_string)
-    function = getattr(module, function)
-    return function(user)
+@functools.lru_cache(maxsize=None)
+def import_timeout_func(func: str):
+    """import timeout func from dotted path (imported once per path)"""
+    return import_string(func)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_context_names(func):
+    """names of context kwargs func accepts (None for **kwargs)"""
+    try:
+        parameters = inspect.signature(func).parameters.values()
+    except (TypeError, ValueError):
+        return frozenset()
+    if any(parameter.kind == parameter.VAR_KEYWORD for parameter in parameters):
+        return None
+    return frozenset(parameter.name for parameter in parameters)
+
+
+def get_timeout_for_user(user, func, **context):
+    """gets a func (callable or dotted path) for calculating timeout for user
+    context kwargs (e.g key, model_class) are passed if func accepts them
+    """
+    if not callable(func):
+        func = import_timeout_func(func)
+    names = _get_context_names(func)
+    if names is not None:
+        context = {name: value for name, value in context.items() if name in names}
+    return func(user, **context)
+
+
+class KeyStats:
+    """decayed counters of a cache key (counters lose 1/e of their value every window seconds)"""
+    __slots__ = ('updated', 'requests', 'invalidations', 'cost', 'size', 'expires_at')
+
+    def __init__(self, now):
+        self.updated = now
+        self.requests = 0.0
+        self.invalidations = 0.0
+        self.cost = None
+        self.size = None
+        self.expires_at = None
+
+    def decay(self, now, window):
+        factor = math.exp(-max(now - self.updated, 0) / window)
+        self.requests *= factor
+        self.invalidations *= factor
+        self.updated = now
+
+
+class AdaptiveTimeoutPolicy:
+    """per process access statistics of cache keys and timeouts chosen from them
+    tracked per key: request rate (hits and misses), invalidation rate (misses before the known expiry),
+    recompute cost and payload size
+    """
+
+    def __init__(self, window=None, max_keys=None):
+        self.window = window or settings.CACHE_ADAPTIVE_WINDOW
+        self.max_keys = max_keys or settings.CACHE_ADAPTIVE_MAX_KEYS
+        self._stats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key, now):
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = KeyStats(now)
+            if len(self._stats) > self.max_keys:
+                self._stats.popitem(last=False)
+        else:
+            self._stats.move_to_end(key)
+            stats.decay(now, self.window)
+        return stats
+
+    def record_hit(self, key, meta=None):
+        now = time.time()
+        with self._lock:
+            stats = self._get(key, now)
+            stats.requests += 1
+            if meta is not None:
+                stats.expires_at = meta.get('expires_at')
+
+    def record_miss(self, key, missing=True):
+        """miss of key, a missing value before the known expiry of key is counted as invalidation
+        (missing=False for expired or early recomputed values)
+        """
+        now = time.time()
+        with self._lock:
+            stats = self._get(key, now)
+            stats.requests += 1
+            if missing and stats.expires_at is not None and now < stats.expires_at:
+                stats.invalidations += 1
+            stats.expires_at = None
+
+    def record_recompute(self, key, delta: float, size: int = None, timeout=None):
+        """recompute seconds and payload size of key (moving averages)"""
+        now = time.time()
+        with self._lock:
+            stats = self._get(key, now)
+            stats.cost = delta if stats.cost is None else 0.8 * stats.cost + 0.2 * delta
+            if size:
+                stats.size = size if stats.size is None else 0.8 * stats.size + 0.2 * size
+            stats.expires_at = now + timeout if timeout else None
+
+    def get_stats(self, key):
+        """{'request_rate', 'invalidation_rate' (per second), 'cost', 'size'} of key or None"""
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                return None
+            stats.decay(time.time(), self.window)
+            return {
+                'request_rate': stats.requests / self.window,
+                'invalidation_rate': stats.invalidations / self.window,
+                'cost': stats.cost,
+                'size': stats.size,
+            }
+
+    def get_timeout(self, key, base=None):
+        """timeout of key
+        base timeout (CACHE_TIMEOUT) is scaled by expected hits in it: cold keys (less than one expected hit)
+        get a fraction of it, hot keys get log2 of expected hits times more.
+        expensive and small values live longer (hit rate per byte), keys invalidated often don't outlive
+        twice their mean invalidation interval. result is clamped to
+        CACHE_ADAPTIVE_MIN_TIMEOUT/MAX_TIMEOUT and jittered by CACHE_TIMEOUT_JITTER
+        """
+        base = settings.CACHE_TIMEOUT if base is None else base
+        stats = self.get_stats(key) if key is not None else None
+        timeout = base
+        if stats is not None:
+            expected_hits = stats['request_rate'] * base
+            timeout = base * expected_hits if expected_hits < 1 else base * (1 + math.log2(expected_hits))
+            if stats['cost'] is not None:
+                timeout *= _clamp(math.sqrt(stats['cost'] / COST_REFERENCE), *WEIGHT_RANGE)
+            if stats['size']:
+                timeout *= _clamp(math.sqrt(SIZE_REFERENCE / stats['size']), *WEIGHT_RANGE)
+            if stats['invalidation_rate'] > 0:
+                timeout = min(timeout, 2 / stats['invalidation_rate'])
+
+        timeout = _clamp(timeout, settings.CACHE_ADAPTIVE_MIN_TIMEOUT, settings.CACHE_ADAPTIVE_MAX_TIMEOUT)
+        jitter = settings.CACHE_TIMEOUT_JITTER
+        if jitter:
+            timeout *= random.uniform(1 - jitter, 1 + jitter)
+        return max(1, int(timeout))
+
+
+def _clamp(value, low, high):
+    return max(low, min(high, value))
+
+
+_policy = None
+
+
+def get_timeout_policy():
+    """AdaptiveTimeoutPolicy of process"""
+    global _policy
+    if _policy is None:
+        _policy = AdaptiveTimeoutPolicy()
+    return _policy
+
+
+def adaptive_timeout(user=None, key=None, **kwargs):
+    """timeout func choosing timeout of key from its access statistics (see `AdaptiveTimeoutPolicy.get_timeout`)
+    e.g CACHE_PER_USER_TIMEOUT_FUNC = 'sage_cache.services.timeout_funcs.adaptive_timeout'
+    NOTE: statistics are recorded when CACHE_ADAPTIVE_TIMEOUT is enabled
+    """
+    return get_timeout_policy().get_timeout(key)
@@ -1,18 +1,37 @@
+from django.core.exceptions import ValidationError
 from django.http import Http404
 
 from sage_cache.services.cache_funcs import filter_from_cache
+from sage_cache.services.object_funcs import get_object_from_cache, is_object_lookup_field
 
 
 def get_object(cls):
     """get object from cache
+    objects of `model_class` are cached per lookup field (one GET on hits, see `get_object_from_cache`),
+    lookup fields which are not in CACHE_OBJECT_LOOKUP_FIELDS of model are filtered in `queryset` of view,
+    object must match `queryset_filter` of view (and `visible_pks` of per user overlay views)
     Must be replaced with `get_object()` method in viewsets
     """
     lookup_url_kwarg = cls.lookup_url_kwarg or cls.lookup_field
     filter_kwargs = {
         cls.lookup_field: cls.kwargs[lookup_url_kwarg]
     }
-    qs = filter_from_cache(cls.queryset, **filter_kwargs)
-    if len(qs) == 0:
+    model_class = getattr(cls, 'model_class', None)
+    if (model_class is None or not hasattr(model_class, 'CACHE_KEY')
+            or not is_object_lookup_field(model_class, cls.lookup_field)):
+        qs = filter_from_cache(cls.queryset, **filter_kwargs)
+        if len(qs) == 0:
+            raise Http404('Not Found')
+        return qs[0]
+
+    try:
+        obj = get_object_from_cache(model_class, filter_kwargs[cls.lookup_field], field=cls.lookup_field)
+    except (TypeError, ValueError, ValidationError):
+        raise Http404('Not Found')
+    queryset_filter = getattr(cls, 'queryset_filter', None)
+    if obj is None or (queryset_filter and not filter_from_cache([obj], **queryset_filter)):
+        raise Http404('Not Found')
+    visible_pks = getattr(cls, 'visible_pks', None)
+    if visible_pks is not None and obj.pk not in visible_pks:
         raise Http404('Not Found')
-    obj = qs[0]
     return obj
@@ -0,0 +1,213 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import close_old_connections
+
+from sage_cache import settings
+from sage_cache.services.cache_funcs import dump_for_cache, get_queryset_for_cache, get_storage, make_meta
+from sage_cache.services.chunk_funcs import dump_chunks
+from sage_cache.services.key_funcs import (
+    get_keys_for_model,
+    is_chunk_key,
+    is_object_key,
+    is_overlay_key,
+    make_meta_key,
+    make_site_key,
+    register_key,
+    register_manifest,
+)
+from sage_cache.services.stampede_funcs import acquire_lock, release_lock
+from sage_cache.services.timeout_funcs import adaptive_timeout, get_timeout_for_user
+from sage_cache.signals import get_cached_models
+
+logger = logging.getLogger(__name__)
+
+
+def get_warm_keys(model_class):
+    """site key and registered keys (e.g per user keys) of model
+    NOTE: chunks, object caches and visible primary keys of per user overlays are registered with model
+    but they don't hold the queryset of model, they're not warmed
+    """
+    keys = [make_site_key(model_class.CACHE_KEY)]
+    keys.extend(sorted(
+        key for key in get_keys_for_model(model_class.CACHE_KEY)
+        if not (is_chunk_key(key) or is_object_key(key) or is_overlay_key(key)) and key not in keys
+    ))
+    return keys
+
+
+def get_key_user_id(key: str, cache_key: str):
+    """user id (str) of a per user key of model (see `make_user_key`) or None"""
+    suffix = f'-{cache_key}'
+    if key.endswith(suffix) and len(key) > len(suffix):
+        return key[:-len(suffix)]
+    return None
+
+
+def get_users(user_ids):
+    """{user id (str): user} of per user keys with one query, AnonymousUser for `None` (not authenticated)"""
+    unique_attr = settings.CACHE_PER_USER_UNIQUE_ATTR
+    users = {'None': AnonymousUser()} if 'None' in user_ids else {}
+    user_model = get_user_model()
+    try:
+        field = user_model._meta.get_field(unique_attr)
+    except FieldDoesNotExist:
+        return users
+
+    values = []
+    for user_id in user_ids:
+        try:
+            values.append(field.to_python(user_id))
+        except ValidationError:  # e.g None or key which isn't per user
+            pass
+    if values:
+        queryset = user_model._default_manager.filter(**{f'{unique_attr}__in': values})
+        users.update((str(getattr(user, unique_attr)), user) for user in queryset)
+    return users
+
+
+def get_warm_timeouts(model_class, keys):
+    """{key: (timeout, user id)} of keys resolved like they're resolved when keys are written
+    per user keys: CACHE_PER_USER_TIMEOUT_FUNC of their user (user id is used for user index sets),
+    other keys: adaptive timeout (CACHE_ADAPTIVE_TIMEOUT) or CACHE_TIMEOUT
+    """
+    user_ids = {key: get_key_user_id(key, model_class.CACHE_KEY) for key in keys}
+    users = get_users({user_id for user_id in user_ids.values() if user_id is not None})
+    timeouts = {}
+    for key in keys:
+        user_id = user_ids[key]
+        if user_id in users:
+            timeout = get_timeout_for_user(
+                user=users[user_id], func=settings.CACHE_PER_USER_TIMEOUT_FUNC, key=key, model_class=model_class
+            )
+            timeouts[key] = (timeout, None if user_id == 'None' else user_id)
+        else:
+            timeout = adaptive_timeout(key=key) if settings.CACHE_ADAPTIVE_TIMEOUT else settings.CACHE_TIMEOUT
+            timeouts[key] = (timeout, None)
+    return timeouts
+
+
+def get_expiring_keys(keys, within: float = None):
+    """keys which are missing or expire in `within` seconds (default CACHE_WARM_REFRESH_BEFORE)
+    NOTE: keys stored without timeout never expire
+    """
+    within = settings.CACHE_WARM_REFRESH_BEFORE if within is None else within
+    now = time.time()
+    metas = cache.get_many([make_meta_key(key) for key in keys])
+    expiring = []
+    for key in keys:
+        meta = metas.get(make_meta_key(key))
+        if meta is None or (meta.get('expires_at') is not None and meta['expires_at'] - now <= within):
+            expiring.append(key)
+    return expiring
+
+
+def warm_model(model_class, keys=None, timeout=None, storage=None, chunk_size=None):
+    """compute cached value of model once and store it in keys (default `get_warm_keys`) with one pipeline
+    rows are read from database in chunks of chunk_size (default CACHE_WARM_CHUNK_SIZE),
+    recompute lock of first key is held, so workers using `lock` wait for the warmed value
+    without timeout, timeouts of keys are resolved like they're written (see `get_warm_timeouts`)
+    per user keys are registered in index sets of their users
+    returns stats dict: model, keys, skipped (lock is held by another worker), elapsed
+    """
+    started = time.perf_counter()
+    keys = get_warm_keys(model_class) if keys is None else list(keys)
+    stats = {'model': model_class._meta.label, 'keys': len(keys), 'skipped': False, 'elapsed': 0.0}
+    if not keys:
+        return stats
+
+    storage = get_storage(model_class, storage)
+    chunk_size = chunk_size or settings.CACHE_WARM_CHUNK_SIZE
+    stale_timeout = max(settings.CACHE_STALE_TIMEOUT or 0, settings.CACHE_STALE_WHILE_REVALIDATE or 0)
+
+    token = acquire_lock(keys[0])
+    if token is None:  # key is being recomputed
+        stats['skipped'] = True
+        return stats
+
+    try:
+        value = dump_for_cache(get_queryset_for_cache(model_class), storage=storage, chunk_size=chunk_size)
+        delta = time.perf_counter() - started
+        timeouts = get_warm_timeouts(model_class, keys)
+        if timeout is not None:
+            timeouts = {key: (timeout, user_id) for key, (_, user_id) in timeouts.items()}
+        values = {}  # physical timeout -> values stored with it
+        registered = []
+        for key in keys:
+            key_timeout, user_id = timeouts[key]
+            physical_timeout = key_timeout + stale_timeout if key_timeout and stale_timeout else key_timeout
+            entry, chunks = dump_chunks(key, value) if storage == 'chunked' else (value, {})
+            values.setdefault(physical_timeout, {}).update(chunks)
+            values[physical_timeout][key] = entry
+            values[physical_timeout][make_meta_key(key)] = make_meta(key_timeout, delta)
+            registered.append(([key, *chunks], user_id, physical_timeout))
+        for physical_timeout, items in values.items():
+            cache.set_many(items, physical_timeout)
+        for items, user_id, physical_timeout in registered:
+            register_key(items, cache_key=model_class.CACHE_KEY, user_id=user_id, timeout=physical_timeout)
+            if storage == 'chunked':
+                register_manifest(items[0], model_class.CACHE_KEY, timeout=physical_timeout)
+    finally:
+        release_lock(keys[0], token)
+
+    stats['elapsed'] = time.perf_counter() - started
+    return stats
+
+
+def _run(func, model_class, **kwargs):
+    try:
+        close_old_connections()
+        return func(model_class, **kwargs)
+    except Exception as e:
+        logger.exception('warming `%s` failed', model_class._meta.label)
+        return {'model': model_class._meta.label, 'error': str(e)}
+    finally:
+        close_old_connections()
+
+
+def warm_models(models=None, concurrency: int = None, keys_func=None, **kwargs):
+    """run `warm_model` for models (default all ModelCacheMixin models) in a bounded thread pool
+    keys_func(model_class) returns keys to warm (default `get_warm_keys`), models without keys are skipped
+    returns list of stats dicts (with `error` for failed models)
+    """
+    models = get_cached_models() if models is None else list(models)
+    concurrency = concurrency or settings.CACHE_WARM_CONCURRENCY
+
+    def warm(model_class):
+        keys = keys_func(model_class) if keys_func else None
+        if keys is not None and not keys:
+            return None
+        return _run(warm_model, model_class, keys=keys, **kwargs)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='sage_cache_warm') as executor:
+        return [stats for stats in executor.map(warm, models) if stats is not None]
+
+
+def refresh_expiring(models=None, within: float = None, concurrency: int = None, **kwargs):
+    """warm keys of models which are missing or expire in `within` seconds (see `get_expiring_keys`)"""
+    return warm_models(
+        models,
+        concurrency=concurrency,
+        keys_func=lambda model_class: get_expiring_keys(get_warm_keys(model_class), within),
+        **kwargs
+    )
+
+
+def warm_periodically(interval: float, within: float = None, models=None, stop: threading.Event = None,
+                      callback=None, **kwargs):
+    """run `refresh_expiring` every interval seconds until stop is set
+    callback(results) is called after every round
+    NOTE: interval must be shorter than `within` (CACHE_WARM_REFRESH_BEFORE) to refresh keys before they expire
+    """
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        results = refresh_expiring(models, within=within, **kwargs)
+        if callback is not None:
+            callback(results)
+        stop.wait(interval)
@@ -9,7 +9,57 @@ CACHE_PER_USER_TIMEOUT_FUNC = getattr(
     'sage_cache.services.timeout_funcs.default_timeout'
 )
 CACHE_PER_USER_UNIQUE_ATTR = getattr(settings, 'CACHE_PER_USER_UNIQUE_ATTR', 'id')
+CACHE_PER_USER_OVERLAY = getattr(settings, 'CACHE_PER_USER_OVERLAY', False)
 CACHE_QUERYSET_ENABLED = getattr(settings, 'CACHE_QUERYSET_ENABLED', True)
 CACHE_TIMEOUT = getattr(settings, 'CACHE_TIMEOUT', 60)
 CACHE_PAGE_ENABLED = getattr(settings, 'CACHE_PAGE_ENABLED', True)
 CACHE_PAGE_PER_SITE_PREFIX = getattr(settings, 'CACHE_PAGE_PER_SITE_PREFIX', 'cache_page')
+CACHE_PAGE_TAG_AUTO_INVALIDATE = getattr(settings, 'CACHE_PAGE_TAG_AUTO_INVALIDATE', True)
+CACHE_KEY_REGISTRY_PREFIX = getattr(settings, 'CACHE_KEY_REGISTRY_PREFIX', 'sage_cache')
+CACHE_SCAN_COUNT = getattr(settings, 'CACHE_SCAN_COUNT', 1000)
+CACHE_UNLINK_BATCH_SIZE = getattr(settings, 'CACHE_UNLINK_BATCH_SIZE', 500)
+CACHE_INVALIDATION_WORKERS = getattr(settings, 'CACHE_INVALIDATION_WORKERS', 2)
+CACHE_AUTO_INVALIDATE = getattr(settings, 'CACHE_AUTO_INVALIDATE', True)
+CACHE_STORAGE_FORMAT = getattr(settings, 'CACHE_STORAGE_FORMAT', 'queryset')
+CACHE_STORAGE_ENCODING = getattr(settings, 'CACHE_STORAGE_ENCODING', 'pickle')
+CACHE_STORAGE_COMPRESSION = getattr(settings, 'CACHE_STORAGE_COMPRESSION', None)
+CACHE_STORAGE_COMPRESSION_LEVEL = getattr(settings, 'CACHE_STORAGE_COMPRESSION_LEVEL', 6)
+CACHE_L1_ENABLED = getattr(settings, 'CACHE_L1_ENABLED', False)
+CACHE_L1_TIMEOUT = getattr(settings, 'CACHE_L1_TIMEOUT', 30)
+CACHE_L1_MAX_ENTRIES = getattr(settings, 'CACHE_L1_MAX_ENTRIES', 128)
+CACHE_L1_MAX_ENTRY_BYTES = getattr(settings, 'CACHE_L1_MAX_ENTRY_BYTES', 16 * 1024 * 1024)
+CACHE_L1_MAX_BYTES = getattr(settings, 'CACHE_L1_MAX_BYTES', 128 * 1024 * 1024)
+CACHE_L1_EVICTION_POLICY = getattr(settings, 'CACHE_L1_EVICTION_POLICY', 'lru')
+CACHE_STAMPEDE_LOCK = getattr(settings, 'CACHE_STAMPEDE_LOCK', False)
+CACHE_STAMPEDE_LOCK_TIMEOUT = getattr(settings, 'CACHE_STAMPEDE_LOCK_TIMEOUT', 10)
+CACHE_STAMPEDE_WAIT_TIMEOUT = getattr(settings, 'CACHE_STAMPEDE_WAIT_TIMEOUT', None)
+CACHE_STAMPEDE_WAIT_INTERVAL = getattr(settings, 'CACHE_STAMPEDE_WAIT_INTERVAL', 0.05)
+CACHE_STALE_TIMEOUT = getattr(settings, 'CACHE_STALE_TIMEOUT', 0)
+CACHE_XFETCH_BETA = getattr(settings, 'CACHE_XFETCH_BETA', 0)
+CACHE_STALE_WHILE_REVALIDATE = getattr(settings, 'CACHE_STALE_WHILE_REVALIDATE', 0)
+CACHE_REFRESH_WORKERS = getattr(settings, 'CACHE_REFRESH_WORKERS', 4)
+CACHE_REFRESH_QUEUE_SIZE = getattr(settings, 'CACHE_REFRESH_QUEUE_SIZE', 100)
+CACHE_ASYNC_REDIS_URL = getattr(settings, 'CACHE_ASYNC_REDIS_URL', None)
+CACHE_ASYNC_CONNECTION_KWARGS = getattr(settings, 'CACHE_ASYNC_CONNECTION_KWARGS', {})
+CACHE_CHUNK_SIZE = getattr(settings, 'CACHE_CHUNK_SIZE', 1000)
+CACHE_REDIS_INDEX_TIMEOUT = getattr(settings, 'CACHE_REDIS_INDEX_TIMEOUT', 24 * 60 * 60)
+CACHE_METRICS_ENABLED = getattr(settings, 'CACHE_METRICS_ENABLED', False)
+CACHE_METRICS_EXPORTERS = getattr(
+    settings, 'CACHE_METRICS_EXPORTERS',
+    ['sage_cache.services.metrics.PrometheusExporter']
+)
+CACHE_METRICS_STATSD_HOST = getattr(settings, 'CACHE_METRICS_STATSD_HOST', 'localhost')
+CACHE_METRICS_STATSD_PORT = getattr(settings, 'CACHE_METRICS_STATSD_PORT', 8125)
+CACHE_METRICS_STATSD_PREFIX = getattr(settings, 'CACHE_METRICS_STATSD_PREFIX', 'sage_cache')
+CACHE_WARM_CONCURRENCY = getattr(settings, 'CACHE_WARM_CONCURRENCY', 4)
+CACHE_BULK_CONCURRENCY = getattr(settings, 'CACHE_BULK_CONCURRENCY', 4)
+CACHE_WARM_CHUNK_SIZE = getattr(settings, 'CACHE_WARM_CHUNK_SIZE', 2000)
+CACHE_WARM_REFRESH_BEFORE = getattr(settings, 'CACHE_WARM_REFRESH_BEFORE', 10)
+CACHE_DELTA_MAX_LENGTH = getattr(settings, 'CACHE_DELTA_MAX_LENGTH', 10000)
+CACHE_DELTA_COMPACT_AFTER = getattr(settings, 'CACHE_DELTA_COMPACT_AFTER', 1)
+CACHE_ADAPTIVE_TIMEOUT = getattr(settings, 'CACHE_ADAPTIVE_TIMEOUT', False)
+CACHE_ADAPTIVE_MIN_TIMEOUT = getattr(settings, 'CACHE_ADAPTIVE_MIN_TIMEOUT', 5)
+CACHE_ADAPTIVE_MAX_TIMEOUT = getattr(settings, 'CACHE_ADAPTIVE_MAX_TIMEOUT', 3600)
+CACHE_ADAPTIVE_WINDOW = getattr(settings, 'CACHE_ADAPTIVE_WINDOW', 300)
+CACHE_ADAPTIVE_MAX_KEYS = getattr(settings, 'CACHE_ADAPTIVE_MAX_KEYS', 10000)
+CACHE_TIMEOUT_JITTER = getattr(settings, 'CACHE_TIMEOUT_JITTER', 0.1)
@@ -0,0 +1,241 @@
+import threading
+from collections import defaultdict
+
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from sage_cache import settings
+from sage_cache.services.cache_funcs import clear_cache_for_model
+from sage_cache.services.invalidation_funcs import unlink_keys
+from sage_cache.services.chunk_funcs import update_chunks
+from sage_cache.services.delta_funcs import append_delta, is_delta_enabled
+from sage_cache.services.object_funcs import get_object_keys
+from sage_cache.services.overlay_funcs import clear_overlays
+from sage_cache.services.redis_index_funcs import update_redis_index
+from sage_cache.services.tag_funcs import invalidate_tags, make_tag
+
+# model class -> CACHE_KEYs that must be invalidated when it changes
+_dependencies = defaultdict(set)
+_local = threading.local()
+
+
+def get_cached_models():
+    """returns all installed models using ModelCacheMixin"""
+    from sage_cache.mixins.model_cache import ModelCacheMixin
+
+    return [
+        model for model in apps.get_models()
+        if issubclass(model, ModelCacheMixin) and hasattr(model, 'CACHE_KEY')
+    ]
+
+
+def get_related_models(model_class):
+    """returns models of CACHED_RELATED_OBJECT paths (e.g 'category__parent')"""
+    related_models = []
+    for path in getattr(model_class, 'CACHED_RELATED_OBJECT', []):
+        current = model_class
+        for name in path.split('__'):
+            current = current._meta.get_field(name).related_model
+            if current is None:
+                break
+            related_models.append(current)
+    return related_models
+
+
+def register_dependencies(model_class):
+    """map model and its cached related models to model CACHE_KEY"""
+    _dependencies[model_class].add(model_class.CACHE_KEY)
+    for related_model in get_related_models(model_class):
+        _dependencies[related_model].add(model_class.CACHE_KEY)
+    for field in model_class._meta.many_to_many:
+        _dependencies[field.remote_field.through].add(model_class.CACHE_KEY)
+
+
+def get_dependent_cache_keys(model_class):
+    """returns CACHE_KEYs depending on model"""
+    return _dependencies.get(model_class, set())
+
+
+def _get_pending(using):
+    """pending batch of current transaction: CACHE_KEYs to clear, changed rows of chunked entries,
+    changed rows of redis indexes and change logs, page tags to invalidate, object keys to remove
+    and CACHE_KEYs of change logged models whose per user overlays are removed
+    batches are kept per thread and keyed by the outermost atomic block of the connection
+    NOTE: flush is registered with `transaction.on_commit` for every write, so the batch is flushed once
+    if any of its writes commits (a rolled back savepoint only discards callbacks of its own writes)
+    """
+    connection = connections[using]
+    block = connection.atomic_blocks[0] if connection.atomic_blocks else None
+    batches = getattr(_local, 'batches', None)
+    if batches is None:
+        batches = _local.batches = {}
+
+    pending = batches.get(using)
+    if pending is None or pending[0] is not block:
+        batch = {
+            'keys': set(), 'rows': {}, 'indexes': {}, 'deltas': {}, 'tags': set(), 'objects': set(),
+            'overlays': set(), 'flushed': False,
+        }
+
+        def flush(batch=batch):
+            if batch['flushed']:
+                return
+            batch['flushed'] = True
+            if batches.get(using, (None, None))[1] is batch:
+                batches.pop(using)
+            keys, overlays, tags, objects = batch['keys'], batch['overlays'], batch['tags'], batch['objects']
+            for cache_key in keys:
+                clear_cache_for_model(cache_key)
+            for cache_key, (model_class, pks) in batch['rows'].items():
+                if cache_key not in keys:
+                    update_chunks(cache_key, model_class, pks)
+            for model_class, pks in batch['indexes'].items():
+                update_redis_index(model_class, list(pks))
+            for model_class, pks in batch['deltas'].items():
+                if model_class.CACHE_KEY not in keys:
+                    append_delta(model_class, list(pks))
+            for cache_key in overlays - keys:
+                clear_overlays(cache_key)
+            if tags:
+                invalidate_tags(tags)
+            if objects:
+                unlink_keys(list(objects))
+
+        batch['flush'] = flush
+        pending = batches[using] = (block, batch)
+    batch = pending[1]
+    transaction.on_commit(batch['flush'], using=using)
+    return batch
+
+
+def schedule_invalidation(cache_keys, using=None):
+    """invalidate CACHE_KEYs after current transaction commits
+    all writes of one transaction are coalesced into one invalidation per key
+    outside of transactions keys are invalidated immediately
+    """
+    using = using or DEFAULT_DB_ALIAS
+    if not cache_keys:
+        return
+    if not connections[using].in_atomic_block:
+        for cache_key in cache_keys:
+            clear_cache_for_model(cache_key)
+        return
+    _get_pending(using)['keys'].update(cache_keys)
+
+
+def schedule_chunk_update(cache_key, model_class, pk, using=None):
+    """rewrite chunks of a changed row in chunked entries of CACHE_KEY after current transaction commits
+    changed rows of one transaction are coalesced into one update per key
+    """
+    using = using or DEFAULT_DB_ALIAS
+    if not connections[using].in_atomic_block:
+        update_chunks(cache_key, model_class, [pk])
+        return
+    rows = _get_pending(using)['rows']
+    rows.setdefault(cache_key, (model_class, set()))[1].add(pk)
+
+
+def schedule_index_update(model_class, pk, using=None):
+    """reindex a changed row in redis indexes of model after current transaction commits"""
+    using = using or DEFAULT_DB_ALIAS
+    if not connections[using].in_atomic_block:
+        update_redis_index(model_class, [pk])
+        return
+    _get_pending(using)['indexes'].setdefault(model_class, set()).add(pk)
+
+
+def schedule_delta(model_class, pk, using=None):
+    """append a changed row to change log of model after current transaction commits
+    changed rows of one transaction are logged in one entry
+    """
+    using = using or DEFAULT_DB_ALIAS
+    if not connections[using].in_atomic_block:
+        append_delta(model_class, [pk])
+        return
+    _get_pending(using)['deltas'].setdefault(model_class, set()).add(pk)
+
+
+def schedule_overlay_invalidation(cache_key, using=None):
+    """remove per user overlays (visible primary keys) of CACHE_KEY after current transaction commits"""
+    using = using or DEFAULT_DB_ALIAS
+    if not connections[using].in_atomic_block:
+        clear_overlays(cache_key)
+        return
+    _get_pending(using)['overlays'].add(cache_key)
+
+
+def schedule_object_invalidation(instance, using=None):
+    """remove object caches of instance (see `get_object_from_cache`) after current transaction commits"""
+    using = using or DEFAULT_DB_ALIAS
+    if not connections[using].in_atomic_block:
+        unlink_keys(get_object_keys(instance))
+        return
+    _get_pending(using)['objects'].update(get_object_keys(instance))
+
+
+def schedule_tag_invalidation(tags, using=None):
+    """delete pages of tags after current transaction commits (one invalidation for all tags of transaction)"""
+    using = using or DEFAULT_DB_ALIAS
+    if not connections[using].in_atomic_block:
+        invalidate_tags(tags)
+        return
+    _get_pending(using)['tags'].update(tags)
+
+
+def invalidate_on_save(sender, instance, raw=False, using=None, **kwargs):
+    """post_save/post_delete receiver
+    with chunked storage, entries of the saved model only get the chunk of the row rewritten,
+    models with CACHE_DELTA_LOG get the row appended to their change log
+    and object caches of the instance and per user overlays are removed (other storages clear all caches of model)
+    redis indexes (CACHE_REDIS_INDEXED_FIELDS) of the saved model are updated
+    pages tagged with the model or the instance are deleted (CACHE_PAGE_TAG_AUTO_INVALIDATE)
+    """
+    if raw:
+        return
+    if settings.CACHE_PAGE_TAG_AUTO_INVALIDATE:
+        tags = [make_tag(sender)] if instance.pk is None else [make_tag(sender), make_tag(sender, instance.pk)]
+        schedule_tag_invalidation(tags, using=using)
+    if getattr(sender, 'CACHE_REDIS_INDEXED_FIELDS', None) and instance.pk is not None:
+        schedule_index_update(sender, instance.pk, using=using)
+    cache_keys = get_dependent_cache_keys(sender)
+    cache_key = getattr(sender, 'CACHE_KEY', None)
+    if cache_key in cache_keys and instance.pk is not None and is_delta_enabled(sender):
+        schedule_delta(sender, instance.pk, using=using)
+        schedule_object_invalidation(instance, using=using)
+        schedule_overlay_invalidation(cache_key, using=using)
+        cache_keys = cache_keys - {cache_key}
+    elif settings.CACHE_STORAGE_FORMAT == 'chunked' and cache_key in cache_keys and instance.pk is not None:
+        schedule_chunk_update(cache_key, sender, instance.pk, using=using)
+        schedule_object_invalidation(instance, using=using)
+        schedule_overlay_invalidation(cache_key, using=using)
+        cache_keys = cache_keys - {cache_key}
+    schedule_invalidation(cache_keys, using=using)
+
+
+def invalidate_on_m2m_changed(sender, instance, action, model, using=None, **kwargs):
+    """m2m_changed receiver"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    cache_keys = set(get_dependent_cache_keys(sender))
+    cache_keys.update(get_dependent_cache_keys(instance.__class__))
+    cache_keys.update(get_dependent_cache_keys(model))
+    schedule_invalidation(cache_keys, using=using)
+
+
+def connect_signals():
+    """connect invalidation receivers for ModelCacheMixin models
+    NOTE: set CACHE_AUTO_INVALIDATE = False on model to skip it
+    """
+    if not settings.CACHE_AUTO_INVALIDATE:
+        return
+
+    for model_class in get_cached_models():
+        if getattr(model_class, 'CACHE_AUTO_INVALIDATE', True):
+            register_dependencies(model_class)
+
+    for model_class in list(_dependencies):
+        uid = f'sage_cache_{model_class._meta.label_lower}'
+        post_save.connect(invalidate_on_save, sender=model_class, dispatch_uid=uid)
+        post_delete.connect(invalidate_on_save, sender=model_class, dispatch_uid=uid)
+        m2m_changed.connect(invalidate_on_m2m_changed, sender=model_class, dispatch_uid=uid)
@@ -19,6 +19,12 @@ setup(
         'django-filters',
         'djangorestframework',
         'cryptography',
+        'pycryptodome',
         'django-redis'
-    ]
+    ],
+    extras_require={
+        'msgpack': ['msgpack'],
+        'lz4': ['lz4'],
+        'test': ['pytest', 'fakeredis'],
+    }
 )
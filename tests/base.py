@@ -0,0 +1,25 @@
+from django.test import TransactionTestCase
+from django_redis import get_redis_connection
+
+from sage_cache.services.local_cache import get_local_cache
+from tests.testapp.models import Category, Product
+
+
+class CacheTestCase(TransactionTestCase):
+    """test case with an empty database and redis (fakeredis) for every test"""
+
+    def setUp(self):
+        self.redis = get_redis_connection('default')
+        self.redis.flushall()
+        get_local_cache().clear()
+
+    def seed(self, count=10):
+        """two categories and count products (odd products in first category)"""
+        first = Category.objects.create(title='first')
+        second = Category.objects.create(title='second')
+        return [
+            Product.objects.create(
+                title=f'product {i}', slug=f'product-{i}', price=i, category=first if i % 2 else second
+            )
+            for i in range(count)
+        ]
@@ -0,0 +1,27 @@
+"""settings of the test suite: sqlite in memory and an in-process fakeredis server"""
+import fakeredis
+from fakeredis.aioredis import FakeAsyncRedisConnection
+
+SECRET_KEY = 'sage-cache-tests'
+INSTALLED_APPS = [
+    'django.contrib.contenttypes',
+    'django.contrib.auth',
+    'rest_framework',
+    'sage_cache',
+    'tests.testapp',
+]
+DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}}
+REDIS_SERVER = fakeredis.FakeServer()
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://localhost:6379/0',
+        'OPTIONS': {
+            'CONNECTION_POOL_KWARGS': {'connection_class': fakeredis.FakeRedisConnection, 'server': REDIS_SERVER},
+        },
+    }
+}
+CACHE_ASYNC_CONNECTION_KWARGS = {'connection_class': FakeAsyncRedisConnection}
+USE_TZ = True
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+ALLOWED_HOSTS = ['*']
@@ -0,0 +1,69 @@
+import asyncio
+import threading
+from unittest import mock
+
+from django.core.cache import cache
+
+from sage_cache.services import bulk_funcs
+from sage_cache.services.bulk_funcs import aget_many_from_cache, get_many_from_cache
+from sage_cache.services.key_funcs import get_keys_for_model
+from sage_cache.services.storage_funcs import CachedRows
+from tests.base import CacheTestCase
+from tests.testapp.models import Category, Event, Product
+
+
+class GetManyFromCacheTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.products = self.seed(4)
+
+    def test_misses_are_stored_with_one_write(self):
+        with mock.patch.object(cache, 'set_many', wraps=cache.set_many) as set_many:
+            values = get_many_from_cache([Product, 'category'], timeout=60, storage='rows', concurrency=1)
+        set_many.assert_called_once()
+        self.assertEqual(set(values), {Product, 'category'})
+        self.assertIsInstance(values[Product], CachedRows)
+        self.assertEqual([row.pk for row in values[Product]], [product.pk for product in self.products])
+        self.assertEqual(sorted(row.title for row in values['category']), ['first', 'second'])
+        self.assertEqual(get_keys_for_model('product'), ['product'])
+
+    def test_hits_are_read_with_one_round_trip(self):
+        get_many_from_cache([Product, Category], timeout=60)
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many, self.assertNumQueries(0):
+            values = get_many_from_cache([Product, Category], timeout=60)
+        get_many.assert_called_once()
+        self.assertEqual(len(values[Product]), 4)
+        self.assertEqual(Product.get_many_from_cache(Category)[Category], values[Category])
+
+    def test_only_missed_models_are_queried(self):
+        get_many_from_cache([Product], timeout=60)
+        with self.assertNumQueries(2):
+            values = get_many_from_cache([Product, Category, Event], timeout=60, concurrency=1)
+        self.assertEqual([len(values[model]) for model in (Product, Category, Event)], [4, 2, 0])
+
+    def test_misses_are_computed_concurrently(self):
+        computed = {model_class: bulk_funcs._compute(model_class, None) for model_class in (Product, Category)}
+        threads = []
+
+        def compute_in_thread(model_class, storage):
+            threads.append(threading.current_thread().name)
+            return computed[model_class]
+
+        with mock.patch.object(bulk_funcs, '_compute_in_thread', side_effect=compute_in_thread):
+            values = get_many_from_cache([Product, Category], timeout=60, concurrency=2)
+        self.assertEqual(len(threads), 2)
+        self.assertTrue(all(name.startswith('sage_cache_bulk') for name in threads))
+        self.assertEqual((len(values[Product]), len(values[Category])), (4, 2))
+
+    def test_async_hits(self):
+        get_many_from_cache([Product, Category], timeout=60)
+        with self.assertNumQueries(0):
+            values = asyncio.run(aget_many_from_cache(['product', Category], timeout=60))
+        self.assertEqual((len(values['product']), len(values[Category])), (4, 2))
+
+    def test_unknown_models(self):
+        with self.assertRaises(LookupError):
+            get_many_from_cache(['missing'])
+        with self.assertRaises(AttributeError):
+            get_many_from_cache([CachedRows])
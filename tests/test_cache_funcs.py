@@ -0,0 +1,29 @@
+from unittest import mock
+
+from sage_cache.services.cache_funcs import filter_from_cache
+from sage_cache.services.storage_funcs import CachedRows, dump_rows
+from tests.base import CacheTestCase
+from tests.testapp.models import Product
+
+
+class FilterFromCacheTests(CacheTestCase):
+
+    def assert_in_filters(self, queryset, name, values, expected):
+        for value in (list(values), tuple(values), set(values), frozenset(values)):
+            with self.subTest(kind=type(value).__name__):
+                self.assertEqual(sorted(obj.pk for obj in filter_from_cache(queryset, **{name: value})), expected)
+
+    def test_in_filters_of_instances(self):
+        products = self.seed(6)
+        expected = [products[1].pk, products[4].pk]
+        self.assert_in_filters(products, 'price', [1, 4], expected)
+        self.assert_in_filters(products, 'title', ['product 1', 'product 4'], expected)
+
+    def test_in_filters_of_rows(self):
+        products = self.seed(6)
+        expected = [products[1].pk, products[4].pk]
+        with mock.patch.object(Product, 'CACHE_INDEXED_FIELDS', ['price'], create=True):
+            rows = CachedRows(dump_rows(Product.objects.all()), model_class=Product)
+        self.assertTrue(rows.is_indexed('price'))
+        self.assert_in_filters(rows, 'price', [1, 4], expected)  # hash index
+        self.assert_in_filters(rows, 'title', ['product 1', 'product 4'], expected)  # raw columns
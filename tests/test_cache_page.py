@@ -0,0 +1,136 @@
+import asyncio
+import warnings
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.cache import cache
+from django.utils.cache import get_cache_key
+from django.http import HttpResponse
+from django_redis.cache import RedisCache
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+from sage_cache.decorators import cache_page
+from sage_cache.decorators.cache_page import arender_page, cache_page_per_site, get_cache_middleware
+from sage_cache.services import timeout_funcs
+from sage_cache.services.key_funcs import make_meta_key
+from tests.base import CacheTestCase
+
+PATH = '/products/'
+PREFIX = 'cache_page'
+
+
+def make_view(rendered, lock=False):
+    """APIView cached per site with 30 seconds stale_while_revalidate, rendered requests are appended"""
+
+    class View(APIView):
+        @cache_page_per_site(lock=lock, stale_while_revalidate=30)
+        def get(self, request):
+            rendered.append(request)
+            return Response({'count': len(rendered)})
+
+    view = View.as_view()
+    return lambda request: view(request).render()
+
+
+@mock.patch('sage_cache.settings.CACHE_TIMEOUT', 10)
+class CachePageTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+
+    def test_headers_use_timeout_and_page_is_kept_stale(self):
+        view = make_view([])
+        response = view(self.factory.get(PATH))
+        self.assertIn('max-age=10', response['Cache-Control'])
+
+        page_key = get_cache_key(self.factory.get(PATH), key_prefix=PREFIX, method='GET', cache=cache)
+        self.assertGreater(cache.ttl(page_key), 30)
+        self.assertEqual(view(self.factory.get(PATH))['Cache-Control'], response['Cache-Control'])
+
+    def test_refresh_renders_copy_of_request(self):
+        rendered = []
+        view = make_view(rendered)
+        view(self.factory.get(PATH))
+        cache.delete(make_meta_key(f'page:{PREFIX}:{PATH}'))  # page is stale
+
+        served = self.factory.get(PATH)
+        with mock.patch('sage_cache.decorators.cache_page.schedule_refresh') as schedule_refresh:
+            response = view(served)
+        self.assertEqual(response.data, {'count': 1})
+        self.assertEqual(len(rendered), 1)
+
+        schedule_refresh.call_args[0][1]()
+        self.assertEqual(len(rendered), 2)
+        self.assertIsNot(rendered[1]._request, served)
+        self.assertEqual(view(self.factory.get(PATH)).data, {'count': 2})
+
+    def test_hit_reads_page_once(self):
+        view = make_view([], lock=True)
+        view(self.factory.get(PATH))
+        with mock.patch.object(RedisCache, 'get', autospec=True, side_effect=RedisCache.get) as get:
+            self.assertEqual(view(self.factory.get(PATH)).data, {'count': 1})
+        keys = [call.args[1] for call in get.call_args_list]
+        self.assertEqual(len([key for key in keys if key.startswith('views.decorators.cache.cache_page.')]), 1)
+        self.assertEqual(len([key for key in keys if key.startswith('views.decorators.cache.cache_header.')]), 1)
+
+    def test_async_hit_reads_page_once(self):
+        async def view_func(view, request):
+            return HttpResponse('page')
+
+        def render():
+            return asyncio.run(arender_page(
+                view_func, SimpleNamespace(), self.factory.get(PATH), (), {},
+                timeout=10, key_prefix=PREFIX, lock=True, stale_while_revalidate=30
+            ))
+
+        render()
+        with mock.patch.object(cache_page, 'aget_many', wraps=cache_page.aget_many) as aget_many:
+            self.assertEqual(render().content, b'page')
+        keys = [key for call in aget_many.call_args_list for key in call.args[0]]
+        self.assertEqual(len([key for key in keys if key.startswith('views.decorators.cache.cache_page.')]), 1)
+
+
+class DecoratorSetupTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+        get_cache_middleware.cache_clear()
+        self.addCleanup(get_cache_middleware.cache_clear)
+
+    def test_middleware_is_built_once(self):
+        with mock.patch.object(cache_page, 'PageCacheMiddleware', wraps=cache_page.PageCacheMiddleware) as middleware:
+            view = make_view([])
+            for _ in range(3):
+                view(self.factory.get(PATH))
+        self.assertEqual(middleware.call_count, 1)
+
+    def test_settings_are_read_when_view_is_decorated(self):
+        with mock.patch('sage_cache.settings.CACHE_TIMEOUT', 10):
+            view = make_view([])
+        with mock.patch('sage_cache.settings.CACHE_TIMEOUT', 99), \
+                mock.patch('sage_cache.settings.CACHE_PAGE_ENABLED', False):
+            response = view(self.factory.get(PATH))
+        self.assertIn('max-age=10', response['Cache-Control'])
+
+    @mock.patch('sage_cache.settings.CACHE_PAGE_ENABLED', False)
+    def test_disabled_cache_warns_once_when_view_is_decorated(self):
+        rendered = []
+        with self.assertWarns(UserWarning):
+            view = make_view(rendered)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            view(self.factory.get(PATH))
+            view(self.factory.get(PATH))
+        self.assertEqual(len(rendered), 2)
+
+    def test_timeout_func_is_imported_once(self):
+        timeout_funcs.import_timeout_func.cache_clear()
+        self.addCleanup(timeout_funcs.import_timeout_func.cache_clear)
+        with mock.patch.object(timeout_funcs, 'import_string', return_value=lambda user: 5) as import_string:
+            for _ in range(3):
+                self.assertEqual(timeout_funcs.get_timeout_for_user(None, 'app.timeouts.get_timeout'), 5)
+        import_string.assert_called_once_with('app.timeouts.get_timeout')
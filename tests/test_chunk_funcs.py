@@ -0,0 +1,135 @@
+from unittest import mock
+
+from django.core.cache import cache
+
+from sage_cache.services import chunk_funcs
+from sage_cache.services.cache_funcs import get_all_from_cache
+from sage_cache.services.chunk_funcs import ChunkedRows, dump_chunks, get_chunk_keys, update_chunks
+from sage_cache.services.key_funcs import get_keys_for_model, get_manifest_keys, make_object_key, make_site_key
+from sage_cache.services.object_funcs import get_object_from_cache
+from sage_cache.services.overlay_funcs import get_user_pks
+from sage_cache.services.stampede_funcs import acquire_lock, release_lock, wait_for_lock
+from sage_cache.services.storage_funcs import dump_rows
+from tests.base import CacheTestCase
+from tests.testapp.models import Product
+
+KEY = make_site_key(Product.CACHE_KEY)
+
+
+@mock.patch('sage_cache.settings.CACHE_CHUNK_SIZE', 3)
+class ChunkFuncsTests(CacheTestCase):
+
+    def get_rows(self):
+        """ChunkedRows of a stored chunked entry (entry is stored on the first call)"""
+        get_all_from_cache(Product, 60, set_cache_key=KEY, storage='chunked')
+        return get_all_from_cache(Product, 60, set_cache_key=KEY, storage='chunked')
+
+    def test_missing_chunk_reloads_whole_entry(self):
+        self.seed(10)
+        rows = self.get_rows()
+        self.assertIsInstance(rows, ChunkedRows)
+        cache.delete(get_chunk_keys(rows.manifest)[1])
+
+        self.assertEqual(sorted(row.pk for row in rows[:]), sorted(Product.objects.values_list('pk', flat=True)))
+        # entry is stored again once, with all its chunks
+        manifest = cache.get(KEY)
+        self.assertEqual(manifest['counts'], rows.counts)
+        self.assertEqual(len(cache.get_many(get_chunk_keys(manifest))), len(manifest['counts']))
+        with self.assertNumQueries(0):
+            self.assertEqual(len(list(get_all_from_cache(Product, 60, set_cache_key=KEY, storage='chunked'))), 10)
+
+    def test_missing_chunk_waits_for_lock_holder(self):
+        self.seed(10)
+        rows = self.get_rows()
+        cache.delete(get_chunk_keys(rows.manifest)[1])
+        token = acquire_lock(KEY)  # another reader is reloading the entry
+
+        def reload_by_holder(*args, **kwargs):
+            release_lock(KEY, token)
+            ChunkedRows(rows.manifest, model_class=Product).reload()
+            return wait_for_lock(*args, **kwargs)
+
+        with mock.patch.object(chunk_funcs, 'dump_rows', wraps=chunk_funcs.dump_rows) as dump_rows, \
+                mock.patch.object(chunk_funcs, 'wait_for_lock', side_effect=reload_by_holder):
+            self.assertEqual(len(rows[:]), 10)
+        dump_rows.assert_called_once()  # by lock holder only
+        self.assertEqual(rows.manifest, cache.get(KEY))
+
+    def test_missing_chunk_while_iterating(self):
+        self.seed(10)
+        rows = self.get_rows()
+        iterator = iter(rows)
+        first = next(iterator)
+        for chunk_key in get_chunk_keys(rows.manifest):
+            cache.delete(chunk_key)
+        pks = [first.pk] + [row.pk for row in iterator]
+        self.assertEqual(sorted(pks), sorted(Product.objects.values_list('pk', flat=True)))
+
+    def test_update_keeps_chunks_of_read_manifest(self):
+        products = self.seed(10)
+        rows = self.get_rows()
+        Product.objects.filter(pk=products[4].pk).update(title='changed')
+        update_chunks(Product.CACHE_KEY, Product, [products[4].pk])
+
+        # reader of the previous manifest still gets a consistent entry
+        self.assertEqual(len(rows[:]), 10)
+        self.assertNotIn('changed', {row.title for row in rows})
+        updated = get_all_from_cache(Product, 60, set_cache_key=KEY, storage='chunked')
+        self.assertIn('changed', {row.title for row in updated})
+
+    def test_rows_keep_queryset_order(self):
+        self.seed(10)
+        queryset = Product.objects.order_by('-price')
+        manifest, chunks = dump_chunks(KEY, dump_rows(queryset, search=False))
+        self.assertEqual(manifest['counts'], [3, 3, 3, 1])
+        cache.set_many(chunks, 60)
+
+        rows = ChunkedRows(manifest, model_class=Product)
+        expected = list(queryset.values_list('pk', flat=True))
+        self.assertEqual([row.pk for row in rows], expected)
+        self.assertEqual([row.pk for row in rows[2:7]], expected[2:7])
+        self.assertEqual([row.pk for row in rows.rows()], expected)
+
+    @mock.patch('sage_cache.settings.CACHE_STORAGE_FORMAT', 'chunked')
+    def test_saves_replace_rows_in_place(self):
+        products = self.seed(10)
+        rows = self.get_rows()
+        expected = [row.pk for row in rows]
+        version = rows.manifest['version']
+
+        products[4].title = 'changed'
+        products[4].save()
+        deleted = products[7].pk
+        products[7].delete()
+        added = Product.objects.create(title='added', category=products[0].category)
+
+        rows = get_all_from_cache(Product, 60, set_cache_key=KEY, storage='chunked')
+        self.assertEqual(rows.manifest['version'], version)  # chunks are updated, entry is not recomputed
+        expected.remove(deleted)
+        self.assertEqual([row.pk for row in rows], expected + [added.pk])
+        self.assertEqual(rows[4].title, 'changed')
+        self.assertEqual(rows.get_chunk_numbers([products[4].pk]), [1])
+        self.assertEqual(rows.get_chunk_numbers([added.pk]), [3])
+
+    @mock.patch('sage_cache.settings.CACHE_STORAGE_FORMAT', 'chunked')
+    def test_saves_only_rewrite_chunked_entries(self):
+        products = self.seed(10)
+        self.get_rows()
+        rows_key = 'product-rows'
+        get_all_from_cache(Product, 60, set_cache_key=rows_key, storage='rows')
+        get_object_from_cache(Product, products[1].pk)
+        get_object_from_cache(Product, products[4].pk)
+        get_user_pks(Product.objects.filter(price__lt=5), 'sage_cache:pks:1-product', 60, cache_key=Product.CACHE_KEY)
+        self.assertEqual(get_manifest_keys(Product.CACHE_KEY), [KEY])
+
+        products[4].title = 'changed'
+        products[4].save()
+
+        keys = set(get_keys_for_model(Product.CACHE_KEY))
+        self.assertIn(KEY, keys)
+        self.assertIsNotNone(cache.get(make_object_key(Product.CACHE_KEY, 'id', products[1].pk)))
+        self.assertIsNone(cache.get(make_object_key(Product.CACHE_KEY, 'id', products[4].pk)))
+        self.assertNotIn(rows_key, keys)
+        self.assertIsNone(cache.get(rows_key))
+        self.assertIsNone(cache.get('sage_cache:pks:1-product'))
+        self.assertEqual(get_all_from_cache(Product, 60, set_cache_key=KEY, storage='chunked')[4].title, 'changed')
@@ -0,0 +1,50 @@
+from unittest import mock
+
+from sage_cache.security.encryption import is_encrypted
+from sage_cache.services import delta_funcs
+from sage_cache.services.cache_funcs import get_all_from_cache
+from sage_cache.services.key_funcs import make_delta_key, make_site_key
+from tests.base import CacheTestCase
+from tests.test_encryption import NEW_KEY, make_cache, use_keys
+from tests.testapp.models import Event
+
+KEY = make_site_key(Event.CACHE_KEY)
+
+
+class DeltaFuncsTests(CacheTestCase):
+
+    def get_events(self):
+        return get_all_from_cache(Event, 60, set_cache_key=KEY)
+
+    def test_changes_are_applied_once(self):
+        events = [Event.objects.create(title=f'event {i}') for i in range(3)]
+        self.assertEqual(len(self.get_events()), 3)
+        events[0].title = 'changed'
+        events[0].save()
+        Event.objects.create(title='added')
+
+        with mock.patch.object(delta_funcs, 'apply_changes', wraps=delta_funcs.apply_changes) as apply_changes:
+            for _ in range(3):
+                with self.assertNumQueries(0):
+                    titles = [event.title for event in self.get_events()]
+                self.assertEqual(titles, ['changed', 'event 1', 'event 2', 'added'])
+        apply_changes.assert_called_once()
+
+    def test_rewritten_snapshot_is_not_overwritten(self):
+        Event.objects.create(title='event')
+        self.get_events()
+        Event.objects.create(title='added')
+        with mock.patch.object(delta_funcs, 'write_snapshot') as write_snapshot:
+            self.assertFalse(delta_funcs.write_back(KEY, {}, {'version': 'read before rewrite'}))
+        write_snapshot.assert_not_called()
+
+    def test_entries_are_encrypted_with_cache_serializer(self):
+        Event.objects.create(title='event')
+        self.get_events()
+        with use_keys(NEW_KEY), mock.patch.object(delta_funcs, 'cache', make_cache()):
+            Event.objects.create(title='secret')
+            _, (_, entry) = self.redis.xrange(make_delta_key(Event.CACHE_KEY))
+            self.assertTrue(is_encrypted(entry[b'data']))
+            self.assertNotIn(b'secret', entry[b'data'])
+            with self.assertNumQueries(0):
+                self.assertEqual([event.title for event in self.get_events()], ['event', 'secret'])
@@ -0,0 +1,70 @@
+import asyncio
+from unittest import mock
+
+from Crypto.PublicKey import RSA
+from django.conf import settings
+from django.test import override_settings
+from django_redis.cache import RedisCache
+
+from sage_cache.security import encryption
+from sage_cache.services.cache_funcs import aget_many
+from tests.base import CacheTestCase
+
+OLD_KEY = RSA.generate(1024)
+NEW_KEY = RSA.generate(1024)
+
+
+def make_cache():
+    """default cache with EncryptedClient and EncryptedPickleSerializer"""
+    options = dict(
+        settings.CACHES['default']['OPTIONS'],
+        CLIENT_CLASS='sage_cache.security.client.EncryptedClient',
+        SERIALIZER='sage_cache.security.serializers.EncryptedPickleSerializer',
+    )
+    return RedisCache(settings.CACHES['default']['LOCATION'], {'OPTIONS': options})
+
+
+def use_keys(key, old_keys=()):
+    """encrypt with key and decrypt with key and old_keys (new data key, no unwrapped keys)"""
+    encryption.rotate_data_key()
+    encryption._unwrapped.clear()
+    return override_settings(
+        PUBLIC_KEY=key.publickey(), PRIVATE_KEY=key, CACHE_ENCRYPTION_OLD_PRIVATE_KEYS=list(old_keys)
+    )
+
+
+class EncryptedCacheTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cache = make_cache()
+
+    def test_round_trip(self):
+        values = {'dict': {'rows': [1, 2]}, 'text': 'secret', 'number': 5, 'flag': True}
+        with use_keys(NEW_KEY):
+            self.cache.set_many(values, 60)
+            for key in values:
+                self.assertTrue(encryption.is_encrypted(self.redis.get(self.cache.make_key(key))))
+            self.assertEqual(self.cache.get_many(list(values) + ['missing']), values)
+            self.assertEqual(self.cache.get('number'), 5)
+            self.assertEqual(self.cache.incr('number'), 6)
+            self.assertEqual(self.cache.get('number'), 6)
+
+    def test_undecryptable_values_are_misses(self):
+        self.redis.set(self.cache.make_key('plain'), 5)  # e.g stored before encryption was enabled
+        with use_keys(NEW_KEY):
+            self.cache.set('encrypted', 'value', 60)
+            self.assertEqual(self.cache.get('plain', 'default'), 'default')
+            self.assertEqual(self.cache.get_many(['plain', 'encrypted']), {'encrypted': 'value'})
+            with mock.patch('sage_cache.services.cache_funcs.cache', self.cache):
+                self.assertEqual(asyncio.run(aget_many(['plain', 'encrypted'])), {'encrypted': 'value'})
+
+    def test_key_rotation(self):
+        with use_keys(OLD_KEY):
+            self.cache.set('old', 'old value', 60)
+        with use_keys(NEW_KEY, old_keys=[OLD_KEY]):
+            self.cache.set('new', 'new value', 60)
+            self.assertEqual(self.cache.get_many(['old', 'new']), {'old': 'old value', 'new': 'new value'})
+        with use_keys(NEW_KEY):  # old private key is dropped
+            self.assertEqual(self.cache.get('old', 'default'), 'default')
+            self.assertEqual(self.cache.get('new'), 'new value')
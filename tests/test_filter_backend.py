@@ -0,0 +1,79 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from rest_framework.filters import SearchFilter
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from sage_cache.filters.backend import CacheFilterBackend, CacheSearchBackend
+from sage_cache.services.cache_funcs import get_all_from_cache
+from sage_cache.services.storage_funcs import CachedRows
+from tests.base import CacheTestCase
+from tests.testapp.models import Product
+
+
+def make_request(**params):
+    return Request(APIRequestFactory().get('/', params))
+
+
+class CacheSearchBackendTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.products = self.seed(12)
+        self.rows = get_all_from_cache(Product, 60, set_cache_key='product', storage='rows')
+        self.assertIsInstance(self.rows, CachedRows)
+
+    def search(self, search_fields, term, rows=None):
+        view = SimpleNamespace(search_fields=search_fields, model_class=Product)
+        rows = self.rows if rows is None else rows
+        return CacheSearchBackend().filter_queryset(make_request(search=term), rows, view)
+
+    def test_contains_search_checks_indexed_candidates_only(self):
+        rows = get_all_from_cache(
+            Product, 60, set_cache_key='product-search', storage='rows', search_fields=['title']
+        )
+        self.assertTrue(rows.is_searchable('title'))
+        with mock.patch.object(CachedRows, 'search', autospec=True, side_effect=CachedRows.search) as search:
+            found = self.search(['title'], 'DUCT 1', rows)
+        self.assertEqual(search.call_count, 2)  # one lookup per term
+        self.assertEqual(sorted(row.title for row in found), ['product 1', 'product 10', 'product 11'])
+        self.assertEqual([row.pk for row in self.search(['title'], 'product 1 10', rows)], [self.products[10].pk])
+
+    def test_regex_prefix(self):
+        self.assertEqual([row.pk for row in self.search(['$title'], r'^PRODUCT\s[12]$')],
+                         [self.products[1].pk, self.products[2].pk])
+        self.assertEqual([row.title for row in self.search(['$title'], r'^product\s1\d')],
+                         ['product 10', 'product 11'])
+
+    def test_full_text_prefix_is_searched_in_database(self):
+        def search_in_database(backend, request, queryset, view):
+            return queryset.filter(title__in=['product 3', 'product 7'])
+
+        with mock.patch.object(SearchFilter, 'filter_queryset', search_in_database):
+            rows = self.search(['@title', 'slug'], 'any')
+        self.assertIsInstance(rows, CachedRows)
+        self.assertEqual([row.pk for row in rows], [self.products[3].pk, self.products[7].pk])
+
+
+class CacheFilterBackendTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.products = self.seed(4)
+        self.rows = get_all_from_cache(Product, 60, set_cache_key='product', storage='rows')
+
+    def filter(self, filterset_fields, **params):
+        view = SimpleNamespace(filterset_fields=filterset_fields, model_class=Product)
+        return [row.pk for row in CacheFilterBackend().filter_queryset(make_request(**params), self.rows, view)]
+
+    def test_regex_lookup(self):
+        self.assertEqual(self.filter({'title': ['regex']}, title__regex='[02]$'),
+                         [self.products[0].pk, self.products[2].pk])
+
+    def test_undeclared_lookups_are_ignored(self):
+        pks = [product.pk for product in self.products]
+        self.assertEqual(self.filter(['title'], title__regex='(a+)+$'), pks)
+        self.assertEqual(self.filter(['price'], price=2, price__gte=1), [self.products[2].pk])
+        self.assertEqual(self.filter({'price': ['gte', 'lt']}, price=2, price__gte=1, price__lt=3),
+                         [self.products[1].pk, self.products[2].pk])
@@ -0,0 +1,53 @@
+from unittest import mock
+
+from django.core.cache import cache
+
+from sage_cache.services.cache_funcs import clear_cache_for_model_async
+from sage_cache.services.invalidation_funcs import scan_and_unlink, scan_and_unlink_many, unlink_keys
+from sage_cache.services.key_funcs import make_meta_key
+from tests.base import CacheTestCase
+
+
+class ScanAndUnlinkTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.set_many({f'1-product-{i}': i for i in range(25)}, 60)
+        cache.set_many({f'2-product-{i}': i for i in range(5)}, 60)
+        cache.set('category', 1, 60)
+
+    def test_matched_keys_are_unlinked_in_batches(self):
+        pipeline = self.redis.pipeline
+        with mock.patch.object(self.redis, 'keys', side_effect=AssertionError('KEYS command')), \
+                mock.patch.object(self.redis, 'pipeline', side_effect=pipeline) as pipelines:
+            stats = scan_and_unlink('1-product-*', count=5, batch_size=10)
+
+        self.assertEqual((stats['scanned'], stats['deleted']), (25, 25))
+        self.assertGreaterEqual(pipelines.call_count, 3)
+        self.assertEqual(sorted(cache.keys('*')), [f'2-product-{i}' for i in range(5)] + ['category'])
+
+    def test_stats_of_patterns_are_merged(self):
+        stats = scan_and_unlink_many(['1-product-*', '2-product-*', 'missing-*'])
+        self.assertEqual((stats['scanned'], stats['deleted']), (30, 30))
+        self.assertEqual(cache.keys('*'), ['category'])
+
+    def test_keys_are_unlinked_without_scan(self):
+        with mock.patch.object(self.redis, 'scan_iter', side_effect=AssertionError('SCAN command')):
+            stats = unlink_keys(['category', '2-product-0', 'missing'], batch_size=2)
+        self.assertEqual((stats['scanned'], stats['deleted']), (3, 2))
+
+    def test_pattern_invalidation_runs_in_background(self):
+        stats = clear_cache_for_model_async('product', pattern='*-{}-*').result(timeout=5)
+        self.assertEqual(stats['deleted'], 30)
+        self.assertEqual(cache.keys('*'), ['category'])
+
+    @mock.patch('sage_cache.settings.CACHE_L1_ENABLED', False)
+    def test_meta_keys_are_unlinked_without_local_cache(self):
+        cache.set('product-all', [1, 2], 60)
+        cache.set(make_meta_key('product-all'), {'expires': 1}, 60)
+
+        stats = scan_and_unlink('product*')
+
+        self.assertEqual(stats['deleted'], 1)
+        self.assertIsNone(cache.get('product-all'))
+        self.assertIsNone(cache.get(make_meta_key('product-all')))
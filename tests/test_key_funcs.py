@@ -0,0 +1,79 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.cache import cache
+
+from sage_cache.services import key_funcs
+from sage_cache.services.cache_funcs import (
+    aget_many, clear_cache_for_model, clear_cache_for_users, clear_model_cache_for_user, get_all_from_cache
+)
+from sage_cache.services.key_funcs import (
+    get_async_connection_kwargs, get_keys_for_model, get_keys_for_user, make_model_index_key, make_user_key,
+    register_key
+)
+from tests.base import CacheTestCase
+from tests.testapp.models import Product
+
+
+class AsyncClientTests(CacheTestCase):
+
+    @mock.patch('sage_cache.settings.CACHE_ASYNC_CONNECTION_KWARGS', {'max_connections': 10})
+    def test_connection_kwargs_of_default_cache(self):
+        caches = {'default': {'OPTIONS': {
+            'PASSWORD': 'secret',
+            'SOCKET_TIMEOUT': 3,
+            'CONNECTION_POOL_KWARGS': {'connection_class': object, 'max_connections': 5, 'ssl_cert_reqs': 'none'},
+        }}}
+        with mock.patch.object(key_funcs, 'django_settings', SimpleNamespace(CACHES=caches)):
+            self.assertEqual(
+                get_async_connection_kwargs(),
+                {'password': 'secret', 'socket_timeout': 3, 'max_connections': 10, 'ssl_cert_reqs': 'none'}
+            )
+
+    def test_values_are_decoded_by_cache_client(self):
+        cache.set('payload', {'rows': [1, 2]})
+        cache.set('number', 5)
+        self.assertEqual(
+            asyncio.run(aget_many(['payload', 'number', 'missing'])),
+            {'payload': {'rows': [1, 2]}, 'number': 5}
+        )
+
+
+class KeyRegistryTests(CacheTestCase):
+
+    def test_cached_keys_are_registered_and_cleared_for_model(self):
+        self.seed(4)
+        get_all_from_cache(Product, 60, set_cache_key='product', cache_key='product')
+        self.assertEqual(get_keys_for_model('product'), ['product'])
+
+        with mock.patch.object(self.redis, 'keys', side_effect=AssertionError('KEYS command')):
+            stats = clear_cache_for_model('product')
+
+        self.assertEqual(stats['deleted'], 1)
+        self.assertIsNone(cache.get('product'))
+        self.assertFalse(self.redis.exists(make_model_index_key('product')))
+
+    def test_user_keys_are_cleared_for_their_user_and_model(self):
+        for user_id in (1, 2):
+            for cache_key in ('product', 'category'):
+                key = make_user_key(user_id, cache_key)
+                cache.set(key, [user_id], 60)
+                register_key(key, cache_key=cache_key, user_id=user_id, timeout=60)
+
+        clear_model_cache_for_user(SimpleNamespace(id=1), 'product')
+        self.assertEqual(get_keys_for_user(1), ['1-category'])
+        self.assertEqual(sorted(get_keys_for_model('product')), ['2-product'])
+        self.assertEqual(sorted(cache.get_many(['1-product', '1-category', '2-product'])), ['1-category', '2-product'])
+
+        clear_cache_for_users([SimpleNamespace(id=1), SimpleNamespace(id=2)])
+        self.assertEqual(cache.get_many(['1-category', '2-product', '2-category']), {})
+        self.assertEqual(get_keys_for_user(2), [])
+
+    def test_index_sets_live_as_long_as_their_keys(self):
+        register_key('product', cache_key='product', timeout=60)
+        register_key('product-new', cache_key='product', timeout=10)
+        self.assertGreater(self.redis.ttl(make_model_index_key('product')), 10)
+
+        register_key('product-forever', cache_key='product')
+        self.assertEqual(self.redis.ttl(make_model_index_key('product')), -1)
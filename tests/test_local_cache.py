@@ -0,0 +1,67 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from sage_cache.services.cache_funcs import get_entry, set_entry
+from sage_cache.services.invalidation_funcs import unlink_keys
+from sage_cache.services.key_funcs import make_meta_key
+from sage_cache.services.local_cache import LocalCache, get_local_cache
+from tests.base import CacheTestCase
+
+
+class LocalCacheTests(SimpleTestCase):
+
+    def test_entries_are_served_for_their_version(self):
+        local_cache = LocalCache()
+        local_cache.set('product', [1], 'v1')
+        self.assertEqual(local_cache.get('product', 'v1'), [1])
+        self.assertIsNone(local_cache.get('product', 'v2'))
+        self.assertNotIn('product', local_cache)
+        self.assertEqual((local_cache.hits, local_cache.misses), (1, 1))
+
+    def test_eviction_policies(self):
+        for policy, kept in (('lru', ['a', 'c']), ('fifo', ['b', 'c'])):
+            with self.subTest(policy=policy):
+                local_cache = LocalCache(max_entries=2, policy=policy)
+                local_cache.set('a', 1, 'v')
+                local_cache.set('b', 2, 'v')
+                local_cache.get('a', 'v')
+                local_cache.set('c', 3, 'v')
+                self.assertEqual(sorted(local_cache._entries), kept)
+                self.assertEqual(local_cache.stats()['evictions'], 1)
+
+    def test_size_limits_and_timeout(self):
+        local_cache = LocalCache(max_entry_bytes=10, max_bytes=15, timeout=30)
+        self.assertFalse(local_cache.set('big', 1, 'v', size=11))
+        local_cache.set('a', 1, 'v', size=10)
+        local_cache.set('b', 2, 'v', size=10)
+        self.assertEqual(local_cache.stats()['bytes'], 10)
+        self.assertNotIn('a', local_cache)
+
+        with mock.patch('sage_cache.services.local_cache.time.monotonic', return_value=float('inf')):
+            self.assertIsNone(local_cache.get('b', 'v'))
+
+
+@mock.patch('sage_cache.settings.CACHE_L1_ENABLED', True)
+class LocalEntryTests(CacheTestCase):
+
+    def test_hits_only_read_meta_from_redis(self):
+        set_entry('product', {'columns': [[1]]}, 60)
+        get_entry('product')
+
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            value, meta = get_entry('product')
+        self.assertEqual(value, {'columns': [[1]]})
+        get_many.assert_called_once_with([make_meta_key('product')])
+        self.assertEqual(get_local_cache().stats()['hits'], 1)
+
+    def test_changed_or_removed_entries_are_not_served(self):
+        set_entry('product', {'columns': [[1]]}, 60)
+        get_entry('product')
+
+        set_entry('product', {'columns': [[2]]}, 60)  # e.g written by another process
+        self.assertEqual(get_entry('product')[0], {'columns': [[2]]})
+
+        unlink_keys(['product'])
+        self.assertEqual(get_entry('product'), (None, None))
@@ -0,0 +1,131 @@
+import socket
+from unittest import mock
+
+from django.http import Http404
+from django.test import SimpleTestCase
+
+from sage_cache.services import metrics
+from sage_cache.services.cache_funcs import get_all_from_cache
+from sage_cache.services.metrics import (
+    MetricsExporter, PrometheusExporter, SignalExporter, StatsdExporter, incr, metric_recorded, metrics_view, observe
+)
+from tests.base import CacheTestCase
+from tests.testapp.models import Product
+
+
+class MetricsExporterTests(SimpleTestCase):
+
+    def test_exporter_must_implement_counter_and_histogram(self):
+        class CounterExporter(MetricsExporter):
+            def counter(self, name, cache_key, value):
+                pass
+
+        with self.assertRaises(TypeError):
+            CounterExporter()
+
+        class Exporter(CounterExporter):
+            def histogram(self, name, cache_key, value):
+                pass
+
+        self.assertIsInstance(Exporter(), MetricsExporter)
+
+    def test_prometheus_exporter(self):
+        exporter = PrometheusExporter()
+        exporter.counter('hits', 'product', 2)
+        exporter.counter('hits', 'product', 1)
+        exporter.counter('misses', 'category', 1)
+        exporter.histogram('redis_seconds', 'product', 0.003)
+        exporter.histogram('redis_seconds', 'product', 10)
+
+        self.assertEqual(exporter.get_stats('product'), {
+            'counters': {'hits': 3},
+            'histograms': {'redis_seconds': {'count': 2, 'sum': 10.003}},
+        })
+        lines = exporter.render().splitlines()
+        self.assertIn('sage_cache_hits_total{cache_key="product"} 3', lines)
+        self.assertIn('sage_cache_redis_seconds_bucket{cache_key="product",le="0.0025"} 0', lines)
+        self.assertIn('sage_cache_redis_seconds_bucket{cache_key="product",le="0.005"} 1', lines)
+        self.assertIn('sage_cache_redis_seconds_bucket{cache_key="product",le="5"} 1', lines)
+        self.assertIn('sage_cache_redis_seconds_bucket{cache_key="product",le="+Inf"} 2', lines)
+        self.assertIn('sage_cache_redis_seconds_count{cache_key="product"} 2', lines)
+
+        exporter.counter('hits', 'a"b', 1)
+        self.assertIn('sage_cache_hits_total{cache_key="a\\"b"} 1', exporter.render().splitlines())
+        exporter.reset()
+        self.assertEqual(exporter.render(), '\n')
+
+    def test_statsd_exporter(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        exporter = StatsdExporter(host='127.0.0.1', port=server.getsockname()[1], prefix='app')
+        self.addCleanup(exporter.socket.close)
+
+        exporter.counter('hits', 'user:1|product', 1)
+        exporter.histogram('redis_seconds', 'product', 0.0012)
+        exporter.histogram('payload_bytes', 'product', 2048)
+        self.assertEqual(
+            [server.recv(512) for _ in range(3)],
+            [b'app.hits.user_1_product:1|c', b'app.redis_seconds.product:1.2|ms', b'app.payload_bytes.product:2048|h']
+        )
+
+    def test_signal_exporter(self):
+        received = []
+
+        def receiver(sender, **kwargs):
+            received.append(kwargs)
+
+        def failing_receiver(sender, **kwargs):
+            raise ValueError
+
+        metric_recorded.connect(receiver)
+        metric_recorded.connect(failing_receiver)
+        self.addCleanup(metric_recorded.disconnect, receiver)
+        self.addCleanup(metric_recorded.disconnect, failing_receiver)
+
+        with self.assertLogs('sage_cache.services.metrics', 'ERROR'):
+            SignalExporter().counter('hits', 'product', 1)
+        self.assertEqual(
+            [(kwargs['name'], kwargs['kind'], kwargs['cache_key'], kwargs['value']) for kwargs in received],
+            [('hits', 'counter', 'product', 1)]
+        )
+
+
+class RecordedMetricsTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        metrics._build_exporters.cache_clear()
+        self.addCleanup(metrics._build_exporters.cache_clear)
+        for name, value in (
+            ('CACHE_METRICS_ENABLED', True),
+            ('CACHE_METRICS_EXPORTERS', ['sage_cache.services.metrics.PrometheusExporter']),
+        ):
+            patcher = mock.patch(f'sage_cache.settings.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_cache_lookups_are_recorded_per_cache_key(self):
+        self.seed(3)
+        for _ in range(3):
+            get_all_from_cache(Product, 60, set_cache_key='product')
+
+        stats = Product.get_cache_metrics()
+        self.assertEqual(stats['counters'], {'hits': 2, 'misses': 1})
+        self.assertEqual(stats['histograms']['redis_seconds']['count'], 3)
+        self.assertEqual(stats['histograms']['recompute_seconds']['count'], 1)
+        self.assertIn(b'sage_cache_hits_total{cache_key="product"} 2', metrics_view(None).content)
+
+    def test_nothing_is_recorded_when_disabled(self):
+        with mock.patch('sage_cache.settings.CACHE_METRICS_ENABLED', False), \
+                mock.patch.object(metrics, 'get_exporters') as get_exporters:
+            incr('hits', 'product')
+            observe('redis_seconds', 'product', 1)
+            self.assertIs(metrics.timer('redis_seconds', 'product'), metrics.NULL_TIMER)
+        get_exporters.assert_not_called()
+
+    @mock.patch('sage_cache.settings.CACHE_METRICS_EXPORTERS', [])
+    def test_scrape_endpoint_needs_prometheus_exporter(self):
+        with self.assertRaises(Http404):
+            metrics_view(None)
@@ -0,0 +1,39 @@
+from unittest import mock
+
+from sage_cache.services.storage_funcs import CachedRows
+from tests.base import CacheTestCase
+from tests.testapp.models import Product
+
+
+class ModelCacheMixinTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for patcher in (
+            mock.patch('sage_cache.settings.CACHE_STORAGE_FORMAT', 'rows'),
+            mock.patch.object(Product, 'CACHE_INDEXED_FIELDS', ['price', 'category__title'], create=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.products = self.seed(6)
+        Product.get_all_from_cache()
+
+    def test_filter_uses_hash_indexes(self):
+        with mock.patch.object(CachedRows, 'filter_indexed', autospec=True,
+                               side_effect=CachedRows.filter_indexed) as filter_indexed:
+            with self.assertNumQueries(0):
+                products = Product.filter_from_cache(price=(1, 4))
+        filter_indexed.assert_called_once()
+        self.assertEqual([product.pk for product in products], [self.products[1].pk, self.products[4].pk])
+
+    def test_filter_related_uses_hash_indexes(self):
+        with mock.patch.object(CachedRows, 'filter_indexed', autospec=True,
+                               side_effect=CachedRows.filter_indexed) as filter_indexed:
+            with self.assertNumQueries(0):
+                products = Product.filter_related_from_cache(category={'title': 'first'})
+        filter_indexed.assert_called_once()
+        self.assertEqual([product.pk for product in products], [product.pk for product in self.products[1::2]])
+
+    def test_filter_instances(self):
+        products = Product.filter_related_from_cache(self.products, category={'title': ['second']})
+        self.assertEqual(products, self.products[::2])
@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+
+from sage_cache.services.key_funcs import get_keys_for_model, is_object_key, make_object_key
+from sage_cache.services.object_funcs import get_object_from_cache
+from sage_cache.services.view_funcs import get_object
+from tests.base import CacheTestCase
+from tests.testapp.models import Product
+
+
+def make_view(lookup_field, value):
+    return SimpleNamespace(
+        lookup_url_kwarg=None,
+        lookup_field=lookup_field,
+        kwargs={lookup_field: value},
+        model_class=Product,
+        queryset=Product.objects.all(),
+    )
+
+
+class ObjectFuncsTests(CacheTestCase):
+
+    def test_only_lookup_fields_are_cached(self):
+        self.seed(4)
+        with self.assertRaises(ImproperlyConfigured):
+            get_object_from_cache(Product, 'product-1', field='slug')
+
+    def test_get_object_filters_other_lookup_fields(self):
+        products = self.seed(4)
+        self.assertEqual(get_object(make_view('slug', 'product-3')), products[3])
+        self.assertEqual([key for key in get_keys_for_model(Product.CACHE_KEY) if is_object_key(key)], [])
+
+        self.assertEqual(get_object(make_view('pk', str(products[2].pk))), products[2])
+        self.assertEqual(
+            [key for key in get_keys_for_model(Product.CACHE_KEY) if is_object_key(key)],
+            [make_object_key(Product.CACHE_KEY, 'id', products[2].pk)]
+        )
+
+    @mock.patch('sage_cache.settings.CACHE_STORAGE_FORMAT', 'chunked')
+    @mock.patch.object(Product, 'CACHE_OBJECT_LOOKUP_FIELDS', ['pk', 'slug'], create=True)
+    def test_saves_remove_keys_of_all_lookup_fields(self):
+        products = self.seed(4)
+        self.assertEqual(get_object(make_view('slug', 'product-3')).title, 'product 3')
+        products[3].title = 'changed'
+        products[3].save()
+        self.assertIsNone(cache.get(make_object_key(Product.CACHE_KEY, 'slug', 'product-3')))
+        self.assertEqual(get_object(make_view('slug', 'product-3')).title, 'changed')
@@ -0,0 +1,84 @@
+import uuid
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from sage_cache.services.cache_funcs import clear_cache_for_model
+from sage_cache.services.key_funcs import make_overlay_key
+from sage_cache.services.overlay_funcs import (
+    ARRAY, BITMAP, PICKLE, Bitmap, clear_overlays, decode_pks, encode_pks, get_overlay_from_cache
+)
+from sage_cache.services.storage_funcs import CachedRows
+from tests.base import CacheTestCase
+from tests.testapp.models import Product
+
+
+class EncodePksTests(SimpleTestCase):
+
+    def test_bitmap(self):
+        bitmap = Bitmap.from_pks([0, 3, 9, 16])
+        self.assertEqual(bitmap.bits, bytes([0b1001, 0b10, 0b1]))
+        self.assertEqual(list(bitmap), [0, 3, 9, 16])
+        self.assertEqual(len(bitmap), 4)
+        self.assertIn(9, bitmap)
+        for pk in (1, 17, 1000, -1, '3', 3.0):
+            self.assertNotIn(pk, bitmap)
+        self.assertEqual(len(Bitmap.from_pks([])), 0)
+
+    def test_pks_are_encoded_in_smallest_format(self):
+        cases = (
+            (range(1, 100), BITMAP),  # dense
+            ([5, 10 ** 9], ARRAY),  # sparse
+            ([-1, 2], ARRAY),
+            ([uuid.UUID(int=1), uuid.UUID(int=2)], PICKLE),
+            (['a', 'b'], PICKLE),
+            ([], PICKLE),
+        )
+        for pks, kind in cases:
+            with self.subTest(pks=pks):
+                value = encode_pks(pks)
+                self.assertEqual(value[:1], kind)
+                self.assertEqual(set(decode_pks(value)), set(pks))
+        self.assertEqual(len(encode_pks(range(1, 10001))), 1 + 1251)  # kind byte and bits of pks 0..10000
+
+
+class OverlayTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.products = self.seed(6)
+        self.first_category = Product.objects.filter(category__title='first')
+
+    def get(self, user_id, user_queryset):
+        return get_overlay_from_cache(
+            Product, 60, user_queryset=user_queryset, user_id=user_id, cache_key='product', storage='rows'
+        )
+
+    def test_users_share_table_and_cache_visible_pks(self):
+        rows, pks = self.get(1, self.first_category)
+        self.assertIsInstance(rows, CachedRows)
+        self.assertEqual([row.pk for row in rows], [self.products[i].pk for i in (1, 3, 5)])
+        self.assertEqual(set(pks), {row.pk for row in rows})
+
+        with self.assertNumQueries(0):
+            rows, _ = self.get(1, self.first_category)
+        self.assertEqual(len(rows), 3)
+
+        with self.assertNumQueries(1):  # pks of second user only
+            rows, _ = self.get(2, Product.objects.filter(price__lt=2))
+        self.assertEqual([row.pk for row in rows], [self.products[0].pk, self.products[1].pk])
+
+        rows, pks = self.get(3, None)
+        self.assertEqual((len(rows), pks), (6, None))
+
+    def test_overlays_are_cleared_with_model(self):
+        self.get(1, self.first_category)
+        self.get(2, self.first_category)
+        self.assertEqual(clear_overlays('product')['deleted'], 2)
+        with self.assertNumQueries(1):  # pks of user, table is kept
+            self.get(1, self.first_category)
+
+        clear_cache_for_model('product')
+        self.assertIsNone(cache.get(make_overlay_key(1, 'product')))
+        with self.assertNumQueries(2):  # table and pks of user
+            self.get(1, self.first_category)
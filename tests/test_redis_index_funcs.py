@@ -0,0 +1,62 @@
+from unittest import mock
+
+from sage_cache.services import redis_index_funcs
+from sage_cache.services.key_funcs import make_field_index_key
+from sage_cache.services.redis_index_funcs import (
+    build_redis_index,
+    filter_pks,
+    get_generation,
+    update_redis_index,
+)
+from tests.base import CacheTestCase
+from tests.testapp.models import Product
+
+
+class RedisIndexFuncsTests(CacheTestCase):
+
+    def test_filter_pks(self):
+        products = self.seed(10)
+        self.assertEqual(build_redis_index(Product)['rows'], 10)
+        self.assertEqual(
+            filter_pks(Product, category=products[1].category_id, price__lt=5),
+            {products[1].pk, products[3].pk}
+        )
+        self.assertEqual(filter_pks(Product, price__range=(7, 8)), {products[7].pk, products[8].pk})
+
+    def test_index_keys_expire(self):
+        self.seed(4)
+        build_redis_index(Product)
+        generation = get_generation(Product)
+        self.assertGreater(self.redis.ttl(make_field_index_key(Product.CACHE_KEY, 'built')), 0)
+        self.assertGreater(self.redis.ttl(make_field_index_key(Product.CACHE_KEY, generation, 'all')), 0)
+
+    def test_cold_index_is_built_in_background(self):
+        self.seed(4)
+        with mock.patch.object(redis_index_funcs, 'schedule_refresh') as schedule_refresh:
+            self.assertIsNone(filter_pks(Product, price=1))
+        schedule_refresh.assert_called_once()
+        self.assertIsNone(get_generation(Product))
+
+    def test_saves_during_rebuild_are_kept(self):
+        products = self.seed(10)
+        build_redis_index(Product)
+        previous = get_generation(Product)
+        index_row = redis_index_funcs._index_row
+        saved = []
+
+        def save_while_building(*args, **kwargs):
+            if not saved:
+                # rows are already read from database, previous generation still serves queries
+                saved.append(products[9].pk)
+                Product.objects.filter(pk=products[9].pk).update(price=100)
+                update_redis_index(Product, [products[9].pk])
+                self.assertEqual(filter_pks(Product, price=100), {products[9].pk})
+            return index_row(*args, **kwargs)
+
+        with mock.patch.object(redis_index_funcs, '_index_row', save_while_building):
+            build_redis_index(Product)
+
+        self.assertNotEqual(get_generation(Product), previous)
+        self.assertEqual(filter_pks(Product, price=100), {products[9].pk})
+        self.assertEqual(filter_pks(Product, price=9), set())
+        self.assertLessEqual(self.redis.ttl(make_field_index_key(Product.CACHE_KEY, previous, 'all')), 60)
@@ -0,0 +1,79 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import transaction
+
+from sage_cache.services.cache_funcs import get_all_from_cache
+from sage_cache.signals import get_dependent_cache_keys
+from tests.base import CacheTestCase
+from tests.testapp.models import Category, Product
+
+
+class InvalidationTests(CacheTestCase):
+
+    def test_related_model_changes_clear_dependent_caches(self):
+        self.assertEqual(get_dependent_cache_keys(Category), {'category', 'product'})
+        category = self.seed(2)[0].category
+        get_all_from_cache(Product, 60, set_cache_key='product', cache_key='product')
+        self.assertIsNotNone(cache.get('product'))
+
+        category.title = 'renamed'
+        category.save()
+        self.assertIsNone(cache.get('product'))
+
+
+class PendingBatchTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('sage_cache.signals.clear_cache_for_model')
+        self.clear = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cleared(self):
+        return sorted(call.args[0] for call in self.clear.call_args_list)
+
+    def test_writes_outside_transactions_are_invalidated_immediately(self):
+        Category.objects.create(title='first')
+        self.assertEqual(self.cleared(), ['category', 'product'])
+
+    def test_writes_of_transaction_are_invalidated_once_on_commit(self):
+        with transaction.atomic():
+            for i in range(5):
+                Category.objects.create(title=f'category {i}')
+            self.assertEqual(self.cleared(), [])
+
+        self.assertEqual(self.cleared(), ['category', 'product'])
+
+    def test_rolled_back_transaction_is_not_invalidated(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            Category.objects.create(title='first')
+            raise ValueError
+        self.assertEqual(self.cleared(), [])
+
+    def test_rolled_back_savepoint_keeps_batch_of_transaction(self):
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    Category.objects.create(title='first')
+                    raise ValueError
+            except ValueError:
+                pass
+            Category.objects.create(title='second')
+            self.assertEqual(self.cleared(), [])
+
+        self.assertEqual(self.cleared(), ['category', 'product'])
+
+    def test_rolled_back_transaction_does_not_hold_next_batch(self):
+        @transaction.atomic
+        def create(title, fail=False):
+            Category.objects.create(title=title)
+            if fail:
+                raise ValueError
+
+        with self.assertRaises(ValueError):
+            create('first', fail=True)
+        self.assertEqual(self.cleared(), [])
+
+        create('second')
+        self.assertEqual(self.cleared(), ['category', 'product'])
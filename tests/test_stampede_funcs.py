@@ -0,0 +1,48 @@
+from unittest import mock
+
+from sage_cache.services.stampede_funcs import acquire_lock, recompute, release_lock
+from tests.base import CacheTestCase
+
+
+class RecomputeTests(CacheTestCase):
+
+    def recompute(self, read, **kwargs):
+        compute = mock.Mock(return_value='computed')
+        store = mock.Mock()
+        value = recompute('key', compute, store, read=read, lock=True, wait_timeout=0.5, **kwargs)
+        return value, compute
+
+    def test_waiter_reads_value_of_lock_holder(self):
+        acquire_lock('key')
+        reads = iter([None, None, 'stored'])
+        value, compute = self.recompute(lambda: next(reads))
+        self.assertEqual(value, 'stored')
+        compute.assert_not_called()
+
+    def test_waiter_takes_over_released_lock(self):
+        token = acquire_lock('key')
+        reads = []
+
+        def read():
+            reads.append(None)
+            if len(reads) == 2:
+                release_lock('key', token)  # lock holder failed
+            return None
+
+        value, compute = self.recompute(read)
+        self.assertEqual(value, 'computed')
+        compute.assert_called_once()
+        self.assertIsNotNone(acquire_lock('key'))  # lock is released after recompute
+
+    def test_waiter_never_recomputes_without_lock(self):
+        acquire_lock('key')
+        compute = mock.Mock()
+        with self.assertRaises(TimeoutError):
+            recompute('key', compute, mock.Mock(), read=lambda: None, lock=True, wait_timeout=0.2)
+        compute.assert_not_called()
+
+    def test_stale_value_is_served_while_locked(self):
+        acquire_lock('key')
+        value, compute = self.recompute(lambda: None, stale='stale')
+        self.assertEqual(value, 'stale')
+        compute.assert_not_called()
@@ -0,0 +1,90 @@
+import datetime
+import decimal
+import uuid
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+
+from sage_cache.services.storage_funcs import (
+    CachedRows, build_search_index, decode, dump_queryset, encode, is_encoded, load_queryset, make_ngrams, search_index
+)
+from tests.base import CacheTestCase
+from tests.testapp.models import Product
+
+VALUE = {
+    'columns': [[1, 2], ['a', None]],
+    'datetime': datetime.datetime(2021, 7, 27, 10, 30, tzinfo=datetime.timezone.utc),
+    'date': datetime.date(2021, 7, 27),
+    'time': datetime.time(10, 30),
+    'decimal': decimal.Decimal('1.50'),
+    'uuid': uuid.UUID(int=1),
+    'timedelta': datetime.timedelta(days=1, seconds=2, microseconds=3),
+}
+
+
+class CodecTests(SimpleTestCase):
+
+    def test_round_trip(self):
+        for encoding in ('pickle', 'msgpack'):
+            for compression in (None, 'zlib'):
+                with self.subTest(encoding=encoding, compression=compression):
+                    data = encode(VALUE, encoding=encoding, compression=compression)
+                    self.assertTrue(is_encoded(data))
+                    self.assertEqual(decode(data), VALUE)
+
+    def test_compressed_payload_is_smaller(self):
+        value = {'columns': [['product'] * 1000]}
+        self.assertLess(
+            len(encode(value, encoding='msgpack', compression='zlib')),
+            len(encode(value, encoding='msgpack', compression=None))
+        )
+
+    def test_unknown_options(self):
+        with self.assertRaises(ImproperlyConfigured):
+            encode(VALUE, encoding='json')
+        with self.assertRaises(ImproperlyConfigured):
+            encode(VALUE, compression='gzip')
+        self.assertFalse(is_encoded(b'plain pickle'))
+
+
+class SearchIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        self.index = build_search_index(['Red Apple', 'green apple', None, 'Pear', 'pale red'])
+
+    def test_ngrams(self):
+        self.assertEqual(make_ngrams('Pear'), {'pea', 'ear'})
+        self.assertEqual(make_ngrams('ab'), {'ab'})
+        self.assertEqual(self.index['app'], [0, 1])
+
+    def test_candidates_contain_all_ngrams_of_term(self):
+        self.assertEqual(search_index(self.index, 'APPLE'), {0, 1})
+        self.assertEqual(search_index(self.index, 'red'), {0, 4})
+        self.assertEqual(search_index(self.index, 'grape'), set())
+
+    def test_short_terms_use_ngrams_containing_them(self):
+        self.assertEqual(search_index(self.index, 'RE'), {0, 1, 4})
+        self.assertEqual(search_index(self.index, 'ea'), {3})
+
+    def test_candidates_may_contain_ngrams_apart(self):
+        index = build_search_index(['abcxbcd', 'abcd'])
+        self.assertEqual(search_index(index, 'abcd'), {0, 1})  # verified by the lookup
+
+
+class QuerysetPayloadTests(CacheTestCase):
+
+    def test_rows_are_loaded_as_instances_with_related_objects(self):
+        products = self.seed(4)
+        data = dump_queryset(Product.objects.order_by('pk'), encoding='msgpack')
+
+        with self.assertNumQueries(0):
+            rows = load_queryset(data)
+            self.assertIsInstance(rows, CachedRows)
+            self.assertEqual(len(rows), 4)
+            self.assertEqual(rows.column('price'), [0, 1, 2, 3])
+            self.assertEqual(
+                [(obj.pk, obj.title, obj.category.title) for obj in rows],
+                [(obj.pk, obj.title, obj.category.title) for obj in products]
+            )
+            self.assertIs(rows[1], rows[1])
+            self.assertEqual([obj.pk for obj in rows[1:3]], [products[1].pk, products[2].pk])
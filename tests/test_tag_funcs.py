@@ -0,0 +1,82 @@
+from unittest import mock
+
+from django.core.cache import cache
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+from sage_cache.decorators.cache_page import cache_page_per_site
+from sage_cache.services.key_funcs import make_tag_index_key
+from sage_cache.services.tag_funcs import get_pages_for_tag, invalidate_tags, make_tag, make_tags
+from tests.base import CacheTestCase
+from tests.testapp.models import Category, Product
+
+
+def make_view(rendered, tags):
+    class View(APIView):
+        @cache_page_per_site(tags=tags)
+        def get(self, request, pk):
+            rendered.append(pk)
+            return Response({'pk': pk})
+
+    view = View.as_view()
+    return lambda request, pk: view(request, pk=pk).render()
+
+
+@mock.patch('sage_cache.settings.CACHE_TIMEOUT', 60)
+class PageTagTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.factory = APIRequestFactory()
+        self.product = self.seed(2)[1]
+        self.rendered = []
+        self.view = make_view(self.rendered, lambda view, request, pk: [Category, Product(pk=pk)])
+
+    def get(self, pk):
+        return self.view(self.factory.get(f'/products/{pk}/'), pk)
+
+    def test_tag_names(self):
+        self.assertEqual(make_tag(Product), 'testapp.product')
+        self.assertEqual(make_tag(self.product), f'testapp.product:{self.product.pk}')
+        self.assertEqual(make_tag(Product, 5), 'testapp.product:5')
+        self.assertEqual(make_tags(['menu', Product, 'menu']), ['menu', 'testapp.product'])
+
+    def test_tagged_pages_are_deleted(self):
+        self.get(1)
+        self.get(2)
+        self.get(1)
+        self.assertEqual(self.rendered, [1, 2])
+        self.assertEqual(len(get_pages_for_tag(Category)), 2)
+        self.assertGreaterEqual(self.redis.ttl(make_tag_index_key(make_tag(Category))), 60)
+
+        stats = invalidate_tags([Product(pk=1)])
+        self.assertEqual(stats['deleted'], 1)
+        self.assertEqual(get_pages_for_tag(Product(pk=1)), [])
+
+        self.get(1)
+        self.get(2)
+        self.assertEqual(self.rendered, [1, 2, 1])
+
+    def test_saves_delete_pages_of_model_and_instance(self):
+        self.get(self.product.pk)
+        self.get(0)
+
+        self.product.save()  # page of the instance
+        self.assertEqual(get_pages_for_tag(self.product), [])
+        self.get(self.product.pk)
+        self.get(0)
+        self.assertEqual(self.rendered, [self.product.pk, 0, self.product.pk])
+
+        self.product.category.save()  # pages of the model
+        self.get(0)
+        self.assertEqual(self.rendered, [self.product.pk, 0, self.product.pk, 0])
+
+    @mock.patch('sage_cache.settings.CACHE_PAGE_TAG_AUTO_INVALIDATE', False)
+    def test_auto_invalidation_can_be_disabled(self):
+        self.get(0)
+        self.product.save()
+        self.product.category.save()
+        self.get(0)
+        self.assertEqual(self.rendered, [0])
+        self.assertEqual(len(cache.keys('views.decorators.cache.cache_page.*')), 1)
@@ -0,0 +1,101 @@
+import math
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from sage_cache.services import timeout_funcs
+from sage_cache.services.cache_funcs import clear_cache_for_model, get_all_from_cache
+from sage_cache.services.timeout_funcs import AdaptiveTimeoutPolicy, adaptive_timeout, get_timeout_policy
+from tests.base import CacheTestCase
+from tests.testapp.models import Product
+
+NOW = 1000.0
+
+
+@mock.patch('sage_cache.settings.CACHE_TIMEOUT', 60)
+@mock.patch('sage_cache.settings.CACHE_TIMEOUT_JITTER', 0)
+@mock.patch('sage_cache.settings.CACHE_ADAPTIVE_MIN_TIMEOUT', 5)
+@mock.patch('sage_cache.settings.CACHE_ADAPTIVE_MAX_TIMEOUT', 3600)
+@mock.patch('sage_cache.services.timeout_funcs.time.time', return_value=NOW)
+class AdaptiveTimeoutPolicyTests(SimpleTestCase):
+
+    def make_policy(self, hits, **kwargs):
+        policy = AdaptiveTimeoutPolicy(window=300, **kwargs)
+        for _ in range(hits):
+            policy.record_hit('product')
+        return policy
+
+    def test_unknown_keys_get_base_timeout(self, time):
+        self.assertEqual(AdaptiveTimeoutPolicy(window=300).get_timeout('product'), 60)
+
+    def test_timeout_follows_expected_hits(self, time):
+        self.assertEqual(self.make_policy(1).get_timeout('product'), 12)  # 0.2 expected hits
+        self.assertEqual(self.make_policy(300).get_timeout('product'), int(60 * (1 + math.log2(60))))
+        self.assertEqual(self.make_policy(300).get_timeout('product', base=1000), 3600)  # max timeout
+
+    def test_cost_and_size_weights(self, time):
+        policy = self.make_policy(5)  # one expected hit
+        policy.record_recompute('product', 0.2)
+        self.assertEqual(policy.get_timeout('product'), 120)
+        policy = self.make_policy(5)
+        policy.record_recompute('product', 0.05, size=1024 * 1024)
+        self.assertEqual(policy.get_timeout('product'), 30)
+
+    def test_invalidated_keys_live_twice_their_invalidation_interval(self, time):
+        policy = self.make_policy(300)
+        for _ in range(30):
+            policy.record_hit('product', {'expires_at': NOW + 60})
+            policy.record_miss('product')
+        self.assertAlmostEqual(policy.get_stats('product')['invalidation_rate'], 0.1)
+        self.assertEqual(policy.get_timeout('product'), 20)
+
+        policy.record_hit('product', {'expires_at': NOW - 1})
+        policy.record_miss('product')  # expired
+        policy.record_hit('product', {'expires_at': NOW + 60})
+        policy.record_miss('product', missing=False)  # recomputed early
+        self.assertAlmostEqual(policy.get_stats('product')['invalidation_rate'], 0.1)
+
+    def test_counters_decay(self, time):
+        policy = self.make_policy(300)
+        time.return_value = NOW + 300
+        self.assertAlmostEqual(policy.get_stats('product')['request_rate'], 1 / math.e)
+
+    def test_least_recently_used_keys_are_dropped(self, time):
+        policy = AdaptiveTimeoutPolicy(window=300, max_keys=2)
+        for key in ('a', 'b', 'a', 'c'):
+            policy.record_hit(key)
+        self.assertIsNone(policy.get_stats('b'))
+        self.assertIsNotNone(policy.get_stats('a'))
+
+    def test_jitter(self, time):
+        policy = AdaptiveTimeoutPolicy(window=300)
+        with mock.patch('sage_cache.settings.CACHE_TIMEOUT_JITTER', 0.1):
+            timeouts = {policy.get_timeout('product', base=1000) for _ in range(50)}
+        self.assertTrue(all(900 <= timeout <= 1100 for timeout in timeouts))
+        self.assertGreater(len(timeouts), 1)
+
+
+@mock.patch('sage_cache.settings.CACHE_TIMEOUT', 60)
+@mock.patch('sage_cache.settings.CACHE_ADAPTIVE_TIMEOUT', True)
+class AdaptiveTimeoutTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(timeout_funcs, '_policy', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cache_lookups_are_recorded(self):
+        self.seed(3)
+        for _ in range(3):
+            get_all_from_cache(Product, 60, set_cache_key='product')
+        clear_cache_for_model('product')  # invalidated before its expiry
+        get_all_from_cache(Product, 60, set_cache_key='product')
+
+        stats = get_timeout_policy().get_stats('product')
+        self.assertAlmostEqual(stats['request_rate'] * 300, 4, places=3)
+        self.assertAlmostEqual(stats['invalidation_rate'] * 300, 1, places=3)
+        self.assertIsNotNone(stats['cost'])
+
+        with mock.patch('sage_cache.settings.CACHE_TIMEOUT_JITTER', 0):
+            self.assertEqual(adaptive_timeout(key='missing'), 60)
@@ -0,0 +1,53 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from sage_cache.services.cache_funcs import clear_cache_for_users, get_all_from_cache
+from sage_cache.services.key_funcs import drop_user_index, get_keys_for_user, make_site_key, make_user_key
+from sage_cache.services.object_funcs import get_object_from_cache
+from sage_cache.services.warm_funcs import get_warm_keys, refresh_expiring, warm_model
+from tests.base import CacheTestCase
+from tests.testapp.models import Product
+
+
+class WarmFuncsTests(CacheTestCase):
+
+    def test_object_keys_are_not_warmed(self):
+        products = self.seed()
+        self.assertEqual(get_object_from_cache(Product, products[3].pk), products[3])
+
+        self.assertEqual(get_warm_keys(Product), [make_site_key(Product.CACHE_KEY)])
+        for storage in ('queryset', 'rows'):
+            warm_model(Product, storage=storage)
+            refresh_expiring([Product], within=60, storage=storage)
+            self.assertEqual(get_object_from_cache(Product, products[3].pk).title, products[3].title)
+
+    def test_warm_model_fills_site_key(self):
+        self.seed(4)
+        stats = warm_model(Product, storage='rows')
+        self.assertEqual(stats['keys'], 1)
+        self.assertFalse(stats['skipped'])
+        rows = get_all_from_cache(Product, 60, set_cache_key=make_site_key(Product.CACHE_KEY), storage='rows')
+        self.assertEqual(len(rows), 4)
+
+    @mock.patch('sage_cache.settings.CACHE_PER_USER_TIMEOUT_FUNC',
+                lambda user: 300 if user.is_authenticated else 200)
+    def test_per_user_keys_keep_timeout_and_user_index(self):
+        self.seed(4)
+        user = User.objects.create(username='user')
+        user_key = make_user_key(user.id, Product.CACHE_KEY)
+        anonymous_key = make_user_key(None, Product.CACHE_KEY)
+        get_all_from_cache(Product, 300, set_cache_key=user_key, user_id=user.id)
+        get_all_from_cache(Product, 200, set_cache_key=anonymous_key)
+        drop_user_index(user.id)
+
+        warm_model(Product)
+        self.assertGreater(cache.ttl(user_key), 200)
+        self.assertLessEqual(cache.ttl(anonymous_key), 200)
+        self.assertLessEqual(cache.ttl(make_site_key(Product.CACHE_KEY)), 60)
+        self.assertEqual(get_keys_for_user(user.id), [user_key])
+
+        clear_cache_for_users([user])
+        self.assertIsNone(cache.get(user_key))
+        self.assertIsNotNone(cache.get(anonymous_key))
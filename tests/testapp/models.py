@@ -0,0 +1,27 @@
+from django.db import models
+
+from sage_cache.mixins.model_cache import ModelCacheMixin
+
+
+class Category(models.Model, ModelCacheMixin):
+    CACHE_KEY = 'category'
+
+    title = models.CharField(max_length=64)
+
+
+class Product(models.Model, ModelCacheMixin):
+    CACHE_KEY = 'product'
+    CACHED_RELATED_OBJECT = ['category']
+    CACHE_REDIS_INDEXED_FIELDS = ['category', 'price']
+
+    title = models.CharField(max_length=128)
+    slug = models.SlugField(max_length=128, blank=True)
+    price = models.IntegerField(default=0)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+
+
+class Event(models.Model, ModelCacheMixin):
+    CACHE_KEY = 'event'
+    CACHE_DELTA_LOG = True
+
+    title = models.CharField(max_length=128)